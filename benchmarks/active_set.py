@@ -0,0 +1,102 @@
+# This code benchmarks the active-set mode of linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares LinearLMESparseModel with and without active_set on problems with a growing number of candidate
+fixed features p, of which only a dozen have non-zero coefficients.
+
+For every p it reports the time of one outer iteration (optimal β, the Newton solve for 𝛄, tβ, t𝛄, and the loss)
+on the full problem and on the reduced problem of the working set which the active-set fit ended up with,
+and the times, the numbers of outer iterations, and the supports of tβ of the two fits.
+
+Usage::
+
+    python benchmarks/active_set.py [--groups 50] [--group-size 100] [--oracle-mode cholesky]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from skmixed.lme.models import LinearLMESparseModel, _minimize_gamma_newton, _working_set
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def outer_iteration(oracle, beta, gamma, tbeta, tgamma):
+    beta = oracle.optimal_beta(gamma, tbeta, beta=beta)
+    gamma, _ = _minimize_gamma_newton(oracle, beta, gamma, tbeta, tgamma)
+    tbeta = oracle.optimal_tbeta(beta=beta, gamma=gamma)
+    tgamma = oracle.optimal_tgamma(tbeta, gamma, beta=beta)
+    return oracle.loss(beta, gamma, tbeta, tgamma)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--group-size", type=int, default=100)
+    parser.add_argument("--oracle-mode", default="cholesky")
+    args = parser.parse_args()
+
+    print("%d groups of %d rows, '%s' mode, 5 random effects" % (args.groups, args.group_size, args.oracle_mode))
+    print("%6s %10s %14s %14s %20s %20s %10s" % ("p", "working", "iteration, s", "reduced it., s",
+                                                  "fit: s (iterations)", "active: s (it.)", "same tβ"))
+    for num_features in (50, 200, 500):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[args.group_size] * args.groups,
+                                               features_labels=[3] * 4 + [1] * (num_features - 4),
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               beta=np.r_[np.linspace(1, 0.1, 12), np.zeros(num_features - 11)],
+                                               gamma=np.r_[np.ones(3), np.zeros(2)],
+                                               seed=0)
+        x, y = problem.to_x_y()
+        times = {}
+        iterations = {}
+        models = {}
+        for active_set in (False, True):
+            model = LinearLMESparseModel(lb=100, lg=100, nnz_tbeta=5, nnz_tgamma=3, n_iter=100, tol=1e-6,
+                                         solver="newton", oracle_mode=args.oracle_mode, active_set=active_set)
+            times[active_set] = timed(model.fit, x, y)
+            iterations[active_set] = model.logger_.get("iterations")
+            models[active_set] = model
+
+        coefficients = models[True].coef_
+        beta, gamma = coefficients["beta"], coefficients["gamma"]
+        tbeta, tgamma = coefficients["tbeta"], coefficients["tgamma"]
+        full_oracle = models[True]._make_oracle(problem)
+        fixed_idx, random_idx = _working_set(full_oracle, beta, gamma, tbeta)
+        reduced_oracle = models[True]._make_reduced_oracle(full_oracle, fixed_idx, random_idx)
+        iteration_time = timed(outer_iteration, full_oracle, beta, gamma, tbeta, tgamma)
+        reduced_iteration_time = timed(outer_iteration, reduced_oracle, beta[fixed_idx], gamma[random_idx],
+                                       tbeta[fixed_idx], tgamma[random_idx])
+        full_oracle.close()
+        reduced_oracle.close()
+
+        same_support = np.array_equal(models[False].coef_["tbeta"] != 0, tbeta != 0)
+        print("%6d %10d %14.3f %14.3f" % (num_features, len(fixed_idx) + len(random_idx), iteration_time,
+                                          reduced_iteration_time)
+              + "".join("%14.2f (%4d)" % (times[key], iterations[key]) for key in (False, True))
+              + "%10s" % same_support)
+
+
+if __name__ == "__main__":
+    main()
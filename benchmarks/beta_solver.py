@@ -0,0 +1,79 @@
+# This code benchmarks the solvers for the optimal fixed effects of linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares LinearLMEOracleRegularized.optimal_beta with beta_solver='direct' and beta_solver='cg' on problems
+with a growing number of fixed effects p.
+
+For every p it times a cold solve (cg starts from zeros) and a warm solve (cg starts from a β perturbed by 1e-3,
+as in the outer iterations of LinearLMESparseModel), and reports the numbers of conjugate gradients iterations
+and the largest difference between the solutions. The factors of Ω_i are computed before timing.
+
+Usage::
+
+    python benchmarks/beta_solver.py [--groups 50] [--group-size 100] [--oracle-mode woodbury]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from skmixed.lme.oracles import LinearLMEOracleRegularized
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--group-size", type=int, default=100)
+    parser.add_argument("--oracle-mode", default="woodbury")
+    args = parser.parse_args()
+
+    print("%d groups of %d rows, '%s' mode, 3 random effects" % (args.groups, args.group_size, args.oracle_mode))
+    print("%6s %10s %10s %12s %10s %12s %14s" % ("p", "direct, s", "cg, s", "iterations", "warm, s", "iterations",
+                                                 "max difference"))
+    for num_features in (250, 500, 1000):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[args.group_size] * args.groups,
+                                                             features_labels=[3] * 2 + [1] * (num_features - 2),
+                                                             random_intercept=True,
+                                                             obs_std=0.3,
+                                                             seed=0)
+        gamma = true_parameters["gamma"]
+        tbeta = np.zeros(problem.num_fixed_effects)
+        direct_oracle = LinearLMEOracleRegularized(problem, lb=1, mode=args.oracle_mode)
+        cg_oracle = LinearLMEOracleRegularized(problem, lb=1, mode=args.oracle_mode, beta_solver="cg")
+        for oracle in (direct_oracle, cg_oracle):
+            oracle.loss(true_parameters["beta"], gamma, tbeta, gamma)
+        direct_time, direct_beta = timed(direct_oracle.optimal_beta, gamma, tbeta)
+        cg_time, cg_beta = timed(cg_oracle.optimal_beta, gamma, tbeta, beta=np.zeros(problem.num_fixed_effects))
+        cold_iterations = cg_oracle.cg_iterations
+        perturbation = 1e-3 * np.random.RandomState(0).randn(problem.num_fixed_effects)
+        warm_time, warm_beta = timed(cg_oracle.optimal_beta, gamma, tbeta, beta=direct_beta + perturbation)
+        warm_iterations = cg_oracle.cg_iterations - cold_iterations
+        difference = max(np.max(np.abs(cg_beta - direct_beta)), np.max(np.abs(warm_beta - direct_beta)))
+        print("%6d %10.3f %10.3f %12d %10.3f %12d %14.2e" % (num_features, direct_time, cg_time, cold_iterations,
+                                                             warm_time, warm_iterations, difference))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# This code benchmarks the loss-weighted regularization of linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares the fit time of LinearLMESparseModel with regularization_type='loss-weighted' to the one with 'l2',
+and measures the time of one computation of the drop penalties which the loss-weighted regularization uses,
+for a growing number of groups G.
+
+The two regularizations follow different paths and may stop after different numbers of outer iterations
+(at most --iterations, tol = 0), so the times per outer iteration are reported as well.
+
+Usage::
+
+    python benchmarks/drop_penalties.py [--features 8] [--iterations 10] [--oracle-mode cholesky]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.oracles import LinearLMEOracle
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--oracle-mode", default="cholesky")
+    args = parser.parse_args()
+
+    np.random.seed(42)
+    features_labels = [3] * (args.features // 2) + [1] * (args.features - args.features // 2 - 1) + [2]
+    print("%d features, %d outer iterations, '%s' mode" % (args.features, args.iterations, args.oracle_mode))
+    print("%6s %22s %22s %18s" % ("G", "l2: s (iterations)", "loss-weighted: s (it.)", "drop penalties, s"))
+    for num_groups in (50, 200, 1000):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=np.random.randint(5, 30, num_groups),
+                                                             features_labels=features_labels,
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=0)
+        x, y = problem.to_x_y()
+        times = {}
+        iterations = {}
+        for regularization_type in ("l2", "loss-weighted"):
+            model = LinearLMESparseModel(lb=1, lg=1, nnz_tbeta=problem.num_fixed_effects,
+                                         nnz_tgamma=problem.num_random_effects, tol=0, n_iter=args.iterations,
+                                         n_iter_inner=5, regularization_type=regularization_type,
+                                         oracle_mode=args.oracle_mode)
+            times[regularization_type] = timed(model.fit, x, y)
+            iterations[regularization_type] = model.logger_.get("iterations")
+        oracle = LinearLMEOracle(problem, mode=args.oracle_mode)
+        beta, gamma = true_parameters["beta"], true_parameters["gamma"]
+        oracle._drop_penalties(beta, gamma)
+        repeats = 5
+        drop_time = timed(lambda: [oracle._drop_penalties(beta, gamma) for _ in range(repeats)]) / repeats
+        print("%6d" % num_groups
+              + "".join("%15.2f (%4d)" % (times[key], iterations[key]) for key in ("l2", "loss-weighted"))
+              + "%18.4f" % drop_time)
+        print("%6s" % "per it"
+              + "".join("%15.3f %6s" % (times[key] / iterations[key], "") for key in ("l2", "loss-weighted")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# This code benchmarks the generators of synthetic linear mixed-effects problems.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares the time of LinearLMEProblem.generate, which draws every group separately, with
+LinearLMEProblem.generate_batched in its "memory" and "disk" modes, for a growing number of groups.
+
+LinearLMEProblem.generate is skipped when the number of groups exceeds --max-groups-loop.
+
+Usage::
+
+    python benchmarks/generation.py [--group-size 10] [--max-groups-loop 100000]
+"""
+
+import argparse
+import tempfile
+import time
+
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--group-size", type=int, default=10)
+    parser.add_argument("--max-groups-loop", type=int, default=100000)
+    args = parser.parse_args()
+
+    parameters = {"features_labels": [3, 3, 1, 2],
+                  "random_intercept": True,
+                  "obs_std": 0.1}
+    print("groups of %d objects" % args.group_size)
+    print("%8s %12s %12s %12s" % ("G", "generate, s", "batched, s", "disk, s"))
+    for num_groups in (1000, 10000, 100000, 1000000):
+        groups_sizes = [args.group_size] * num_groups
+        if num_groups <= args.max_groups_loop:
+            loop_time = "%12.2f" % timed(LinearLMEProblem.generate, groups_sizes=groups_sizes, seed=42, **parameters)
+        else:
+            loop_time = "%12s" % "skipped"
+        batched_time = timed(LinearLMEProblem.generate_batched, groups_sizes, random_state=42, **parameters)
+        with tempfile.TemporaryDirectory() as path:
+            disk_time = timed(LinearLMEProblem.generate_batched, groups_sizes, random_state=42, mode="disk",
+                              path=path, **parameters)
+        print("%8d %s %12.2f %12.2f" % (num_groups, loop_time, batched_time, disk_time))
+
+
+if __name__ == "__main__":
+    main()
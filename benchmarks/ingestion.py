@@ -0,0 +1,80 @@
+# This code benchmarks the conversion of raw data to linear mixed-effects problems.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measures how the time of LinearLMEProblem.from_x_y scales with the number of groups G
+for a fixed number of objects, for the input which is sorted by groups and for a shuffled one.
+
+For comparison, it also times the grouping by one boolean mask per group, which from_x_y used before
+(O(G*m) instead of O(m*log(m))). It is skipped when it would take too long.
+
+Usage::
+
+    python benchmarks/ingestion.py [--objects 1000000] [--features 5]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def masked_grouping(x, group_labels_idx):
+    order_of_objects = []
+    for label in np.unique(x[:, group_labels_idx]):
+        objects_idx = x[:, group_labels_idx] == label
+        order_of_objects.append(np.where(objects_idx)[0])
+        x[objects_idx]
+    return order_of_objects
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=1000000)
+    parser.add_argument("--features", type=int, default=5)
+    parser.add_argument("--max-masked-work", type=float, default=2e9,
+                        help="skip the masked grouping when G*objects exceeds this")
+    args = parser.parse_args()
+
+    np.random.seed(42)
+    columns_labels = [0] + [3] * args.features + [4]
+    print("%d objects, %d features" % (args.objects, args.features))
+    print("%8s %12s %12s %12s" % ("G", "sorted, s", "shuffled, s", "masked, s"))
+    for num_groups in (10, 100, 1000, 10000, 50000):
+        x = np.random.rand(args.objects, len(columns_labels))
+        x[:, 0] = np.sort(np.random.randint(num_groups, size=args.objects))
+        y = np.random.rand(args.objects)
+        sorted_time = timed(LinearLMEProblem.from_x_y, x, y, columns_labels)
+        permutation = np.random.permutation(args.objects)
+        shuffled_x = x[permutation]
+        shuffled_time = timed(LinearLMEProblem.from_x_y, shuffled_x, y[permutation], columns_labels)
+        if num_groups * args.objects <= args.max_masked_work:
+            masked_time = "%12.2f" % timed(masked_grouping, shuffled_x, 0)
+        else:
+            masked_time = "%12s" % "skipped"
+        print("%8d %12.2f %12.2f %s" % (num_groups, sorted_time, shuffled_time, masked_time))
+
+
+if __name__ == "__main__":
+    main()
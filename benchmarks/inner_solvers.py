@@ -0,0 +1,121 @@
+# This code benchmarks the solvers of linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares the solvers of LinearLMESparseModel for the inner problem (min w.r.t. 𝛄): 'pgd', 'newton', and 'lbfgsb'.
+
+For every solver it reports the total number of inner iterations, the numbers of oracle calls by kind,
+the wall time, and the final loss, summed over the fits of the problems which the tests generate (seeds 0..trials-1).
+Fits which fail with a LinAlgError are counted separately and excluded from the sums.
+
+Usage::
+
+    python benchmarks/inner_solvers.py [--trials 10] [--regularization l2]
+"""
+
+import argparse
+import time
+from collections import Counter
+
+import numpy as np
+
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.problems import LinearLMEProblem
+
+oracle_methods = ("loss", "value_and_grad", "value_grad_hess", "gradient_gamma", "hessian_gamma")
+
+
+class CountingModel(LinearLMESparseModel):
+    """
+    LinearLMESparseModel which counts the calls of the methods of its oracle.
+    """
+
+    def _make_oracle(self, problem):
+        oracle = super()._make_oracle(problem)
+        for name in oracle_methods:
+            setattr(oracle, name, counted(getattr(oracle, name), name, self.calls_))
+        return oracle
+
+
+def counted(method, name, counter):
+    def wrapper(*args, **kwargs):
+        counter[name] += 1
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--regularization", default="l2", choices=("l2", "loss-weighted"))
+    args = parser.parse_args()
+
+    problem_parameters = {
+        "groups_sizes": [20, 5, 10, 50],
+        "features_labels": [3, 3, 3],
+        "random_intercept": True,
+        "features_covariance_matrix": np.array([
+            [1, 0, 0],
+            [0, 1, 0.7],
+            [0, 0.7, 1]
+        ]),
+        "obs_std": 0.1,
+    }
+    model_parameters = {
+        "nnz_tbeta": 2,
+        "nnz_tgamma": 2,
+        "lb": 1,
+        "lg": 1,
+        "regularization_type": args.regularization,
+        "logger_keys": ("inner_iteration",),
+        "tol": 1e-6,
+        "n_iter": 1000,
+        "tol_inner": 1e-4,
+        "n_iter_inner": 1000,
+    }
+    print("%d problems, %s regularization" % (args.trials, args.regularization))
+    print("%8s %8s" % ("solver", "inner") + "".join("%16s" % name for name in oracle_methods)
+          + "%10s %12s %8s" % ("time, s", "sum of loss", "failed"))
+    for solver in ("pgd", "newton", "lbfgsb"):
+        calls = Counter()
+        inner_iterations = 0
+        elapsed = 0
+        total_loss = 0
+        failed = 0
+        for seed in range(args.trials):
+            problem, _ = LinearLMEProblem.generate(**problem_parameters, seed=seed)
+            x, y = problem.to_x_y()
+            model = CountingModel(solver=solver, **model_parameters)
+            model.calls_ = Counter()
+            start = time.perf_counter()
+            try:
+                model.fit(x, y)
+            except np.linalg.LinAlgError:
+                failed += 1
+                continue
+            elapsed += time.perf_counter() - start
+            calls.update(model.calls_)
+            inner_iterations += sum(model.logger_.get("inner_iteration"))
+            coefficients = model.coef_
+            total_loss += model._make_oracle(LinearLMEProblem.from_x_y(x, y)[0]).loss(
+                coefficients["beta"], coefficients["gamma"], coefficients["tbeta"], coefficients["tgamma"])
+        print("%8s %8d" % (solver, inner_iterations) + "".join("%16d" % calls[name] for name in oracle_methods)
+              + "%10.2f %12.4f %8d" % (elapsed, total_loss, failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# This code benchmarks the line search of the projected gradient descent solver.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measures the cost of the line search of the 'pgd' solver of LinearLMESparseModel
+for different numbers of trial steps which are evaluated in one oracle call (line_search_batch_size).
+
+For every batch size and group size it reports the number of line searches, the mean number of loss
+evaluations per search (as logged under 'line_search_evaluations'), the number of oracle calls which
+the searches made (one per evaluation for the batch size 1, and the calls of losses otherwise),
+the wall time of the fits, and the final loss, summed over the problems with seeds 0..trials-1.
+
+Usage::
+
+    python benchmarks/line_search.py [--trials 5] [--groups 100] [--oracle-mode cholesky]
+"""
+
+import argparse
+import time
+from collections import Counter
+
+import numpy as np
+
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.problems import LinearLMEProblem
+
+
+class CountingModel(LinearLMESparseModel):
+    """
+    LinearLMESparseModel which counts the calls of the method 'losses' of its oracle.
+    """
+
+    def _make_oracle(self, problem):
+        oracle = super()._make_oracle(problem)
+        oracle.losses = counted(oracle.losses, "losses", self.calls_)
+        return oracle
+
+
+def counted(method, name, counter):
+    def wrapper(*args, **kwargs):
+        counter[name] += 1
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--oracle-mode", default="cholesky")
+    args = parser.parse_args()
+
+    print("%d problems of %d groups, '%s' mode" % (args.trials, args.groups, args.oracle_mode))
+    print("%6s %6s %9s %13s %8s %10s %12s" % ("size", "batch", "searches", "evals/search", "calls", "time, s",
+                                              "sum of loss"))
+    for group_size in (5, 20, 100):
+        for batch_size in (1, 2, 4, 8):
+            calls = 0
+            evaluations = []
+            elapsed = 0
+            total_loss = 0
+            for seed in range(args.trials):
+                problem, _ = LinearLMEProblem.generate(groups_sizes=[group_size] * args.groups,
+                                                       features_labels=[3, 3, 3, 1],
+                                                       random_intercept=True,
+                                                       obs_std=0.1,
+                                                       seed=seed)
+                x, y = problem.to_x_y()
+                model = CountingModel(nnz_tbeta=3, nnz_tgamma=2, lb=1, lg=1, n_iter=100, n_iter_inner=20,
+                                      oracle_mode=args.oracle_mode, line_search_batch_size=batch_size,
+                                      logger_keys=("line_search_evaluations",))
+                model.calls_ = Counter()
+                start = time.perf_counter()
+                model.fit(x, y)
+                elapsed += time.perf_counter() - start
+                fit_evaluations = sum(model.logger_.get("line_search_evaluations"), [])
+                calls += sum(fit_evaluations) if batch_size == 1 else model.calls_["losses"]
+                evaluations += fit_evaluations
+                coefficients = model.coef_
+                total_loss += model._make_oracle(LinearLMEProblem.from_x_y(x, y)[0]).loss(
+                    coefficients["beta"], coefficients["gamma"], coefficients["tbeta"], coefficients["tgamma"])
+            print("%6d %6d %9d %13.2f %8d %10.2f %12.4f" % (group_size, batch_size, len(evaluations),
+                                                            np.mean(evaluations), calls,
+                                                            elapsed, total_loss))
+
+
+if __name__ == "__main__":
+    main()
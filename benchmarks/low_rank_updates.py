@@ -0,0 +1,84 @@
+# This code benchmarks the low-rank updates of the Cholesky factors of linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares LinearLMESparseModel fits in 'cholesky' mode with and without max_low_rank_updates on problems
+with groups of a growing size n_i and few random effects. A rank-one update of the factors takes O(n_i²) flops
+and a new factorization O(n_i³), but the update makes several memory-bound passes over n_i×n_i arrays while
+the factorization runs in blocked LAPACK routines, so the updates pay off only for large groups.
+
+For every n_i it reports the fit times, the number of low-rank updates in the last run of consecutive updates,
+and the largest difference between the coefficients of the two fits.
+
+Usage::
+
+    python benchmarks/low_rank_updates.py [--groups 10] [--max-low-rank-updates 20] [--solver pgd]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--max-low-rank-updates", type=int, default=20)
+    parser.add_argument("--solver", default="pgd")
+    args = parser.parse_args()
+
+    print("%d groups, 3 random effects, max_low_rank_updates = %d, '%s' solver" % (args.groups,
+                                                                                  args.max_low_rank_updates,
+                                                                                  args.solver))
+    print("%8s %12s %12s %10s %16s" % ("n_i", "default, s", "updates, s", "updates", "max difference"))
+    for group_size in (100, 300, 600):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[group_size] * args.groups,
+                                               features_labels=[3, 3, 1, 1],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=0)
+        x, y = problem.to_x_y()
+        times = []
+        models = []
+        oracles = []
+        for max_low_rank_updates in (0, args.max_low_rank_updates):
+            model = LinearLMESparseModel(nnz_tbeta=3, nnz_tgamma=2, lb=1, lg=1, tol=1e-6, n_iter=1000,
+                                         solver=args.solver, max_low_rank_updates=max_low_rank_updates)
+            # keep the oracle of the fit to look at its counters
+            make_oracle = model._make_oracle
+            model._make_oracle = lambda problem, make_oracle=make_oracle: oracles.append(make_oracle(problem)) \
+                or oracles[-1]
+            elapsed, _ = timed(model.fit, x, y)
+            times.append(elapsed)
+            models.append(model)
+        difference = max(np.max(np.abs(models[0].coef_[key] - models[1].coef_[key]))
+                         for key in ("beta", "gamma", "tbeta", "tgamma"))
+        print("%8d %12.2f %12.2f %10d %16.2e" % (group_size, times[0], times[1], oracles[-1].low_rank_updates,
+                                                 difference))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# This code benchmarks the memory footprint of linear mixed-effects oracles.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares the memory footprint of the storage modes of LinearLMEOracle.
+
+For every mode it reports the memory occupied by the factors which the oracle keeps between the calls,
+and the peak memory allocated during one evaluation of the loss, its gradient, and the optimal β.
+
+Usage::
+
+    python benchmarks/oracle_memory.py [--groups 8] [--group-size 1000]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from skmixed.lme.oracles import LinearLMEOracle
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def measure(problem, mode, beta, gamma):
+    oracle = LinearLMEOracle(problem, mode=mode, cache_max_bytes=0)
+    tracemalloc.start()
+    start = time.perf_counter()
+    oracle.loss(beta, gamma)
+    oracle.gradient_gamma(beta, gamma)
+    oracle.optimal_beta(gamma)
+    elapsed = time.perf_counter() - start
+    stored, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return stored, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=8)
+    parser.add_argument("--group-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[args.group_size] * args.groups,
+                                                         features_labels=[3, 3, 1, 2],
+                                                         random_intercept=True,
+                                                         obs_std=0.1,
+                                                         seed=42)
+    beta = true_parameters["beta"]
+    gamma = true_parameters["gamma"]
+    print("%d groups of %d observations" % (args.groups, args.group_size))
+    print("%10s %14s %14s %10s" % ("mode", "stored, MB", "peak, MB", "time, s"))
+    for mode in ("cholesky", "packed"):
+        stored, peak, elapsed = measure(problem, mode, beta, gamma)
+        print("%10s %14.1f %14.1f %10.2f" % (mode, stored / 2 ** 20, peak / 2 ** 20, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# This code benchmarks predictions of linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measures the time of LinearLMESparseModel.predict on a shuffled batch of rows for a growing number of groups.
+
+The model is fitted on a few objects per group with a few iterations only: the time of prediction does not depend
+on the quality of the fit.
+
+Usage::
+
+    python benchmarks/prediction.py [--objects 1000000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=1000000)
+    args = parser.parse_args()
+
+    print("%d objects" % args.objects)
+    print("%8s %12s" % ("G", "predict, s"))
+    for num_groups in (100, 10000, 100000):
+        parameters = {"features_labels": [3, 3, 1], "random_intercept": True, "random_state": 42}
+        train_problem, _ = LinearLMEProblem.generate_batched([5] * num_groups, **parameters)
+        x, y = train_problem.to_x_y()
+        model = LinearLMESparseModel(nnz_tbeta=3, nnz_tgamma=3, lb=0, lg=0, n_iter=1, n_iter_inner=1)
+        model.fit(x, y)
+        test_problem, _ = LinearLMEProblem.generate_batched([args.objects // num_groups] * num_groups, **parameters)
+        x, _ = test_problem.to_x_y()
+        x = np.concatenate((x[:1], x[1:][np.random.default_rng(42).permutation(x.shape[0] - 1)]))
+        start = time.perf_counter()
+        model.predict(x)
+        print("%8d %12.2f" % (num_groups, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# This code benchmarks the estimation of random effects of linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measures the time of LinearLMEOracle.optimal_random_effects for groups of 1000 rows
+and a growing number of groups G, in 'cholesky' and 'woodbury' modes.
+
+For comparison, it also times the per-group loop which optimal_random_effects used before: it multiplied
+Z_i^T by a dense n_i×n_i matrix diag(1/stds) and solved the k×k systems one by one.
+
+Usage::
+
+    python benchmarks/random_effects.py [--group-size 1000] [--features 6]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from skmixed.lme.oracles import LinearLMEOracle
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def dense_random_effects(problem, beta, gamma):
+    random_effects = []
+    for x, y, z, stds in problem:
+        xi = y - x.dot(beta)
+        stds_inv_mat = np.diag(1 / stds)
+        mask = np.abs(gamma) > 1e-10
+        z_masked = z[:, mask]
+        u_nonzero = np.linalg.solve(np.diag(1 / gamma[mask]) + z_masked.T.dot(stds_inv_mat).dot(z_masked),
+                                    z_masked.T.dot(stds_inv_mat).dot(xi))
+        u = np.zeros(len(gamma))
+        u[mask] = u_nonzero
+        random_effects.append(u)
+    return np.array(random_effects)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--group-size", type=int, default=1000)
+    parser.add_argument("--features", type=int, default=6)
+    args = parser.parse_args()
+
+    print("groups of %d rows, %d features" % (args.group_size, args.features))
+    print("%6s %12s %12s %12s %14s" % ("G", "dense, s", "cholesky, s", "woodbury, s", "max difference"))
+    for num_groups in (10, 50, 200):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[args.group_size] * num_groups,
+                                                             features_labels=[3] * args.features,
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=0)
+        beta, gamma = true_parameters["beta"], true_parameters["gamma"]
+        dense_time, dense_effects = timed(dense_random_effects, problem, beta, gamma)
+        times = []
+        difference = 0
+        for mode in ("cholesky", "woodbury"):
+            oracle = LinearLMEOracle(problem, mode=mode)
+            elapsed, random_effects = timed(oracle.optimal_random_effects, beta, gamma)
+            times.append(elapsed)
+            difference = max(difference, np.max(np.abs(random_effects - dense_effects)))
+        print("%6d %12.3f %12.3f %12.3f %14.2e" % (num_groups, dense_time, times[0], times[1], difference))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# This code benchmarks the screening of columns of linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares LinearLMESparseModel with and without screening_size on problems with a growing number of candidate
+fixed features p, of which only a dozen have non-zero coefficients.
+
+For every p it reports the fit times, the fraction of the columns which were screened out, the number of re-fits
+which the check after the fit required, whether tβ has the same support, and the loss of both solutions
+on the full problem.
+
+Usage::
+
+    python benchmarks/screening.py [--groups 50] [--group-size 100] [--screening-size 20] [--oracle-mode cholesky]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--group-size", type=int, default=100)
+    parser.add_argument("--screening-size", type=int, default=20)
+    parser.add_argument("--oracle-mode", default="cholesky")
+    args = parser.parse_args()
+
+    print("%d groups of %d rows, screening_size = %d, '%s' mode" % (args.groups, args.group_size,
+                                                                    args.screening_size, args.oracle_mode))
+    print("%6s %10s %12s %10s %8s %10s %12s %14s" % ("p", "fit, s", "screened, s", "fraction", "refits", "same tβ",
+                                                     "loss", "screened loss"))
+    for num_features in (200, 500, 1000):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[args.group_size] * args.groups,
+                                               features_labels=[3] * 6 + [1] * (num_features - 6),
+                                               random_intercept=True,
+                                               obs_std=0.3,
+                                               beta=np.r_[np.linspace(1, 0.1, 12), np.zeros(num_features - 11)],
+                                               gamma=np.r_[np.ones(3), np.zeros(4)],
+                                               seed=0)
+        x, y = problem.to_x_y()
+        times = {}
+        losses = {}
+        models = {}
+        for screening_size in (None, args.screening_size):
+            model = LinearLMESparseModel(lb=1, lg=1, nnz_tbeta=5, nnz_tgamma=3, n_iter=100, tol=1e-6,
+                                         oracle_mode=args.oracle_mode, screening_size=screening_size)
+            times[screening_size] = timed(model.fit, x, y)
+            oracle = model._make_oracle(problem)
+            coefficients = model.coef_
+            losses[screening_size] = oracle.loss(coefficients["beta"], coefficients["gamma"], coefficients["tbeta"],
+                                                 coefficients["tgamma"])
+            oracle.close()
+            models[screening_size] = model
+
+        screened_model = models[args.screening_size]
+        same_support = np.array_equal(models[None].coef_["tbeta"] != 0, screened_model.coef_["tbeta"] != 0)
+        print("%6d %10.2f %12.2f %10.2f %8d %10s %12.2f %14.2f" % (num_features, times[None],
+                                                                   times[args.screening_size],
+                                                                   screened_model.logger_.get("screened_fraction"),
+                                                                   screened_model.logger_.get("screening_refits"),
+                                                                   same_support, losses[None],
+                                                                   losses[args.screening_size]))
+
+
+if __name__ == "__main__":
+    main()
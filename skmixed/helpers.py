@@ -46,21 +46,20 @@ def get_per_group_coefficients(beta, us, labels):
 
     per_group_coefficients = np.zeros((num_studies, len(labels)))
 
-    for i, u in enumerate(us):
-        fixed_effects_counter = 0
-        random_effects_counter = 0
-
-        for j, label in enumerate(labels):
-            if label == 1:
-                per_group_coefficients[i, j] = beta[fixed_effects_counter]
-                fixed_effects_counter += 1
-            elif label == 2:
-                per_group_coefficients[i, j] = u[random_effects_counter]
-                random_effects_counter += 1
-            elif label == 3:
-                per_group_coefficients[i, j] = beta[fixed_effects_counter] + u[random_effects_counter]
-                fixed_effects_counter += 1
-                random_effects_counter += 1
-            else:
-                continue
+    # the columns are filled for all groups at once
+    fixed_effects_counter = 0
+    random_effects_counter = 0
+    for j, label in enumerate(labels):
+        if label == 1:
+            per_group_coefficients[:, j] = beta[fixed_effects_counter]
+            fixed_effects_counter += 1
+        elif label == 2:
+            per_group_coefficients[:, j] = us[:, random_effects_counter]
+            random_effects_counter += 1
+        elif label == 3:
+            per_group_coefficients[:, j] = beta[fixed_effects_counter] + us[:, random_effects_counter]
+            fixed_effects_counter += 1
+            random_effects_counter += 1
+        else:
+            continue
     return per_group_coefficients
@@ -0,0 +1,136 @@
+# This code implements line search routines for the solvers of linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Line search along a descent direction.
+
+The routines work with the restriction of the loss to the search ray, φ(t) = ℒ(𝛄 + t*d), and never evaluate
+φ(0): the caller passes the value and the slope φ'(0) = ∇ℒ(𝛄)^T*d which it has already computed together
+with the gradient.
+"""
+
+from typing import Callable
+
+import numpy as np
+
+
+def armijo_backtracking(function: Callable,
+                        value: float,
+                        slope: float,
+                        step_len: float = 1.0,
+                        c1: float = 1e-4,
+                        min_decrease: float = 0.0,
+                        min_step_len: float = 1e-15,
+                        batch_function: Callable = None,
+                        batch_size: int = 1):
+    """
+    Finds a step length t which satisfies the Armijo condition φ(t) <= φ(0) + c1*t*φ'(0) - min_decrease.
+
+    The positive min_decrease makes the search give up as soon as the linear model promises less than that,
+    t*|φ'(0)| < min_decrease, instead of shrinking the step down to min_step_len: it is a stopping criterion
+    for the methods which call the search.
+
+    After a rejected trial the next one is the minimizer of the quadratic interpolant of φ(0), φ'(0), and φ(t),
+    or of the cubic one which also uses the previous trial, safeguarded to lie in [0.1*t, 0.5*t].
+
+    If batch_function is given and batch_size > 1, then every round evaluates batch_size candidates
+    t, t/2, t/4, ... in one call, takes the largest one which satisfies the condition, and otherwise continues
+    from the interpolated minimizer below the smallest candidate. It pays off when evaluating several
+    candidates together is much cheaper than evaluating them one by one, see LinearLMEOracle.losses.
+
+    Parameters
+    ----------
+    function : Callable
+        φ(t), takes a step length and returns the value of the loss at this step.
+    value : float
+        φ(0), the value at the current point.
+    slope : float
+        φ'(0), the directional derivative at the current point. Should be negative.
+    step_len : float, default = 1.0
+        The first trial step length.
+    c1 : float, default = 1e-4
+        The parameter of the sufficient decrease condition.
+    min_decrease : float, default = 0.0
+        The absolute decrease which is required on top of the Armijo condition.
+    min_step_len : float, default = 1e-15
+        The search fails when the trial step length drops below this value.
+    batch_function : Callable, Optional
+        Takes an array of step lengths and returns an array of the values of the loss at these steps.
+    batch_size : int, default = 1
+        Number of candidates which are evaluated by one call of batch_function.
+
+    Returns
+    -------
+    step_len : float
+        The accepted step length, or 0 if the search failed.
+    new_value : float
+        φ(step_len), or φ(0) if the search failed.
+    evaluations : int
+        How many values of φ were computed. Every candidate of a batch counts as one evaluation.
+    calls : int
+        How many times function or batch_function was called.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size should be at least 1, got %d" % batch_size)
+    if slope >= 0:
+        return 0, value, 0, 0
+
+    use_batches = batch_function is not None and batch_size > 1
+    evaluations = 0
+    calls = 0
+    prev_step_len, prev_value = None, None
+    while step_len >= min_step_len and -slope * step_len >= min_decrease:
+        if use_batches:
+            steps = step_len * 0.5 ** np.arange(batch_size)
+            values = np.asarray(batch_function(steps), dtype=float)
+            evaluations += batch_size
+            calls += 1
+            accepted = np.flatnonzero(values <= value + c1 * steps * slope - min_decrease)
+            if len(accepted) > 0:
+                return steps[accepted[0]], values[accepted[0]], evaluations, calls
+            prev_step_len, prev_value = steps[-2], values[-2]
+            step_len, new_value = steps[-1], values[-1]
+        else:
+            new_value = function(step_len)
+            evaluations += 1
+            calls += 1
+            if new_value <= value + c1 * step_len * slope - min_decrease:
+                return step_len, new_value, evaluations, calls
+        next_step_len = _interpolate(value, slope, step_len, new_value, prev_step_len, prev_value)
+        if not np.isfinite(next_step_len):
+            next_step_len = 0.5 * step_len
+        prev_step_len, prev_value = step_len, new_value
+        step_len = min(max(next_step_len, 0.1 * step_len), 0.5 * step_len)
+    return 0, value, evaluations, calls
+
+
+def _interpolate(value, slope, step_len, new_value, prev_step_len=None, prev_value=None):
+    """
+    Returns the minimizer of the quadratic interpolant of φ(0), φ'(0), φ(t), or, if the previous trial is given,
+    of the cubic interpolant of φ(0), φ'(0), φ(t), and φ(t_prev). See Nocedal & Wright, Numerical Optimization,
+    section 3.5. Returns NaN when the interpolant has no minimizer.
+    """
+    with np.errstate(all="ignore"):
+        excess = new_value - value - slope * step_len
+        if prev_step_len is None or not np.isfinite(prev_value):
+            return -slope * step_len ** 2 / (2 * excess)
+        prev_excess = prev_value - value - slope * prev_step_len
+        denominator = step_len ** 2 * prev_step_len ** 2 * (step_len - prev_step_len)
+        a = (prev_step_len ** 2 * excess - step_len ** 2 * prev_excess) / denominator
+        b = (-prev_step_len ** 3 * excess + step_len ** 3 * prev_excess) / denominator
+        if a == 0:
+            return -slope / (2 * b)
+        return (-b + np.sqrt(b ** 2 - 3 * a * slope)) / (3 * a)
@@ -0,0 +1,302 @@
+# This code implements model selection routines for linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+from sklearn.base import BaseEstimator, RegressorMixin, clone
+from sklearn.utils.validation import check_is_fitted
+
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.problems import LinearLMEProblem
+
+
+def sparsity_path(model: LinearLMESparseModel,
+                  x: np.ndarray,
+                  y: np.ndarray,
+                  columns_labels: np.ndarray = None,
+                  nnz_tbeta: List[int] = None,
+                  nnz_tgamma: List[int] = None,
+                  random_intercept: bool = True,
+                  n_processes: int = 1):
+    """
+    Fits the model for every combination of the sparsity levels nnz_tbeta and nnz_tgamma.
+
+    The problem is built only once. The path consists of branches, one per value of nnz_tbeta, which go over
+    the values of nnz_tgamma from the largest to the smallest. All points of a branch share one oracle,
+    and every point is warm-started from the solution at the previous one, so the factorizations cached
+    by the oracle and the proximity of the solutions are both reused. The first point of every branch
+    starts from the same initial point as LinearLMESparseModel.fit.
+
+    Parameters
+    ----------
+    model : LinearLMESparseModel
+        A model with the hyperparameters to use. Its nnz_tbeta and nnz_tgamma are ignored, and it is not fitted.
+    x : np.ndarray
+        Data, see LinearLMESparseModel.fit.
+    y : np.ndarray
+        Answers.
+    columns_labels : np.ndarray, Optional
+        Labels of the columns of x, see LinearLMESparseModel.fit.
+    nnz_tbeta : List[int], Optional
+        Numbers of non-zero fixed effects to try. If None then all from the number of fixed effects down to 1.
+    nnz_tgamma : List[int], Optional
+        Numbers of non-zero random effects to try. If None then all from the number of random effects down to 1.
+    random_intercept : bool, default = True
+        Whether to treat the intercept as a random effect.
+    n_processes : int, default = 1
+        Number of processes which the branches are distributed between.
+
+    Returns
+    -------
+    path : dict
+        Dict of arrays with one element (or row) per point of the path, in the order of the branches:
+
+            - "nnz_tbeta", "nnz_tgamma" : sparsity levels.
+            - "beta", "gamma", "tbeta", "tgamma" : fitted coefficients.
+            - "loss" : the loss function ℒ(tβ, t𝛄) of the sparse coefficients, without regularization.
+            - "aic", "bic" : Akaike and Bayesian information criteria 2ℒ + 2*df and 2ℒ + log(m)*df, where
+              df is the number of non-zero coefficients in tβ and t𝛄, and m is the number of objects.
+              The loss omits the constant m*log(2π)/2 of the negative log-likelihood, so only the differences
+              between the points are meaningful.
+    """
+    problem, _ = LinearLMEProblem.from_x_y(x, y, columns_labels, random_intercept=random_intercept)
+    if nnz_tbeta is None:
+        nnz_tbeta = range(problem.num_fixed_effects, 0, -1)
+    if nnz_tgamma is None:
+        nnz_tgamma = range(problem.num_random_effects, 0, -1)
+    nnz_tbeta = list(nnz_tbeta)
+    nnz_tgamma = sorted(nnz_tgamma, reverse=True)
+    if not all(1 <= k <= problem.num_fixed_effects for k in nnz_tbeta):
+        raise ValueError("nnz_tbeta should be between 1 and the number of fixed effects.")
+    if not all(1 <= j <= problem.num_random_effects for j in nnz_tgamma):
+        raise ValueError("nnz_tgamma should be between 1 and the number of random effects.")
+
+    arguments = [(model, problem, k, nnz_tgamma) for k in nnz_tbeta]
+    if n_processes > 1:
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            branches = list(executor.map(_sparsity_path_branch, *zip(*arguments)))
+    else:
+        branches = [_sparsity_path_branch(*branch_arguments) for branch_arguments in arguments]
+
+    path = {key: np.array([point[key] for branch in branches for point in branch]) for key in branches[0][0]}
+    degrees_of_freedom = np.count_nonzero(path["tbeta"], axis=1) + np.count_nonzero(path["tgamma"], axis=1)
+    path["aic"] = 2 * path["loss"] + 2 * degrees_of_freedom
+    path["bic"] = 2 * path["loss"] + np.log(problem.num_obs) * degrees_of_freedom
+    return path
+
+
+class LinearLMESparseModelCV(BaseEstimator, RegressorMixin):
+    """
+    LinearLMESparseModel with the hyperparameters lb, lg, nnz_tbeta, and nnz_tgamma chosen by group K-fold
+    cross-validation.
+
+    The problem is built only once, and the folds are subsets of its groups (LinearLMEProblem.take_groups),
+    so the data is not parsed again for every fold and every combination of the hyperparameters. If the oracle
+    of the estimator works in 'woodbury' or 'sufficient_statistics' mode, then the per-group statistics are also
+    computed once for all groups and shared by the folds. The held-out groups are new to the model fitted on the
+    other folds, so they are predicted with the fixed effects only.
+    """
+
+    def __init__(self,
+                 estimator: LinearLMESparseModel = None,
+                 lb: List[float] = (1,),
+                 lg: List[float] = (1,),
+                 nnz_tbeta: List[int] = (3,),
+                 nnz_tgamma: List[int] = (3,),
+                 cv: int = 5,
+                 use_sparse_coefficients: bool = False,
+                 n_processes: int = 1):
+        """
+        init: initializes the model.
+
+        Parameters
+        ----------
+        estimator : LinearLMESparseModel, Optional
+            A model with the values of all other hyperparameters. If None then LinearLMESparseModel() is used.
+
+        lb, lg, nnz_tbeta, nnz_tgamma : List
+            Values of the respective hyperparameters of LinearLMESparseModel to try. All combinations are tried.
+
+        cv : int, default = 5
+            Number of folds. The groups are distributed between the folds so that the folds have about the same
+            number of objects.
+
+        use_sparse_coefficients : bool, default = False
+            Whether to predict the held-out groups with tβ instead of β.
+
+        n_processes : int, default = 1
+            Number of processes which the pairs (fold, combination of hyperparameters) are distributed between.
+        """
+        self.estimator = estimator
+        self.lb = lb
+        self.lg = lg
+        self.nnz_tbeta = nnz_tbeta
+        self.nnz_tgamma = nnz_tgamma
+        self.cv = cv
+        self.use_sparse_coefficients = use_sparse_coefficients
+        self.n_processes = n_processes
+
+    def fit(self, x: np.ndarray, y: np.ndarray, columns_labels: np.ndarray = None, random_intercept=True):
+        """
+        Chooses the hyperparameters by cross-validation and fits the best model to all data.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            Data, see LinearLMESparseModel.fit.
+
+        y : np.ndarray
+            Answers, real-valued array.
+
+        columns_labels : np.ndarray, Optional
+            Labels of the columns of x, see LinearLMESparseModel.fit.
+
+        random_intercept : bool, default = True
+            Whether treat the intercept as a random effect.
+
+        Returns
+        -------
+        self : LinearLMESparseModelCV
+            Fitted model. The results are in the attributes:
+
+                - cv_results_ : dict with the list of combinations of hyperparameters "params", the array
+                  "split_scores" of R^2 of every combination (rows) on every fold (columns), and
+                  its "mean_test_score" and "std_test_score".
+                - best_params_, best_score_ : the combination with the largest mean R^2 and its score.
+                - best_estimator_ : LinearLMESparseModel with best_params_ fitted to all data.
+        """
+        estimator = LinearLMESparseModel() if self.estimator is None else self.estimator
+        problem, _ = LinearLMEProblem.from_x_y(x, y, columns_labels, random_intercept=random_intercept)
+        if estimator.oracle_mode in ("woodbury", "sufficient_statistics"):
+            problem.compute_sufficient_statistics()
+        folds = _group_k_fold(problem.groups_sizes, self.cv)
+        params = [{"lb": lb, "lg": lg, "nnz_tbeta": nnz_tbeta, "nnz_tgamma": nnz_tgamma}
+                  for lb, lg, nnz_tbeta, nnz_tgamma in itertools.product(self.lb, self.lg, self.nnz_tbeta,
+                                                                         self.nnz_tgamma)]
+        tasks = [(estimator, point_params, train_idx, test_idx, self.use_sparse_coefficients)
+                 for point_params in params for train_idx, test_idx in folds]
+        if self.n_processes > 1:
+            with ProcessPoolExecutor(max_workers=self.n_processes, initializer=_set_cross_validation_problem,
+                                     initargs=(problem,)) as executor:
+                scores = list(executor.map(_cross_validation_score, *zip(*tasks)))
+        else:
+            _set_cross_validation_problem(problem)
+            scores = [_cross_validation_score(*task) for task in tasks]
+            _set_cross_validation_problem(None)
+        scores = np.reshape(scores, (len(params), len(folds)))
+
+        self.cv_results_ = {
+            "params": params,
+            "split_scores": scores,
+            "mean_test_score": scores.mean(axis=1),
+            "std_test_score": scores.std(axis=1),
+        }
+        best = int(np.argmax(self.cv_results_["mean_test_score"]))
+        self.best_params_ = params[best]
+        self.best_score_ = self.cv_results_["mean_test_score"][best]
+        self.best_estimator_ = clone(estimator).set_params(**self.best_params_)._fit_problem(problem)
+        return self
+
+    def predict(self, x, use_sparse_coefficients=False):
+        """
+        Makes a prediction with the best model, see LinearLMESparseModel.predict.
+        """
+        check_is_fitted(self, 'best_estimator_')
+        return self.best_estimator_.predict(x, use_sparse_coefficients=use_sparse_coefficients)
+
+
+def _sparsity_path_branch(model: LinearLMESparseModel, problem: LinearLMEProblem, nnz_tbeta: int,
+                          nnz_tgamma: List[int]) -> List[dict]:
+    """
+    Fits the points (nnz_tbeta, j) for j in nnz_tgamma with one oracle, warm-starting every point
+    from the previous one.
+    """
+    model = clone(model)
+    model.nnz_tbeta = nnz_tbeta
+    model.nnz_tgamma = nnz_tgamma[0]
+    oracle = model._make_oracle(problem)
+    beta = np.ones(problem.num_fixed_effects)
+    gamma = np.ones(problem.num_random_effects)
+    tbeta = np.zeros(problem.num_fixed_effects)
+    tgamma = np.zeros(problem.num_random_effects)
+    points = []
+    try:
+        beta, gamma = model._initialize(oracle, beta, gamma, tbeta)
+        for j in nnz_tgamma:
+            model.nnz_tgamma = oracle.j = j
+            model._optimize(oracle, beta, gamma, tbeta, tgamma)
+            beta, gamma, tbeta, tgamma = (model.coef_[key] for key in ("beta", "gamma", "tbeta", "tgamma"))
+            # with β = tβ and 𝛄 = t𝛄 the regularization terms vanish
+            points.append({"nnz_tbeta": nnz_tbeta,
+                           "nnz_tgamma": j,
+                           "beta": beta,
+                           "gamma": gamma,
+                           "tbeta": tbeta,
+                           "tgamma": tgamma,
+                           "loss": oracle.loss(tbeta, tgamma, tbeta, tgamma)})
+    finally:
+        oracle.close()
+    return points
+
+
+# The problem which the cross-validation tasks take the folds from. It's set once per process,
+# so that the data is not sent to the worker processes with every task.
+_cross_validation_problem = None
+
+
+def _set_cross_validation_problem(problem: LinearLMEProblem):
+    global _cross_validation_problem
+    _cross_validation_problem = problem
+
+
+def _cross_validation_score(estimator: LinearLMESparseModel, params: dict, train_idx: np.ndarray,
+                            test_idx: np.ndarray, use_sparse_coefficients: bool) -> float:
+    """
+    Fits the estimator with the given hyperparameters to the train groups and returns its R^2 on the test groups.
+    """
+    problem = _cross_validation_problem
+    model = clone(estimator).set_params(**params)
+    model._fit_problem(problem.take_groups(train_idx))
+    test_problem = problem.take_groups(test_idx)
+    beta = model.coef_["tbeta" if use_sparse_coefficients else "beta"]
+    # the test groups were not seen in training, so their random effects are zero
+    y_pred = test_problem.fixed_features_packed.dot(beta)
+    y = test_problem.answers_packed
+    return 1 - ((y - y_pred) ** 2).sum() / ((y - y.mean()) ** 2).sum()
+
+
+def _group_k_fold(groups_sizes: List[int], n_splits: int):
+    """
+    Splits the groups into n_splits folds with about the same numbers of objects, like sklearn's GroupKFold:
+    from the largest group to the smallest, every group goes to the fold with the fewest objects so far.
+
+    Returns
+    -------
+    folds : List of (train_idx, test_idx)
+        Indices of the train and test groups of every fold, in increasing order.
+    """
+    if not 2 <= n_splits <= len(groups_sizes):
+        raise ValueError("The number of folds should be between 2 and the number of groups.")
+    folds_sizes = np.zeros(n_splits)
+    groups_folds = np.zeros(len(groups_sizes), dtype=int)
+    for i in np.argsort(groups_sizes, kind="stable")[::-1]:
+        fold = int(np.argmin(folds_sizes))
+        groups_folds[i] = fold
+        folds_sizes[fold] += groups_sizes[i]
+    return [(np.flatnonzero(groups_folds != fold), np.flatnonzero(groups_folds == fold)) for fold in range(n_splits)]
@@ -17,11 +17,14 @@
 from typing import Set
 
 import numpy as np
+from scipy.optimize import minimize
 from sklearn.base import BaseEstimator, RegressorMixin
 from sklearn.utils.validation import check_consistent_length, check_is_fitted
 
 from skmixed.lme.problems import LinearLMEProblem
-from skmixed.lme.oracles import LinearLMEOracleRegularized, LinearLMEOracleW
+from skmixed.lme.line_search import armijo_backtracking
+from skmixed.lme.oracles import LinearLMEOracle, LinearLMEOracleRegularized, LinearLMEOracleW
+from skmixed.lme.predictor import LinearLMEPredictor
 from skmixed.logger import Logger
 from skmixed.helpers import get_per_group_coefficients
 
@@ -71,6 +74,15 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
                  regularization_type: str = "l2",
                  nnz_tbeta: int = 3,
                  nnz_tgamma: int = 3,
+                 n_jobs: int = 1,
+                 oracle_mode: str = "cholesky",
+                 max_low_rank_updates: int = 0,
+                 beta_solver: str = "direct",
+                 line_search_batch_size: int = 1,
+                 active_set: bool = False,
+                 active_set_patience: int = 3,
+                 active_set_check_period: int = 10,
+                 screening_size: int = None,
                  logger_keys: Set = ('converged',)):
         """
         init: initializes the model.
@@ -84,9 +96,11 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
             Tolerance for inner optimization subroutine (min ℋ w.r.t. 𝛄) stopping criterion:
             ||projected ∇ℋ|| <= tol_inner
 
-        solver : {'pgd'} Solver to use in computational routines:
+        solver : {'pgd', 'newton', 'lbfgsb'} Solver to use in computational routines:
 
                 - 'pgd' : Projected Gradient Descent
+                - 'newton' : Projected Newton method with an active set of the constraints 𝛄 >= 0
+                - 'lbfgsb' : Bound-constrained quasi-Newton method L-BFGS-B
 
         initializer : {None, 'EM'}, Optional
             Whether to use an initializer before starting the main optimization routine:
@@ -101,8 +115,12 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
             Number of iterations for the inner optimization cycle.
 
         use_line_search : bool, default = True
-            Whether to use line search when optimizing w.r.t. 𝛄. If true, it starts from step_len = 1 and cuts it
-            in half until the descent criterion is met. If false, it uses a fixed step size of 1/iteration_number.
+            Whether to use line search when optimizing w.r.t. 𝛄. If true, it starts from step_len = 0.1 and
+            backtracks with quadratic/cubic interpolation until the Armijo condition with the relative decrease
+            of at least 1e-5 is met, see skmixed.lme.line_search.armijo_backtracking. The numbers of loss
+            evaluations which the searches took are logged under the key 'line_search_evaluations', one list per
+            outer iteration; the last search of an inner loop fails when no step gives enough decrease.
+            If false, it uses a fixed step size of 1/iteration_number.
 
         lb : float
             Regularization coefficient for the tβ-related term, see the loss-function description.
@@ -121,6 +139,60 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
 
         nnz_tgamma : int,
             How many non-zero coefficients are allowed in t𝛄.
+
+        n_jobs : int, default = 1
+            Number of worker processes which the oracle splits the groups between. -1 means using all processors,
+            -2 all but one, and so on. See the docs for LinearLMEOracle.
+
+        oracle_mode : str, default = "cholesky"
+            How the oracle computes the loss and its derivatives, see the docs for LinearLMEOracle.
+
+        max_low_rank_updates : int, default = 0
+            Only for oracle_mode="cholesky". Inner iterations of the solvers for 𝛄 change 𝛄 by small steps,
+            so the oracle can update the Cholesky factors of Ω_i by low-rank terms instead of recomputing them,
+            up to max_low_rank_updates times in a row. 0 means always recomputing the factors.
+            See the docs for LinearLMEOracle.
+
+        beta_solver : {'direct', 'cg'}, default = "direct"
+            How the oracle solves for the optimal β: by assembling the p×p kernel and solving the system directly,
+            or by matrix-free conjugate gradients started from the current β, which pays off for wide designs.
+            See the docs for LinearLMEOracle.
+
+        line_search_batch_size : int, default = 1
+            How many trial step lengths the line search evaluates in one oracle call (LinearLMEOracle.losses).
+            Values above 1 pay off when the loss of several 𝛄's is much cheaper to compute together,
+            e.g. for small groups.
+
+        active_set : bool, default = False
+            Whether to run the iterations on a reduced problem once the supports of tβ and t𝛄 settle.
+            The reduced problem keeps only the working set of columns: the 2*nnz_tbeta fixed effects which
+            the oracle ranks highest for tβ (the intercept always stays), the random effects paired with them, and
+            the ones with non-zero variances or without a fixed counterpart. It is the full problem
+            with the coefficients of all the other columns fixed at zero. Every active_set_check_period iterations,
+            and upon convergence, tβ and t𝛄 are recomputed on the full problem, and if their supports leave
+            the working set, or the gradient of the loss w.r.t. some of the variances fixed at zero is negative,
+            then the missing columns are re-admitted and the iterations go on. The size of the working set is logged
+            under the key 'working_set_size' (None while the full problem is used).
+
+        active_set_patience : int, default = 3
+            For how many consecutive outer iterations the supports of tβ and t𝛄 need to stay the same
+            before the problem is reduced to the working set.
+
+        active_set_check_period : int, default = 10
+            How often, in outer iterations, the working set is checked against the full problem.
+
+        screening_size : int, Optional
+            If given, the columns are screened before the fit: the model is fitted to the problem of the
+            screening_size fixed effects with the highest marginal scores (see LinearLMEOracle.marginal_scores) at
+            the null point, where β has only the intercept and 𝛄 = 0, or the 𝛄 of the initializer if it is 'EM'. It
+            should be between nnz_tbeta and the number of fixed effects. The intercept always stays. The random
+            effects which are paired with the kept fixed effects stay, and so do the random effects whose variances
+            would leave zero there. After the fit the solution is checked against the full problem, as in the
+            active-set mode, and the scores are recomputed at the null point with the fitted 𝛄. If a screened-out
+            column violates the optimality conditions, or its fixed effect now scores higher than the weakest one of
+            the support of tβ, then it is re-admitted and the model is re-fitted from the initial point. The
+            fraction of the columns which stayed screened out is logged under the key 'screened_fraction', and the
+            number of re-fits under 'screening_refits'.
         """
 
         self.tol = tol
@@ -134,6 +206,15 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
         self.lg = lg
         self.nnz_tbeta = nnz_tbeta
         self.nnz_tgamma = nnz_tgamma
+        self.n_jobs = n_jobs
+        self.oracle_mode = oracle_mode
+        self.max_low_rank_updates = max_low_rank_updates
+        self.beta_solver = beta_solver
+        self.line_search_batch_size = line_search_batch_size
+        self.active_set = active_set
+        self.active_set_patience = active_set_patience
+        self.active_set_check_period = active_set_check_period
+        self.screening_size = screening_size
         self.logger_keys = logger_keys
         self.regularization_type = regularization_type
 
@@ -194,6 +275,26 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
         """
 
         problem, _ = LinearLMEProblem.from_x_y(x, y, columns_labels, random_intercept=random_intercept, **kwargs)
+        return self._fit_problem(problem, initial_parameters=initial_parameters, warm_start=warm_start)
+
+    def _fit_problem(self, problem: LinearLMEProblem, initial_parameters: dict = None, warm_start=False):
+        """
+        Fits the model to a problem which is already built, see fit for the details.
+
+        Parameters
+        ----------
+        problem : LinearLMEProblem
+            The problem to fit.
+        initial_parameters : dict, Optional
+            Initial point, see fit.
+        warm_start : bool, default is False
+            Whether to use previous parameters as initial ones, see fit.
+
+        Returns
+        -------
+        self : LinearLMESparseModel
+            Fitted regression model.
+        """
         if initial_parameters is None:
             initial_parameters = {}
         beta0 = initial_parameters.get("beta", None)
@@ -202,27 +303,15 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
         tgamma0 = initial_parameters.get("tgamma", None)
         _check_input_consistency(problem, beta0, gamma0, tbeta0, tgamma0)
 
-        if self.regularization_type == "l2":
-            oracle = LinearLMEOracleRegularized(problem,
-                                                lb=self.lb,
-                                                lg=self.lg,
-                                                nnz_tbeta=self.nnz_tbeta,
-                                                nnz_tgamma=self.nnz_tgamma
-                                                )
-        elif self.regularization_type == "loss-weighted":
-            oracle = LinearLMEOracleW(problem,
-                                      lb=self.lb,
-                                      lg=self.lg,
-                                      nnz_tbeta=self.nnz_tbeta,
-                                      nnz_tgamma=self.nnz_tgamma
-                                      )
-        else:
-            raise ValueError("regularization_type is not understood.")
-
         num_fixed_effects = problem.num_fixed_effects
         num_random_effects = problem.num_random_effects
         assert num_fixed_effects >= self.nnz_tbeta
         assert num_random_effects >= self.nnz_tgamma
+        if self.screening_size is not None and not self.nnz_tbeta <= self.screening_size <= num_fixed_effects:
+            raise ValueError("screening_size should be between nnz_tbeta (%d) and the number of fixed effects (%d), "
+                             "got %d" % (self.nnz_tbeta, num_fixed_effects, self.screening_size))
+
+        oracle = self._make_oracle(problem)
         # old_oracle = OldOracle(problem, lb=self.lb, lg=self.lg, k=self.nnz_tbeta, j=self.nnz_tgamma)
 
         if warm_start:
@@ -253,12 +342,146 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
             else:
                 tgamma = np.zeros(num_random_effects)
 
+        try:
+            beta, gamma = self._initialize(oracle, beta, gamma, tbeta)
+            self._optimize(oracle, beta, gamma, tbeta, tgamma)
+        finally:
+            oracle.close()
+        return self
+
+    def _make_oracle(self, problem: LinearLMEProblem):
+        """
+        Creates the oracle of the regularization type of the model for the given problem.
+
+        Parameters
+        ----------
+        problem : LinearLMEProblem
+            The problem to fit.
+
+        Returns
+        -------
+        oracle : LinearLMEOracleRegularized
+            An oracle for the problem. The caller is responsible for closing it.
+        """
+        if self.regularization_type == "l2":
+            return LinearLMEOracleRegularized(problem,
+                                              lb=self.lb,
+                                              lg=self.lg,
+                                              nnz_tbeta=self.nnz_tbeta,
+                                              nnz_tgamma=self.nnz_tgamma,
+                                              mode=self.oracle_mode,
+                                              n_jobs=self.n_jobs,
+                                              max_low_rank_updates=self.max_low_rank_updates,
+                                              beta_solver=self.beta_solver
+                                              )
+        elif self.regularization_type == "loss-weighted":
+            return LinearLMEOracleW(problem,
+                                    lb=self.lb,
+                                    lg=self.lg,
+                                    nnz_tbeta=self.nnz_tbeta,
+                                    nnz_tgamma=self.nnz_tgamma,
+                                    mode=self.oracle_mode,
+                                    n_jobs=self.n_jobs,
+                                    max_low_rank_updates=self.max_low_rank_updates,
+                                    beta_solver=self.beta_solver
+                                    )
+        else:
+            raise ValueError("regularization_type is not understood.")
+
+    def _make_reduced_oracle(self, oracle, fixed_idx, random_idx):
+        """
+        Creates the oracle of the problem of the given oracle reduced to the given fixed and random effects.
+
+        Parameters
+        ----------
+        oracle : LinearLMEOracleRegularized
+            Oracle of the full problem.
+        fixed_idx, random_idx : np.ndarray[int]
+            Indices of the fixed and random effects to keep, see LinearLMEProblem.take_columns.
+
+        Returns
+        -------
+        oracle : LinearLMEOracleRegularized
+            An oracle for the reduced problem with the same sparsity levels. The caller is responsible for closing it.
+        """
+        reduced_oracle = self._make_oracle(oracle.problem.take_columns(fixed_idx, random_idx))
+        reduced_oracle.k = oracle.k
+        reduced_oracle.j = oracle.j
+        return reduced_oracle
+
+    def _make_null_oracle(self, problem: LinearLMEProblem):
+        """
+        Creates the non-regularized oracle of the problem reduced to the intercept and all the random effects,
+        which finds the null point of the screening, see screening_size.
+
+        Parameters
+        ----------
+        problem : LinearLMEProblem
+            The full problem.
+
+        Returns
+        -------
+        oracle : LinearLMEOracle
+            An oracle for the reduced problem with the settings of the model. The caller is responsible for closing it.
+        """
+        return LinearLMEOracle(problem.take_columns([0], np.arange(problem.num_random_effects)),
+                               mode=self.oracle_mode,
+                               n_jobs=self.n_jobs,
+                               max_low_rank_updates=self.max_low_rank_updates,
+                               beta_solver=self.beta_solver)
+
+    def _initialize(self, oracle, beta, gamma, tbeta):
+        """
+        Improves the initial point with the initializer of the model, if there is one.
+
+        Parameters
+        ----------
+        oracle : LinearLMEOracleRegularized
+            Oracle of the problem to fit.
+        beta, gamma, tbeta : np.ndarray
+            Initial point.
+
+        Returns
+        -------
+        beta, gamma : np.ndarray
+            The improved initial estimates of fixed effects and random effects' covariances.
+        """
         if self.initializer == "EM":
-            beta = oracle.optimal_beta(gamma, tbeta)
+            beta = oracle.optimal_beta(gamma, tbeta, beta=beta)
             us = oracle.optimal_random_effects(beta, gamma)
             gamma = np.sum(us ** 2, axis=0) / oracle.problem.num_groups
             # tbeta = oracle.optimal_tbeta(beta)
             # tgamma = oracle.optimal_tgamma(tbeta, gamma)
+        return beta, gamma
+
+    def _optimize(self, oracle, beta, gamma, tbeta, tgamma, screen=True):
+        """
+        Runs the optimization routine from the given initial point and stores the result in coef_ and logger_.
+
+        The sparsity levels are taken from the oracle (oracle.k and oracle.j), so one oracle can be reused
+        for fitting several sparsity levels. The oracle is not closed; the oracles of the reduced problems
+        which the active-set mode and the screening create are.
+
+        Parameters
+        ----------
+        oracle : LinearLMEOracleRegularized
+            Oracle of the problem to fit.
+        beta, gamma, tbeta, tgamma : np.ndarray
+            Initial point.
+        screen : bool, default = True
+            Whether to screen the columns first if screening_size is set. The fits of the screened problems
+            themselves are not screened again.
+
+        Returns
+        -------
+        self : LinearLMESparseModel
+            Fitted regression model.
+        """
+        problem = oracle.problem
+        if self.solver not in ("pgd", "newton", "lbfgsb"):
+            raise ValueError("Unknown solver: %s" % self.solver)
+        if screen and self.screening_size is not None:
+            return self._optimize_screened(oracle, beta, gamma, tbeta, tgamma)
 
         def projected_direction(current_gamma, current_direction):
             proj_direction = current_direction.copy()
@@ -273,10 +496,43 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
         prev_tbeta = np.infty
         prev_tgamma = np.infty
 
+        full_oracle = oracle
+        # indices of the fixed and random effects of the working set, None when the full problem is used
+        fixed_idx = None
+        random_idx = None
+        working_set_size = None
+        stable_iterations = 0
+        last_check = 0
+
         iteration = 0
-        while (np.linalg.norm(tbeta - prev_tbeta) > self.tol
-               and np.linalg.norm(tgamma - prev_tgamma) > self.tol
-               and iteration < self.n_iter):
+        while iteration < self.n_iter:
+            converged = (np.linalg.norm(tbeta - prev_tbeta) <= self.tol
+                         or np.linalg.norm(tgamma - prev_tgamma) <= self.tol)
+            if fixed_idx is not None and (converged or iteration - last_check >= self.active_set_check_period):
+                # checks the working set against the full problem
+                last_check = iteration
+                (beta_full, gamma_full, tbeta_full, tgamma_full), satisfied, (new_fixed_idx, new_random_idx) = \
+                    _check_working_set(full_oracle, (beta, gamma, tbeta), fixed_idx, random_idx, tol=self.tol_inner)
+                if not satisfied:
+                    # re-admits the columns which the full problem wants
+                    fixed_idx, random_idx = new_fixed_idx, new_random_idx
+                    oracle.close()
+                    oracle = self._make_reduced_oracle(full_oracle, fixed_idx, random_idx)
+                    working_set_size = len(fixed_idx) + len(random_idx)
+                    beta, gamma = beta_full[fixed_idx], gamma_full[random_idx]
+                    tbeta, tgamma = tbeta_full[fixed_idx], tgamma_full[random_idx]
+                    prev_tbeta = np.infty
+                    prev_tgamma = np.infty
+                    converged = False
+                elif converged:
+                    # the solution of the reduced problem satisfies the full one: finishes on the full problem
+                    oracle.close()
+                    oracle = full_oracle
+                    fixed_idx = None
+                    random_idx = None
+                    beta, gamma, tbeta, tgamma = beta_full, gamma_full, tbeta_full, tgamma_full
+            if converged:
+                break
 
             if iteration >= self.n_iter:
                 us = oracle.optimal_random_effects(beta, gamma)
@@ -291,59 +547,173 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
                 self.logger_.add("converged", 0)
                 return self
 
+            beta = oracle.optimal_beta(gamma, tbeta, beta=beta)
             if self.solver == 'pgd':
                 inner_iteration = 0
-                beta = oracle.optimal_beta(gamma, tbeta, beta=beta)
-                gradient_gamma = oracle.gradient_gamma(beta, gamma, tgamma)
+                line_search_evaluations = []
+                current_loss, gradient_gamma = oracle.value_and_grad(beta, gamma, tbeta, tgamma)
                 direction = projected_direction(gamma, -gradient_gamma)
                 while (np.linalg.norm(direction) > self.tol_inner
                        and inner_iteration < self.n_iter_inner):
-                    # gradient_gamma = oracle.gradient_gamma(beta, gamma, tgamma)
-                    # projecting the gradient to the set of constraints
-                    # direction = projected_direction(gamma, -gradient_gamma)
                     if self.use_line_search:
                         # line search method
-                        step_len = 0.1
-                        for i, _ in enumerate(gamma):
-                            if direction[i] < 0:
-                                step_len = min(-gamma[i] / direction[i], step_len)
-
-                        current_loss = oracle.loss(beta, gamma, tbeta, tgamma)
-
-                        while (oracle.loss(beta, gamma + step_len * direction, tbeta, tgamma)
-                               >= (1 - np.sign(current_loss) * 1e-5) * current_loss):
-                            step_len *= 0.5
-                            if step_len <= 1e-15:
-                                break
+                        # step lengths at which the coordinates of gamma reach zero
+                        boundaries = np.full(len(gamma), np.infty)
+                        boundaries[direction < 0] = -gamma[direction < 0] / direction[direction < 0]
+                        step_len = min(0.1, np.min(boundaries))
+
+                        step_len, _, evaluations, _ = armijo_backtracking(
+                            lambda t: oracle.loss(beta, np.maximum(gamma + t * direction, 0), tbeta, tgamma),
+                            value=current_loss,
+                            slope=gradient_gamma.dot(direction),
+                            step_len=step_len,
+                            min_decrease=1e-5 * abs(current_loss),
+                            batch_function=lambda steps: oracle.losses(beta,
+                                                                       np.maximum(gamma + np.outer(steps,
+                                                                                                   direction), 0),
+                                                                       tbeta, tgamma),
+                            batch_size=self.line_search_batch_size)
+                        line_search_evaluations.append(evaluations)
                     else:
                         # fixed step size
                         step_len = 1 / iteration
                     if step_len <= 1e-15:
                         break
                     gamma = gamma + step_len * direction
-                    gradient_gamma = oracle.gradient_gamma(beta, gamma, tgamma)
+                    if self.use_line_search:
+                        # the coordinates which reach the boundary are set to zero exactly, despite round-off errors
+                        gamma[boundaries <= step_len] = 0
+                    gamma = np.maximum(gamma, 0)
+                    current_loss, gradient_gamma = oracle.value_and_grad(beta, gamma, tbeta, tgamma)
                     direction = projected_direction(gamma, -gradient_gamma)
                     inner_iteration += 1
+            elif self.solver == 'newton':
+                gamma, inner_iteration = _minimize_gamma_newton(oracle, beta, gamma, tbeta, tgamma,
+                                                                tol=self.tol_inner, max_iter=self.n_iter_inner)
+            else:
+                gamma, inner_iteration = _minimize_gamma_lbfgsb(oracle, beta, gamma, tbeta, tgamma,
+                                                                tol=self.tol_inner, max_iter=self.n_iter_inner)
 
-                prev_tbeta = tbeta
-                prev_tgamma = tgamma
-                tbeta = oracle.optimal_tbeta(beta=beta, gamma=gamma)
-                tgamma = oracle.optimal_tgamma(tbeta, gamma, beta=beta)
-                iteration += 1
+            prev_tbeta = tbeta
+            prev_tgamma = tgamma
+            tbeta = oracle.optimal_tbeta(beta=beta, gamma=gamma)
+            tgamma = oracle.optimal_tgamma(tbeta, gamma, beta=beta)
+            iteration += 1
 
             loss = oracle.loss(beta, gamma, tbeta, tgamma)
             if len(self.logger_keys) > 0:
                 self.logger_.log(locals())
 
+            if self.active_set and fixed_idx is None:
+                if (np.array_equal(tbeta != 0, prev_tbeta != 0)
+                        and np.array_equal(tgamma != 0, prev_tgamma != 0)):
+                    stable_iterations += 1
+                else:
+                    stable_iterations = 0
+                if stable_iterations >= self.active_set_patience:
+                    fixed_idx, random_idx = _working_set(oracle, beta, gamma, tbeta)
+                    if (len(fixed_idx) < problem.num_fixed_effects
+                            or len(random_idx) < problem.num_random_effects):
+                        oracle = self._make_reduced_oracle(full_oracle, fixed_idx, random_idx)
+                        working_set_size = len(fixed_idx) + len(random_idx)
+                        beta, gamma = beta[fixed_idx], gamma[random_idx]
+                        tbeta, tgamma = tbeta[fixed_idx], tgamma[random_idx]
+                        prev_tbeta, prev_tgamma = prev_tbeta[fixed_idx], prev_tgamma[random_idx]
+                        last_check = iteration
+                    else:
+                        fixed_idx = None
+                        random_idx = None
+
+        if fixed_idx is not None:
+            # the iterations ran out on the reduced problem
+            oracle.close()
+            oracle = full_oracle
+            beta = _pad(beta, fixed_idx, problem.num_fixed_effects)
+            tbeta = _pad(tbeta, fixed_idx, problem.num_fixed_effects)
+            gamma = _pad(gamma, random_idx, problem.num_random_effects)
+            tgamma = _pad(tgamma, random_idx, problem.num_random_effects)
+
+        self.logger_.add('converged', 1)
+        self.logger_.add('iterations', iteration)
+        return self._store_coefficients(oracle, beta, gamma, tbeta, tgamma)
+
+    def _optimize_screened(self, oracle, beta, gamma, tbeta, tgamma):
+        """
+        Screens the columns of the problem, fits the model to the rest of them and checks the result against
+        the full problem, re-fitting until it passes, see screening_size.
+
+        Parameters
+        ----------
+        oracle : LinearLMEOracleRegularized
+            Oracle of the full problem.
+        beta, gamma, tbeta, tgamma : np.ndarray
+            Initial point.
+
+        Returns
+        -------
+        self : LinearLMESparseModel
+            Fitted regression model.
+        """
+        problem = oracle.problem
+        null_gamma = gamma if self.initializer == "EM" else np.zeros(problem.num_random_effects)
+        # the null point is found at every re-fit, so its oracle and the factors it caches are kept between them
+        null_oracle = self._make_null_oracle(problem)
+        try:
+            fixed_idx, random_idx = _screen(oracle, null_oracle, null_gamma, self.screening_size)
+            # every re-fit starts from the initial point: the previous solution can be a local minimum
+            # of the full problem as well, which the re-admitted columns would not leave
+            initial_point = (beta, gamma, tbeta, tgamma)
+            refits = 0
+            while True:
+                beta, gamma, tbeta, tgamma = initial_point
+                reduced_oracle = self._make_reduced_oracle(oracle, fixed_idx, random_idx)
+                try:
+                    self._optimize(reduced_oracle, beta[fixed_idx], gamma[random_idx], tbeta[fixed_idx],
+                                   tgamma[random_idx], screen=False)
+                finally:
+                    reduced_oracle.close()
+                solution = (self.coef_["beta"], self.coef_["gamma"], self.coef_["tbeta"])
+                (beta, gamma, tbeta, tgamma), satisfied, (new_fixed_idx, new_random_idx) = \
+                    _check_working_set(oracle, solution, fixed_idx, random_idx, tol=self.tol_inner)
+                # the check above re-optimizes β towards tβ, which is zero on the screened-out columns, so it can
+                # miss a column which the screening ranked wrongly; the ranking itself is checked at the fitted 𝛄
+                entering_fixed_idx, entering_random_idx = _rescreen(oracle, null_oracle, gamma, tbeta, fixed_idx)
+                if satisfied and len(entering_fixed_idx) == 0:
+                    break
+                fixed_idx = np.union1d(new_fixed_idx, entering_fixed_idx)
+                random_idx = np.union1d(new_random_idx, entering_random_idx)
+                refits += 1
+        finally:
+            null_oracle.close()
+
+        self.logger_.add('screened_fraction', 1 - (len(fixed_idx) + len(random_idx))
+                         / (problem.num_fixed_effects + problem.num_random_effects))
+        self.logger_.add('screening_refits', refits)
+        return self._store_coefficients(oracle, beta, gamma, tbeta, tgamma)
+
+    def _store_coefficients(self, oracle, beta, gamma, tbeta, tgamma):
+        """
+        Stores the solution in coef_ along with the random effects and the per-group coefficients it implies.
+
+        Parameters
+        ----------
+        oracle : LinearLMEOracleRegularized
+            Oracle of the problem which the solution is for.
+        beta, gamma, tbeta, tgamma : np.ndarray
+            The solution.
+
+        Returns
+        -------
+        self : LinearLMESparseModel
+            Fitted regression model.
+        """
+        problem = oracle.problem
         us = oracle.optimal_random_effects(beta, gamma)
         sparse_us = oracle.optimal_random_effects(tbeta, tgamma)
 
         per_group_coefficients = get_per_group_coefficients(beta, us, labels=problem.column_labels)
         sparse_per_group_coefficients = get_per_group_coefficients(tbeta, sparse_us, labels=problem.column_labels)
 
-        self.logger_.add('converged', 1)
-        self.logger_.add('iterations', iteration)
-
         self.coef_ = {
             "beta": beta,
             "gamma": gamma,
@@ -352,6 +722,9 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
             "random_effects": us,
             "sparse_random_effects": sparse_us,
             "group_labels": np.copy(problem.group_labels),
+            # positions of the groups in the order of their labels, for looking the labels up by searchsorted
+            "group_index": np.argsort(problem.group_labels, kind="stable"),
+            "column_labels": np.copy(problem.column_labels),
             "per_group_coefficients": per_group_coefficients,
             "sparse_per_group_coefficients": sparse_per_group_coefficients,
         }
@@ -376,7 +749,7 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
         Returns
         -------
         y : np.ndarray
-            Models predictions.
+            Models predictions, in the order of the rows of x.
         """
         check_is_fitted(self, 'coef_')
         problem, _ = LinearLMEProblem.from_x_y(x, y=None)
@@ -394,21 +767,45 @@ class LinearLMESparseModel(BaseEstimator, RegressorMixin):
         assert problem.num_random_effects == us[0].shape[0], \
             "Number of random effects is not the same to what it was in the train data."
 
+        # positions of the test groups in the train groups, or -1 for the groups which were not seen in training
         group_labels = self.coef_['group_labels']
-        answers = []
-        for i, (x, _, z, stds) in enumerate(problem):
-            label = problem.group_labels[i]
-            idx_of_this_label_in_train = np.where(group_labels == label)
-            assert len(idx_of_this_label_in_train) <= 1, "Group labels of the classifier contain duplicates."
-            if len(idx_of_this_label_in_train) == 1:
-                idx_of_this_label_in_train = idx_of_this_label_in_train[0]
-                y = x.dot(beta) + z.dot(us[idx_of_this_label_in_train][0])
-            else:
-                # If we have not seen this group (so we don't have inferred random effects for this)
-                # then we make a prediction with "expected" (e.g. zero) random effects
-                y = x.dot(beta)
-            answers.append(y)
-        return np.concatenate(answers)
+        group_index = self.coef_['group_index']
+        sorted_group_labels = group_labels[group_index]
+        positions = np.searchsorted(sorted_group_labels, problem.group_labels)
+        positions = np.minimum(positions, len(group_labels) - 1)
+        train_groups = np.where(sorted_group_labels[positions] == problem.group_labels, group_index[positions], -1)
+        # If we have not seen a group (so we don't have inferred random effects for it)
+        # then we make a prediction with "expected" (i.e. zero) random effects, which are the last row here
+        us = np.concatenate((np.reshape(us, (len(group_labels), -1)), np.zeros((1, problem.num_random_effects))))
+        objects_us = us[np.repeat(train_groups, problem.groups_sizes)]
+        answers = (problem.fixed_features_packed.dot(beta)
+                   + np.einsum('ij,ij->i', problem.random_features_packed, objects_us))
+        # the problem keeps the objects grouped, so we put the predictions back to the order of the rows of x
+        y = np.empty(problem.num_obs)
+        y[problem.order_of_objects] = answers
+        return y
+
+    def export(self, path, use_sparse_coefficients=False):
+        """
+        Saves a compact predict-only version of the model to an .npz file.
+
+        The file can be loaded by LinearLMEPredictor.load from skmixed.lme.predictor, which depends only on Numpy.
+
+        Parameters
+        ----------
+        path : str
+            Path to the file.
+
+        use_sparse_coefficients : bool, default is False
+            If true then the predictor uses sparse coefficients, tbeta and tgamma, otherwise it uses beta and gamma.
+
+        Returns
+        -------
+            None
+        """
+        check_is_fitted(self, 'coef_')
+        LinearLMEPredictor.from_model(self, use_sparse_coefficients=use_sparse_coefficients).save(path)
+        return None
 
     def score(self, x, y, sample_weight=None):
         """
@@ -487,3 +884,218 @@ def _check_input_consistency(problem, beta=None, gamma=None, tbeta=None, tgamma=
             len(gamma), num_random_effects
         )
     return None
+
+
+def _working_set(oracle, beta, gamma, tbeta):
+    """
+    Returns the fixed and random effects which the active-set mode keeps.
+
+    These are the 2*k fixed effects which the oracle would keep in tβ if it allowed twice as many non-zeros,
+    the support of tβ, and the intercept; and the random effects which are paired with them, have non-zero
+    variances, or have no fixed counterpart at all.
+    """
+    k = oracle.k
+    oracle.k = min(2 * k, len(beta))
+    try:
+        wide_tbeta = oracle.optimal_tbeta(beta=beta, gamma=gamma)
+    finally:
+        oracle.k = k
+    fixed_idx = np.union1d(np.flatnonzero((wide_tbeta != 0) | (tbeta != 0)), [0])
+    paired = np.isin(oracle.paired_beta_idx, fixed_idx)
+    unpaired_gamma_idx = np.setdiff1d(np.arange(len(gamma)), oracle.paired_gamma_idx)
+    random_idx = np.union1d(np.union1d(oracle.paired_gamma_idx[paired], unpaired_gamma_idx), np.flatnonzero(gamma))
+    return fixed_idx, random_idx
+
+
+def _check_working_set(oracle, solution, fixed_idx, random_idx, tol):
+    """
+    Checks whether a solution of the problem reduced to a working set is a solution of the full problem as well.
+
+    The solution is padded with zeros, then β is re-optimized and tβ, t𝛄 are recomputed on the full problem.
+    The check fails if their supports leave the working set, or the derivative of the loss w.r.t. some of
+    the variances which are fixed at zero is below -tol, so these variances should leave zero.
+
+    Parameters
+    ----------
+    oracle : LinearLMEOracleRegularized
+        Oracle of the full problem.
+    solution : tuple of np.ndarray
+        β, 𝛄, and tβ of the reduced problem.
+    fixed_idx, random_idx : np.ndarray[int]
+        Indices of the fixed and random effects of the working set.
+    tol : float
+        Tolerance for the derivatives w.r.t. the variances.
+
+    Returns
+    -------
+    point : tuple of np.ndarray
+        β, 𝛄, tβ, and t𝛄 of the full problem.
+    satisfied : bool
+        Whether the check passed.
+    working_set : tuple of np.ndarray[int]
+        The working set extended by the columns which the full problem wants, if the check failed,
+        or the given one otherwise.
+    """
+    problem = oracle.problem
+    beta, gamma, tbeta = solution
+    gamma = _pad(gamma, random_idx, problem.num_random_effects)
+    beta = oracle.optimal_beta(gamma, _pad(tbeta, fixed_idx, problem.num_fixed_effects),
+                               beta=_pad(beta, fixed_idx, problem.num_fixed_effects))
+    tbeta = oracle.optimal_tbeta(beta=beta, gamma=gamma)
+    tgamma = oracle.optimal_tgamma(tbeta, gamma, beta=beta)
+    gradient_gamma = oracle.gradient_gamma(beta, gamma, tgamma=tgamma)
+    growing_gamma_idx = np.setdiff1d(np.flatnonzero(gradient_gamma < -tol), random_idx)
+    satisfied = (len(growing_gamma_idx) == 0
+                 and np.all(np.isin(np.flatnonzero(tbeta), fixed_idx))
+                 and np.all(np.isin(np.flatnonzero(tgamma), random_idx)))
+    if not satisfied:
+        new_fixed_idx, new_random_idx = _working_set(oracle, beta, gamma, tbeta)
+        fixed_idx = np.union1d(fixed_idx, new_fixed_idx)
+        random_idx = np.union1d(np.union1d(random_idx, new_random_idx), growing_gamma_idx)
+    return (beta, gamma, tbeta, tgamma), satisfied, (fixed_idx, random_idx)
+
+
+def _screen(oracle, null_oracle, gamma, size):
+    """
+    Returns the fixed and random effects which stay after screening, see LinearLMESparseModel.screening_size.
+
+    The null point is β with only the intercept, which is optimal for the given 𝛄, and the given 𝛄.
+    """
+    scores_beta, scores_gamma = _null_scores(oracle, null_oracle, gamma)
+    # the intercept always stays
+    scores_beta[0] = np.infty
+    fixed_idx = np.sort(np.argsort(scores_beta)[-size:])
+    paired = np.isin(oracle.paired_beta_idx, fixed_idx)
+    random_idx = np.union1d(oracle.paired_gamma_idx[paired], np.flatnonzero(scores_gamma > 0))
+    return fixed_idx, random_idx
+
+
+def _rescreen(oracle, null_oracle, gamma, tbeta, fixed_idx):
+    """
+    Returns the screened-out fixed effects which outrank the support of tβ at the null point with the given 𝛄,
+    and the random effects paired with them.
+
+    A screened-out fixed effect outranks the support when its score is higher than the weakest score of the support
+    (the intercept aside) and than the scores of all the kept fixed effects which stayed out of the support:
+    the fit did not take those, so it would not take a weaker one either.
+    """
+    scores_beta, _ = _null_scores(oracle, null_oracle, gamma)
+    support_idx = np.flatnonzero(tbeta)
+    support_idx = support_idx[support_idx != 0]
+    if len(support_idx) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    unused_idx = np.setdiff1d(fixed_idx[fixed_idx != 0], support_idx)
+    threshold = max(np.min(scores_beta[support_idx]), np.max(scores_beta[unused_idx], initial=0))
+    screened_out_idx = np.setdiff1d(np.arange(oracle.problem.num_fixed_effects), fixed_idx)
+    entering_idx = screened_out_idx[scores_beta[screened_out_idx] > threshold]
+    paired = np.isin(oracle.paired_beta_idx, entering_idx)
+    return entering_idx, oracle.paired_gamma_idx[paired]
+
+
+def _null_scores(oracle, null_oracle, gamma):
+    """
+    Returns the marginal scores of all the coefficients at the null point: β with only the intercept,
+    which is optimal for the given 𝛄 (found by null_oracle, see LinearLMESparseModel._make_null_oracle),
+    and the given 𝛄.
+    """
+    beta = np.zeros(oracle.problem.num_fixed_effects)
+    beta[0] = null_oracle.optimal_beta(gamma)[0]
+    return oracle.marginal_scores(beta, gamma)
+
+
+def _pad(x: np.ndarray, idx: np.ndarray, size: int) -> np.ndarray:
+    """
+    Returns a vector of the given size with the elements of x at the positions idx and zeros everywhere else.
+    """
+    padded = np.zeros(size)
+    padded[idx] = x
+    return padded
+
+
+def _projected_gradient(gamma: np.ndarray, gradient: np.ndarray) -> np.ndarray:
+    """
+    Returns the gradient without the components which point outside of the set 𝛄 >= 0 at the boundary.
+    """
+    return np.where((gamma == 0) & (gradient >= 0), 0, gradient)
+
+
+def _minimize_gamma_newton(oracle, beta, gamma, tbeta, tgamma, tol=1e-4, max_iter=20, sigma=1e-4):
+    """
+    Minimizes the loss with respect to 𝛄 >= 0 for fixed β, tβ, and t𝛄 with the projected Newton method.
+
+    The coordinates of 𝛄 which are at zero and whose gradient pushes them further down form the active set:
+    they stay at zero, and the Newton step is made in the others using the respective block of the Hessian.
+    If this block is not positive definite, the step falls back to the antigradient. The step length is chosen by
+    backtracking along the projection of the step on 𝛄 >= 0, with the Armijo condition.
+
+    Parameters
+    ----------
+    oracle : LinearLMEOracleRegularized
+        Oracle of the problem.
+    beta, gamma, tbeta, tgamma : np.ndarray
+        Current estimates, gamma is the starting point.
+    tol : float
+        Tolerance for the norm of the projected gradient.
+    max_iter : int
+        Maximal number of Newton steps.
+    sigma : float
+        Sufficient decrease parameter of the Armijo condition.
+
+    Returns
+    -------
+    gamma : np.ndarray
+        The estimate of 𝛄.
+    iterations : int
+        The number of Newton steps made.
+    """
+    iterations = 0
+    value, gradient, hessian = oracle.value_grad_hess(beta, gamma, tbeta, tgamma)
+    while np.linalg.norm(_projected_gradient(gamma, gradient)) > tol and iterations < max_iter:
+        free = ~((gamma == 0) & (gradient > 0))
+        direction = np.zeros(len(gamma))
+        try:
+            cholesky = np.linalg.cholesky(hessian[np.ix_(free, free)])
+            direction[free] = -np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, gradient[free]))
+        except np.linalg.LinAlgError:
+            direction[free] = -gradient[free]
+        step_len = 1
+        while True:
+            new_gamma = np.maximum(gamma + step_len * direction, 0)
+            new_value = oracle.loss(beta, new_gamma, tbeta, tgamma)
+            if new_value <= value + sigma * gradient.dot(new_gamma - gamma) or step_len <= 1e-15:
+                break
+            step_len *= 0.5
+        if step_len <= 1e-15:
+            break
+        gamma = new_gamma
+        value, gradient, hessian = oracle.value_grad_hess(beta, gamma, tbeta, tgamma)
+        iterations += 1
+    return gamma, iterations
+
+
+def _minimize_gamma_lbfgsb(oracle, beta, gamma, tbeta, tgamma, tol=1e-4, max_iter=20):
+    """
+    Minimizes the loss with respect to 𝛄 >= 0 for fixed β, tβ, and t𝛄 with L-BFGS-B.
+
+    Parameters
+    ----------
+    oracle : LinearLMEOracleRegularized
+        Oracle of the problem.
+    beta, gamma, tbeta, tgamma : np.ndarray
+        Current estimates, gamma is the starting point.
+    tol : float
+        Tolerance for the largest component of the projected gradient.
+    max_iter : int
+        Maximal number of iterations.
+
+    Returns
+    -------
+    gamma : np.ndarray
+        The estimate of 𝛄.
+    iterations : int
+        The number of iterations made.
+    """
+    result = minimize(lambda g: oracle.value_and_grad(beta, g, tbeta, tgamma), gamma, jac=True, method="L-BFGS-B",
+                      bounds=[(0, None)] * len(gamma), options={"maxiter": max_iter, "gtol": tol})
+    # L-BFGS-B leaves the variables at their bounds exactly, but they are not guaranteed to be non-negative otherwise
+    return np.maximum(result.x, 0), result.nit
@@ -15,13 +15,23 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import heapq
+import multiprocessing
+import os
+import warnings
+from collections import OrderedDict
+from functools import partial
 from typing import Callable
 
 import numpy as np
+from scipy.linalg.blas import get_blas_funcs
 from scipy.linalg.lapack import get_lapack_funcs
 
 from skmixed.lme.problems import LinearLMEProblem
 
+# Modes which work through the capacitance matrices instead of forming Ω_i's explicitly
+woodbury_modes = ("woodbury", "sufficient_statistics")
+
 
 class LinearLMEOracle:
     """
@@ -41,7 +51,8 @@ class LinearLMEOracle:
 
     """
 
-    def __init__(self, problem: LinearLMEProblem):
+    def __init__(self, problem: LinearLMEProblem, mode: str = "cholesky", cache_max_bytes: int = 2 ** 27,
+                 n_jobs: int = 1, max_low_rank_updates: int = 0, beta_solver: str = "direct", cg_tol: float = 1e-10):
         """
         Creates an oracle on top of the given problem
 
@@ -49,12 +60,98 @@ class LinearLMEOracle:
         ----------
         problem : LinearLMEProblem
             set of data and answers. See docs for LinearLMEProblem class for more details.
+        mode : {'cholesky', 'packed', 'batched', 'woodbury', 'sufficient_statistics'}, default = 'cholesky'
+            How the oracle handles the matrices Ω_i = Z_i*diag(𝛄)*Z_i^T + Λ_i:
+
+                -   | 'cholesky' : Forms every Ω_i explicitly and computes its Cholesky factor.
+                    | Costs O(n_i³) per group for every new 𝛄.
+                -   | 'packed' : Same as 'cholesky', but keeps only the lower Cholesky factor in LAPACK's packed
+                    | format (n_i*(n_i+1)/2 numbers) and applies L_i^{-1} by triangular solves instead of
+                    | storing the explicit inverse. Needs about 4 times less memory for the factors.
+                -   | 'batched' : Same as 'cholesky', but groups of the same size are stacked into 3-D arrays
+                    | and processed by one vectorized call per size. Removes the per-group interpreter
+                    | overhead, which dominates when there are many small groups.
+                -   | 'woodbury' : Never forms Ω_i. Works through the k×k capacitance matrices
+                    | diag(1/𝛄) + Z_i^T*Λ_i^{-1}*Z_i instead (Woodbury identity), so the cost per group is
+                    | linear in n_i. Preferable when groups are large and random effects are few.
+                -   | 'sufficient_statistics' : Same as 'woodbury', but also computes the Gram blocks
+                    | X_i^TΛ_i^{-1}X_i, X_i^TΛ_i^{-1}Z_i, X_i^TΛ_i^{-1}y_i, Z_i^TΛ_i^{-1}y_i, y_i^TΛ_i^{-1}y_i once
+                    | at creation and never touches the data afterwards. Every call costs O(G*(p+k)³) regardless
+                    | of the number of observations. Requires answers.
+        cache_max_bytes : int, default = 2**27
+            Memory budget (in bytes) of the LRU cache of factorizations for previously seen 𝛄's. Line search
+            evaluates the loss at the same 𝛄's repeatedly, so the cached factors are reused instead of being
+            recomputed. Set to 0 to keep only the factors for the latest 𝛄.
+        n_jobs : int, default = 1
+            Number of worker processes. If greater than one, the groups are split into n_jobs shards of
+            approximately equal computational cost, and every shard is served by a persistent worker process
+            which keeps its own factors and cache. Workers return only small reduced arrays.
+            Negative values count from the number of processors, as in scikit-learn: -1 means using
+            all processors, -2 all but one, and so on (at least one). 0 is not allowed.
+            Call close() to stop the workers when the oracle is not needed anymore.
+        max_low_rank_updates : int, default = 0
+            Only for 'cholesky' mode. When only a few components of 𝛄 change, Ω_i changes by a low-rank term
+            Σ_j δ_j*z_j*z_j^T, so the factors L_i and L_i^{-1} are updated in O(n_i²) per changed component
+            instead of being recomputed in O(n_i³). To bound the accumulation of round-off errors,
+            the factors are recomputed from scratch after max_low_rank_updates consecutive updates.
+            0 means always recomputing the factors.
+        beta_solver : {'direct', 'cg'}, default = 'direct'
+            How optimal_beta solves the p×p system for β:
+
+                -   | 'direct' : Assembles the kernel ∑X_i^TΩ_i^{-1}X_i and solves the system by np.linalg.solve.
+                    | Costs O(N*p²) to assemble and O(p³) to solve.
+                -   | 'cg' : Never forms the kernel. Solves the system by conjugate gradients with the Jacobi
+                    | preconditioner, applying the kernel to a vector as a sum of per-group products
+                    | (whitened blocks, or the Woodbury identity in Woodbury-based modes), and starts from
+                    | the given β or from the previous solution. Costs O(N*p) per iteration. Preferable for
+                    | wide designs with thousands of fixed effects. If conjugate gradients do not converge
+                    | in 2*p iterations, or meet a direction of non-positive curvature (e.g. for collinear
+                    | columns), the oracle warns and solves the system directly.
+        cg_tol : float, default = 1e-10
+            Only for beta_solver='cg'. Conjugate gradients stop when the norm of the residual of the system
+            falls below cg_tol times the norm of its right-hand side.
         """
 
+        self.workers = []
+        if n_jobs == 0:
+            raise ValueError("n_jobs should be non-zero")
+        if beta_solver not in ("direct", "cg"):
+            raise ValueError("Unknown beta_solver: %s" % beta_solver)
+        if mode not in ("cholesky", "packed", "batched") + woodbury_modes:
+            raise ValueError("Unknown mode: %s" % mode)
+        if max_low_rank_updates > 0 and mode != "cholesky":
+            raise ValueError("Low-rank updates are only supported in 'cholesky' mode.")
+        if mode == "sufficient_statistics" and problem.answers is None and problem.sufficient_statistics is None:
+            raise ValueError("Sufficient statistics mode requires a problem with answers.")
+        if problem.fixed_features_packed is None and mode != "sufficient_statistics":
+            raise ValueError("A problem without data requires 'sufficient_statistics' mode.")
         self.problem = problem
+        self.mode = mode
         self.omega_cholesky_inv = []
         self.omega_cholesky = []
+        self.omega_cholesky_packed = []
+        self.capacitance_inv = []
+        self.omega_logdets = []
+        self.buckets_cholesky_inv = []
+        self.whitened_blocks = None
+        self.whitening_count = 0
         self.gamma = None
+        self.factors_key = None
+        self.cache_max_bytes = cache_max_bytes
+        self.factors_cache = OrderedDict()
+        self.factors_cache_sizes = {}
+        self.factors_cache_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.max_low_rank_updates = max_low_rank_updates
+        self.low_rank_updates = 0
+        self.beta_solver = beta_solver
+        self.cg_tol = cg_tol
+        self.cg_iterations = 0
+        self.cg_beta = None
+        if n_jobs < 0:
+            n_jobs = max(os.cpu_count() + 1 + n_jobs, 1)
+        self.n_jobs = min(n_jobs, self.problem.num_groups)
         beta_to_gamma_map = np.zeros(self.problem.num_fixed_effects)
         beta_counter = 0
         gamma_counter = 0
@@ -71,6 +168,146 @@ class LinearLMEOracle:
             else:
                 continue
         self.beta_to_gamma_map = beta_to_gamma_map
+        # fixed effects which are random effects as well, and their positions among the random effects
+        self.paired_beta_idx = np.flatnonzero(beta_to_gamma_map >= 0)
+        self.paired_gamma_idx = beta_to_gamma_map[self.paired_beta_idx].astype(int)
+        if self.n_jobs > 1:
+            self._start_workers()
+        else:
+            self._precompute()
+
+    def _precompute(self):
+        """
+        Precomputes the mode-specific data which does not depend on 𝛄.
+
+        Returns
+        -------
+            None
+        """
+        if self.problem.sufficient_statistics is not None and self.mode in woodbury_modes:
+            # the problem has already accumulated them, possibly without keeping the data
+            if self.mode == "woodbury":
+                names = ("zTlambda_invZ", "lambda_logdets")
+            else:
+                names = self.problem.sufficient_statistics.keys()
+            for name in names:
+                setattr(self, name, list(self.problem.sufficient_statistics[name]))
+            return None
+        if self.mode in woodbury_modes:
+            # Λ_i-weighted Gram matrices of random features do not depend on 𝛄, so we compute them only once.
+            self.zTlambda_invZ = []
+            self.lambda_logdets = []
+            for x, y, z, stds in self.problem:
+                self.zTlambda_invZ.append(z.T.dot(z / stds[:, np.newaxis]))
+                self.lambda_logdets.append(np.sum(np.log(stds)))
+        if self.mode == "batched":
+            # Groups of the same size are stacked together: each bucket is a tuple of (groups indices, rows of the
+            # packed arrays which belong to these groups, shape [b, n]). Only indices are kept here, the stacked blocks
+            # are gathered from the packed storage by _buckets one bucket at a time, so the data is not duplicated.
+            self.buckets = []
+            groups_sizes = np.array(self.problem.groups_sizes)
+            for size in np.unique(groups_sizes):
+                idx = np.where(groups_sizes == size)[0]
+                self.buckets.append((idx, self.problem.group_offsets[idx][:, np.newaxis] + np.arange(size)))
+        if self.mode == "sufficient_statistics":
+            self.xTlambda_invX = []
+            self.xTlambda_invZ = []
+            self.xTlambda_invY = []
+            self.zTlambda_invY = []
+            self.yTlambda_invY = []
+            for x, y, z, stds in self.problem:
+                xTl = (x / stds[:, np.newaxis]).T
+                self.xTlambda_invX.append(xTl.dot(x))
+                self.xTlambda_invZ.append(xTl.dot(z))
+                self.xTlambda_invY.append(xTl.dot(y))
+                self.zTlambda_invY.append(z.T.dot(y / stds))
+                self.yTlambda_invY.append(y.dot(y / stds))
+        return None
+
+    def _start_workers(self):
+        """
+        Splits the groups into n_jobs shards of approximately equal cost and starts a worker process for each.
+
+        The cost of a group is estimated as n_i³ for Cholesky-based modes, n_i*k² for 'woodbury' mode,
+        and 1 for 'sufficient_statistics' mode. Groups are assigned greedily from the most expensive ones
+        to the least loaded shard.
+
+        Returns
+        -------
+            None
+        """
+        groups_sizes = np.array(self.problem.groups_sizes, dtype=float)
+        if self.mode == "woodbury":
+            costs = groups_sizes * self.problem.num_random_effects ** 2
+        elif self.mode == "sufficient_statistics":
+            costs = np.ones(self.problem.num_groups)
+        else:
+            costs = groups_sizes ** 3
+        loads = [(0, j) for j in range(self.n_jobs)]
+        shards = [[] for _ in range(self.n_jobs)]
+        for i in np.argsort(-costs, kind="stable"):
+            load, j = heapq.heappop(loads)
+            shards[j].append(i)
+            heapq.heappush(loads, (load + costs[i], j))
+        self.shards = [np.sort(shard) for shard in shards]
+        for shard in self.shards:
+            parent_connection, child_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_oracle_worker,
+                                             args=(child_connection,
+                                                   self.problem.take_groups(shard),
+                                                   self.mode,
+                                                   self.cache_max_bytes,
+                                                   self.max_low_rank_updates),
+                                             daemon=True)
+            worker.start()
+            child_connection.close()
+            self.workers.append((worker, parent_connection))
+        return None
+
+    def _map(self, method: str, *args, **kwargs):
+        """
+        Calls the method of the single-process oracles of all the workers and collects their results.
+
+        Parameters
+        ----------
+        method : str
+            Name of the LinearLMEOracle's method to call.
+        args, kwargs :
+            Arguments of the method.
+
+        Returns
+        -------
+        results : list
+            Results of the method for every shard, in the order of self.shards.
+        """
+        for worker, connection in self.workers:
+            connection.send((method, args, kwargs))
+        results = [connection.recv() for worker, connection in self.workers]
+        for success, result in results:
+            if not success:
+                raise result
+        return [result for success, result in results]
+
+    def close(self):
+        """
+        Stops the worker processes, if there are any.
+
+        Returns
+        -------
+            None
+        """
+        for worker, connection in self.workers:
+            try:
+                connection.send(None)
+                connection.close()
+            except (OSError, ValueError):
+                pass
+            worker.join()
+        self.workers = []
+        return None
+
+    def __del__(self):
+        self.close()
 
     def _recalculate_cholesky(self, gamma: np.ndarray):
         """
@@ -81,6 +318,9 @@ class LinearLMEOracle:
 
         Ω_i = Z_i*diag(𝛄)*Z_i^T + Λ_i = L_i*L_i^T
 
+        Factors of previously seen 𝛄's are taken from the LRU cache when they are still there.
+        The whitened blocks of the previous 𝛄 are discarded; they are recomputed on demand by _whitened_blocks.
+
         Parameters
         ----------
         gamma : np.ndarray, shape=[k]
@@ -92,20 +332,451 @@ class LinearLMEOracle:
                 if all the Cholesky factors were updated and stored successfully, otherwise raises and error
         """
 
+        if self.workers:
+            # workers keep their own factors
+            self.gamma = gamma
+            return None
         if (self.gamma != gamma).any():
-            self.omega_cholesky = []
-            self.omega_cholesky_inv = []
-            gamma_mat = np.diag(gamma)
+            key = np.asarray(gamma, dtype=float).tobytes()
+            if key in self.factors_cache:
+                self.factors_cache.move_to_end(key)
+                for name, value in zip(self._factors_names(), self.factors_cache[key]):
+                    setattr(self, name, value)
+                self.cache_hits += 1
+                self.gamma = gamma
+                self.factors_key = key
+                return None
+            self.cache_misses += 1
             invert_upper_triangular: Callable[[np.ndarray], np.ndarray] = get_lapack_funcs("trtri")
-            for x, y, z, stds in self.problem:
-                omega = z.dot(gamma_mat).dot(z.T) + np.diag(stds)
-                L = np.linalg.cholesky(omega)
-                L_inv = invert_upper_triangular(L.T)[0].T
-                self.omega_cholesky.append(L)
-                self.omega_cholesky_inv.append(L_inv)
+            if self.mode in woodbury_modes:
+                self._recalculate_capacitance(gamma, invert_upper_triangular)
+            elif self.mode == "batched":
+                self.buckets_cholesky_inv = []
+                for idx, x, y, z, stds in self._buckets():
+                    omega = np.einsum('bik,k,bjk->bij', z, gamma, z)
+                    omega += stds[:, :, np.newaxis] * np.eye(stds.shape[1])
+                    L = np.linalg.cholesky(omega)
+                    # L^{-1} is triangular as well, so it is computed by trtri group by group
+                    # rather than by a general solve of the whole stack
+                    self.buckets_cholesky_inv.append(np.array([invert_upper_triangular(L_b.T)[0].T for L_b in L]))
+            elif self.mode == "packed":
+                factorize_packed = get_lapack_funcs("pptrf")
+                self.omega_cholesky_packed = []
+                for x, y, z, stds in self.problem:
+                    omega_packed = _packed_omega(z, gamma, stds)
+                    L_packed, info = factorize_packed(len(stds), omega_packed, lower=1, overwrite_ap=1)
+                    if info > 0:
+                        raise np.linalg.LinAlgError("Matrix is not positive definite")
+                    self.omega_cholesky_packed.append(L_packed)
+            elif self.gamma is not None and self.low_rank_updates < self.max_low_rank_updates:
+                self._update_cholesky(gamma, invert_upper_triangular)
+                self.low_rank_updates += 1
+            else:
+                self.omega_cholesky = []
+                self.omega_cholesky_inv = []
+                gamma_mat = np.diag(gamma)
+                for x, y, z, stds in self.problem:
+                    omega = z.dot(gamma_mat).dot(z.T) + np.diag(stds)
+                    L = np.linalg.cholesky(omega)
+                    L_inv = invert_upper_triangular(L.T)[0].T
+                    self.omega_cholesky.append(L)
+                    self.omega_cholesky_inv.append(L_inv)
+                self.low_rank_updates = 0
+            self.whitened_blocks = None
+            self._cache_factors(key)
             self.gamma = gamma
+            self.factors_key = key
         return None
 
+    def _update_cholesky(self, gamma: np.ndarray, invert_upper_triangular: Callable):
+        """
+        Updates the Cholesky factors of Ω_i's for the previous 𝛄 to the factors for the new 𝛄.
+
+        Ω_i(𝛄_new) = Ω_i(𝛄) + Σ_j (𝛄_new_j - 𝛄_j)*z_ij*z_ij^T, where the sum goes over the changed components only,
+        so every changed component is a rank-one update (or downdate) of the factors. Updates go before downdates
+        to keep the intermediate matrices positive definite. The groups where the update is not cheaper than
+        a new factorization, or where a downdate loses positive definiteness, are factorized from scratch.
+
+        Parameters
+        ----------
+        gamma : np.ndarray, shape=[k]
+            new vector of covariances for random effects
+        invert_upper_triangular : callable
+            LAPACK's trtri routine
+
+        Returns
+        -------
+            None
+        """
+        delta = np.asarray(gamma, dtype=float) - np.asarray(self.gamma, dtype=float)
+        changed = np.where(delta != 0)[0]
+        changed = changed[np.argsort(-delta[changed], kind="stable")]
+        omega_cholesky = []
+        omega_cholesky_inv = []
+        for (x, y, z, stds), L, L_inv in zip(self.problem, self.omega_cholesky, self.omega_cholesky_inv):
+            # one rank-one modification costs about 10*n_i² flops, a new factorization -- about 2/3*n_i³
+            if 15 * len(changed) < z.shape[0]:
+                for j in changed:
+                    factors = _cholesky_rank_one_update(L, L_inv, z[:, j], delta[j])
+                    if factors is None:
+                        break
+                    L, L_inv = factors
+                else:
+                    omega_cholesky.append(L)
+                    omega_cholesky_inv.append(L_inv)
+                    continue
+            omega = z.dot(np.diag(gamma)).dot(z.T) + np.diag(stds)
+            L = np.linalg.cholesky(omega)
+            omega_cholesky.append(L)
+            omega_cholesky_inv.append(invert_upper_triangular(L.T)[0].T)
+        self.omega_cholesky = omega_cholesky
+        self.omega_cholesky_inv = omega_cholesky_inv
+        return None
+
+    def _factors_names(self):
+        """
+        Returns the names of the attributes which store the factors for the current 𝛄 in the current mode.
+        In 'cholesky' mode the number of low-rank updates which the factors went through is stored with them,
+        so that a cache hit restores how far the factors are from the last factorization from scratch.
+        """
+        if self.mode in woodbury_modes:
+            return "capacitance_inv", "omega_logdets"
+        elif self.mode == "batched":
+            return "buckets_cholesky_inv", "whitened_blocks"
+        elif self.mode == "packed":
+            return "omega_cholesky_packed", "whitened_blocks"
+        else:
+            return "omega_cholesky", "omega_cholesky_inv", "whitened_blocks", "low_rank_updates"
+
+    def _cache_factors(self, key: bytes):
+        """
+        Puts the factors for the current 𝛄 to the LRU cache and evicts the least recently used ones
+        until the cache fits into cache_max_bytes. Replaces the entry if it is already there.
+
+        Parameters
+        ----------
+        key : bytes
+            Bytes of 𝛄 which the factors were computed for.
+
+        Returns
+        -------
+            None
+        """
+        if key in self.factors_cache:
+            del self.factors_cache[key]
+            self.factors_cache_bytes -= self.factors_cache_sizes.pop(key)
+        factors = tuple(getattr(self, name) for name in self._factors_names())
+        size = _nbytes(factors)
+        if size > self.cache_max_bytes:
+            return None
+        self.factors_cache[key] = factors
+        self.factors_cache_sizes[key] = size
+        self.factors_cache_bytes += size
+        while self.factors_cache_bytes > self.cache_max_bytes:
+            evicted_key, _ = self.factors_cache.popitem(last=False)
+            self.factors_cache_bytes -= self.factors_cache_sizes.pop(evicted_key)
+        return None
+
+    def _buckets(self):
+        """
+        Gathers the stacked blocks of same-sized groups from the packed storage of the problem in 'batched' mode.
+
+        Returns
+        -------
+            generator of tuples (groups indices, X of shape [b, n, p], y of shape [b, n] or None,
+            Z of shape [b, n, k], stds of shape [b, n]) for every bucket.
+        """
+        for idx, rows in self.buckets:
+            yield (idx,
+                   self.problem.fixed_features_packed[rows],
+                   None if self.problem.answers_packed is None else self.problem.answers_packed[rows],
+                   self.problem.random_features_packed[rows],
+                   self.problem.obs_stds_packed[rows])
+
+    def _cholesky_solvers(self):
+        """
+        Yields the data of every group together with the means to apply the inverse of its Cholesky factor.
+
+        In 'cholesky' mode L_i^{-1} is applied by a matrix product with the stored inverse,
+        in 'packed' mode -- by triangular solves with the packed factor.
+
+        Returns
+        -------
+            generator of tuples ((X_i, y_i, Z_i, stds_i), solve, logdet), where solve(b) = L_i^{-1}*b
+            and logdet = log(det(L_i)) = 1/2*log(det(Ω_i)).
+        """
+        if self.mode == "packed":
+            for data, L_packed in zip(self.problem, self.omega_cholesky_packed):
+                n = len(data[3])
+                diagonal = L_packed[np.arange(n) * n - np.arange(n) * (np.arange(n) - 1) // 2]
+                yield data, partial(_packed_triangular_solve, L_packed), np.sum(np.log(diagonal))
+        else:
+            for data, L_inv in zip(self.problem, self.omega_cholesky_inv):
+                yield data, L_inv.dot, -np.sum(np.log(np.diag(L_inv)))
+
+    def _whitened_blocks(self):
+        """
+        Returns the whitened design blocks for the current 𝛄.
+
+        Every method needs L_i^{-1}*X_i, L_i^{-1}*y_i, and L_i^{-1}*Z_i, where Ω_i = L_i*L_i^T. They are computed
+        only once per 𝛄 and stored next to the factors (in the LRU cache as well), so all the terms which depend
+        on β are assembled by matrix-vector products: L_i^{-1}*ξ_i = L_i^{-1}*y_i - (L_i^{-1}*X_i)*β.
+        whitening_count counts how many times the blocks were computed.
+
+        Returns
+        -------
+            list of tuples (L_i^{-1}*X_i, L_i^{-1}*y_i, L_i^{-1}*Z_i, log(det(L_i))) for every group,
+            or for every bucket of same-sized groups in 'batched' mode (then the blocks are stacked along
+            the leading dimension and the log-determinants are summed). L_i^{-1}*y_i is None when the problem
+            has no answers.
+        """
+        if self.whitened_blocks is None:
+            self.whitening_count += 1
+            if self.mode == "batched":
+                self.whitened_blocks = [(np.matmul(L_inv, x),
+                                         None if y is None else np.einsum('bij,bj->bi', L_inv, y),
+                                         np.matmul(L_inv, z),
+                                         -np.sum(np.log(np.diagonal(L_inv, axis1=1, axis2=2))))
+                                        for (idx, x, y, z, stds), L_inv in zip(self._buckets(),
+                                                                                 self.buckets_cholesky_inv)]
+            else:
+                self.whitened_blocks = [(solve(x), None if y is None else solve(y), solve(z), logdet)
+                                        for (x, y, z, stds), solve, logdet in self._cholesky_solvers()]
+            if self.factors_key is not None:
+                self._cache_factors(self.factors_key)
+        return self.whitened_blocks
+
+    def _recalculate_capacitance(self, gamma: np.ndarray, invert_upper_triangular: Callable):
+        """
+        Recalculates inverses of capacitance matrices and log-determinants of all Ω_i's when gamma changes.
+
+        By the Woodbury identity::
+
+            Ω_i^{-1} = Λ_i^{-1} - Λ_i^{-1}*Z_i*P_i*Z_i^T*Λ_i^{-1},
+
+            P_i = (diag(1/𝛄) + Z_i^T*Λ_i^{-1}*Z_i)^{-1} = S*(I + S*Z_i^T*Λ_i^{-1}*Z_i*S)^{-1}*S, S = diag(√𝛄)
+
+            ln(det(Ω_i)) = ln(det(Λ_i)) + ln(det(I + S*Z_i^T*Λ_i^{-1}*Z_i*S))
+
+        The last form of P_i stays well-defined when some of 𝛄 are zeros. Only k×k matrices are factorized here.
+
+        Parameters
+        ----------
+        gamma : np.ndarray, shape=[k]
+            vector of covariances for random effects
+        invert_upper_triangular : Callable
+            LAPACK's trtri routine.
+
+        Returns
+        -------
+            None :
+                if all the factors were updated and stored successfully, otherwise raises and error
+        """
+
+        self.capacitance_inv = []
+        self.omega_logdets = []
+        # Variances are non-negative; negative values can come only from round-off errors in the line search.
+        gamma_sqrt = np.sqrt(np.maximum(gamma, 0))
+        identity = np.eye(len(gamma))
+        for zTlz, lambda_logdet in zip(self.zTlambda_invZ, self.lambda_logdets):
+            capacitance = identity + gamma_sqrt[:, np.newaxis] * zTlz * gamma_sqrt
+            C = np.linalg.cholesky(capacitance)
+            C_inv = invert_upper_triangular(C.T)[0].T * gamma_sqrt
+            self.capacitance_inv.append(C_inv.T.dot(C_inv))
+            self.omega_logdets.append(lambda_logdet + 2 * np.sum(np.log(np.diag(C))))
+        return None
+
+    def _design_statistics(self):
+        """
+        Yields Λ_i-weighted Gram blocks of the design for every group, which are used in Woodbury-based modes.
+
+        Returns
+        -------
+            generator of tuples (X_i^TΛ_i^{-1}X_i, X_i^TΛ_i^{-1}Z_i, X_i^TΛ_i^{-1}y_i, Z_i^TΛ_i^{-1}y_i).
+            They are precomputed in the sufficient statistics mode and are computed from the data otherwise.
+        """
+        if self.mode == "sufficient_statistics":
+            yield from zip(self.xTlambda_invX, self.xTlambda_invZ, self.xTlambda_invY, self.zTlambda_invY)
+        else:
+            for x, y, z, stds in self.problem:
+                xTl = (x / stds[:, np.newaxis]).T
+                yield xTl.dot(x), xTl.dot(z), xTl.dot(y), z.T.dot(y / stds)
+
+    def _residual_statistics(self, beta: np.ndarray):
+        """
+        Yields Λ_i-weighted statistics of the residuals ξ_i = y_i - X_i*β for every group.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+
+        Returns
+        -------
+            generator of tuples (Z_i^TΛ_i^{-1}ξ_i, ξ_i^TΛ_i^{-1}ξ_i).
+        """
+        if self.mode == "sufficient_statistics":
+            for xTlx, xTlz, xTly, zTly, yTly in zip(self.xTlambda_invX, self.xTlambda_invZ, self.xTlambda_invY,
+                                                    self.zTlambda_invY, self.yTlambda_invY):
+                yield zTly - xTlz.T.dot(beta), yTly - 2 * beta.dot(xTly) + beta.dot(xTlx).dot(beta)
+        else:
+            for x, y, z, stds in self.problem:
+                xi = y - x.dot(beta)
+                lambda_inv_xi = xi / stds
+                yield z.T.dot(lambda_inv_xi), xi.dot(lambda_inv_xi)
+
+    def _drop_statistics(self, beta):
+        """
+        Returns the quantities which drop penalties are assembled from, stacked over all the groups.
+
+        In Woodbury-based modes they are computed for all the groups at once by batched products of k×k
+        and k×n matrices. In other modes they are reduced from the whitened blocks, which are shared with
+        the loss and its derivatives. Here ξ_i = y_i - X_i*β, and the pairs (j, m) run over the fixed effects
+        which are random effects as well: β_j and 𝛄_m correspond to the same feature.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+
+        Returns
+        -------
+            tuple of np.ndarray: Z_i^TΩ_i^{-1}ξ_i of shape [G, k], X_i^TΩ_i^{-1}ξ_i of shape [G, n],
+            diag(X_i^TΩ_i^{-1}X_i) of shape [G, n], (Z_i^TΩ_i^{-1}X_i)_{mj} for all the pairs (j, m) of shape [G, s],
+            and diag(Z_i^TΩ_i^{-1}Z_i) of shape [G, k].
+        """
+        beta_idx, gamma_idx = self.paired_beta_idx, self.paired_gamma_idx
+        if self.mode in woodbury_modes:
+            xTlx, xTlz, xTly, zTly = (np.array(statistics) for statistics in zip(*self._design_statistics()))
+            zTlz = np.array(self.zTlambda_invZ)
+            P = np.array(self.capacitance_inv)
+            zTlxi = zTly - np.einsum('gpk,p->gk', xTlz, beta)
+            P_zTlxi = np.einsum('gkl,gl->gk', P, zTlxi)
+            xTlz_P = np.matmul(xTlz, P)
+            zTlz_P = np.matmul(zTlz, P)
+            return (zTlxi - np.einsum('gkl,gl->gk', zTlz, P_zTlxi),
+                    xTly - np.einsum('gpq,q->gp', xTlx, beta) - np.einsum('gpk,gk->gp', xTlz, P_zTlxi),
+                    np.diagonal(xTlx, axis1=1, axis2=2) - np.sum(xTlz_P * xTlz, axis=2),
+                    (xTlz[:, beta_idx, gamma_idx]
+                     - np.einsum('gsk,gsk->gs', zTlz_P[:, gamma_idx, :], xTlz[:, beta_idx, :])),
+                    np.diagonal(zTlz, axis1=1, axis2=2) - np.sum(zTlz_P * zTlz, axis=2))
+        if self.mode == "batched":
+            statistics = []
+            for Lx, Ly, Lz, _ in self._whitened_blocks():
+                Lxi = Ly - Lx.dot(beta)
+                statistics.append((np.einsum('bik,bi->bk', Lz, Lxi),
+                                   np.einsum('bip,bi->bp', Lx, Lxi),
+                                   np.sum(Lx ** 2, axis=1),
+                                   np.einsum('bis,bis->bs', Lz[:, :, gamma_idx], Lx[:, :, beta_idx]),
+                                   np.sum(Lz ** 2, axis=1)))
+            return tuple(np.concatenate(statistic) for statistic in zip(*statistics))
+        statistics = []
+        for Lx, Ly, Lz, _ in self._whitened_blocks():
+            Lxi = Ly - Lx.dot(beta)
+            statistics.append((Lz.T.dot(Lxi),
+                               Lx.T.dot(Lxi),
+                               np.sum(Lx ** 2, axis=0),
+                               np.sum(Lz[:, gamma_idx] * Lx[:, beta_idx], axis=0),
+                               np.sum(Lz ** 2, axis=0)))
+        return tuple(np.array(statistic) for statistic in zip(*statistics))
+
+    def _drop_penalties(self, beta: np.ndarray, gamma: np.ndarray):
+        """
+        Returns the drop penalties: how much the loss ℒ(β, 𝛄) increases when one coefficient is set to zero.
+
+        Dropping a coefficient of β which is also a random effect drops the respective 𝛄 as well.
+        These penalties are used as weights in the regularizer of LinearLMEOracleW.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+
+        Returns
+        -------
+        drop_penalties_beta : np.ndarray, shape = [n]
+            Drop penalties for the coefficients of β.
+        drop_penalties_gamma : np.ndarray, shape = [k]
+            Drop penalties for the coefficients of 𝛄.
+        """
+        self._recalculate_cholesky(gamma)
+        if self.workers:
+            shards_penalties = self._map("_drop_penalties", beta, gamma)
+            return (sum(penalties[0] for penalties in shards_penalties),
+                    sum(penalties[1] for penalties in shards_penalties))
+
+        zTomega_xi, xTomega_xi, xTomega_x_diag, zTomega_x_paired, h1 = self._drop_statistics(beta)
+        # Calculate drop price for gammas individually
+        g1 = zTomega_xi ** 2
+        drop_penalties_gamma = np.sum(-gamma * g1 / (1 - gamma * h1)
+                                      + np.log(1 + gamma * h1 / (1 - gamma * h1)), axis=0)
+        # Calculate drop price for betas only
+        drop_penalties_beta = np.sum(-2 * beta * xTomega_xi - beta ** 2 * xTomega_x_diag, axis=0)
+        # Calculate drop price for gammas given dropped betas
+        beta_idx, gamma_idx = self.paired_beta_idx, self.paired_gamma_idx
+        gamma_s = gamma[gamma_idx]
+        h1_s = h1[:, gamma_idx]
+        g2_s = zTomega_xi[:, gamma_idx] + zTomega_x_paired * beta[beta_idx]
+        drop_penalties_beta[beta_idx] += np.sum(-gamma_s * (g2_s ** 2) / (1 - gamma_s * h1_s)
+                                                + np.log(1 + gamma_s * h1_s / (1 - gamma_s * h1_s)),
+                                                axis=0)
+
+        # we invert the sign and take into account the 1/2 multiplier for the loss function
+        drop_penalties_beta /= -2
+        drop_penalties_gamma /= -2
+        return drop_penalties_beta, drop_penalties_gamma
+
+    def marginal_scores(self, beta: np.ndarray, gamma: np.ndarray):
+        """
+        Returns how much every coefficient, taken alone, can improve the loss function ℒ(β, 𝛄) at the given point.
+
+        The score of β_j is the decrease of ℒ when only β_j is optimized with all other coefficients fixed::
+
+            (Σ_i X_ij^T*Ω_i^{-1}*ξ_i)^2 / (2*Σ_i X_ij^T*Ω_i^{-1}*X_ij)
+
+        The score of 𝛄_j is minus the derivative of ℒ w.r.t. 𝛄_j at 𝛄_j = 0 with all other coefficients fixed.
+        A non-positive score means that 𝛄_j stays at zero when optimized alone. The derivative is found
+        from the statistics of the current Ω_i by the Sherman–Morrison formula, as in the drop penalties.
+
+        These scores are cheap (the statistics are shared with the drop penalties), so they are used to screen
+        out the columns which are unlikely to enter the model before fitting it.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+
+        Returns
+        -------
+        scores_beta : np.ndarray, shape = [n]
+            Scores of the coefficients of β.
+        scores_gamma : np.ndarray, shape = [k]
+            Scores of the coefficients of 𝛄.
+        """
+        if self.workers:
+            self._recalculate_cholesky(gamma)
+            statistics = [sum(shard_statistics)
+                          for shard_statistics in zip(*self._map("_marginal_statistics", beta, gamma))]
+        else:
+            statistics = self._marginal_statistics(beta, gamma)
+        xTomega_xi, xTomega_x_diag, gradient_gamma = statistics
+        return xTomega_xi ** 2 / (2 * xTomega_x_diag), -gradient_gamma
+
+    def _marginal_statistics(self, beta: np.ndarray, gamma: np.ndarray):
+        """
+        Returns the sums over the groups which marginal_scores are assembled from, see marginal_scores.
+        """
+        self._recalculate_cholesky(gamma)
+        zTomega_xi, xTomega_xi, xTomega_x_diag, _, zTomega_z_diag = self._drop_statistics(beta)
+        # the statistics of Ω_i without the j-th random effect, by the Sherman–Morrison formula
+        shrinkage = 1 - gamma * zTomega_z_diag
+        gradient_gamma = np.sum(zTomega_z_diag / shrinkage - (zTomega_xi / shrinkage) ** 2, axis=0) / 2
+        return np.sum(xTomega_xi, axis=0), np.sum(xTomega_x_diag, axis=0), gradient_gamma
+
     def loss(self, beta: np.ndarray, gamma: np.ndarray, **kwargs) -> float:
         """
         Returns the loss function value ℒ(β, 𝛄).
@@ -125,11 +796,60 @@ class LinearLMEOracle:
                 The value of the loss function: ℒ(β, 𝛄)
         """
 
-        result = 0
-        self._recalculate_cholesky(gamma)
-        for (x, y, z, stds), L_inv in zip(self.problem, self.omega_cholesky_inv):
-            xi = y - x.dot(beta)
-            result += 1 / 2 * np.sum(L_inv.dot(xi) ** 2) - np.sum(np.log(np.diag(L_inv)))
+        return self._loss_and_derivatives(beta, gamma, gradient=False)[0]
+
+    def losses(self, beta: np.ndarray, gammas: np.ndarray, **kwargs) -> np.ndarray:
+        """
+        Returns the loss function values ℒ(β, 𝛄) for several 𝛄's at once, e.g. for the trial steps of a line search.
+
+        All the candidates are evaluated in one pass over the groups: the factorizations of Ω_i (or of the
+        capacitance matrices in Woodbury-based modes) for all 𝛄's are stacked and done by one batched LAPACK call
+        per group. The factors of the current 𝛄 and the LRU cache are left untouched.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+        gammas : np.ndarray, shape = [c, k]
+            Vectors of estimates of random effects, one per row.
+        kwargs :
+            Not used, left for future and for passing debug/experimental parameters
+
+        Returns
+        -------
+            result : np.ndarray, shape = [c]
+                The values of the loss function: ℒ(β, 𝛄_j) for every row 𝛄_j of gammas
+        """
+        # Variances are non-negative; negative values can come only from round-off errors in the line search.
+        gammas = np.maximum(np.atleast_2d(gammas), 0)
+        if self.workers:
+            return sum(self._map("losses", beta, gammas))
+        result = np.zeros(len(gammas))
+        if self.mode in woodbury_modes:
+            gammas_sqrt = np.sqrt(gammas)
+            identity = np.eye(gammas.shape[1])
+            for (zTlxi, xiTlxi), zTlz, lambda_logdet in zip(self._residual_statistics(beta),
+                                                            self.zTlambda_invZ,
+                                                            self.lambda_logdets):
+                # C*C^T = I + S*Z_i^TΛ_i^{-1}Z_i*S for every candidate S = diag(√𝛄), see _recalculate_capacitance
+                C = np.linalg.cholesky(identity + gammas_sqrt[:, :, np.newaxis] * zTlz * gammas_sqrt[:, np.newaxis])
+                w = np.linalg.solve(C, (gammas_sqrt * zTlxi)[:, :, np.newaxis])
+                result += (1 / 2 * (xiTlxi - np.sum(w ** 2, axis=(1, 2)))
+                           + 1 / 2 * lambda_logdet + np.sum(np.log(np.diagonal(C, axis1=1, axis2=2)), axis=1))
+        else:
+            if self.mode == "batched":
+                blocks = ((x, y, z, stds) for idx, x, y, z, stds in self._buckets())
+            else:
+                blocks = ((x[np.newaxis], y[np.newaxis], z[np.newaxis], stds[np.newaxis])
+                          for x, y, z, stds in self.problem)
+            for x, y, z, stds in blocks:
+                # Ω_i for every candidate and every group of the block, shape = [c, b, n, n]
+                omega = np.einsum('bik,ck,bjk->cbij', z, gammas, z)
+                omega += stds[:, :, np.newaxis] * np.eye(stds.shape[1])
+                L = np.linalg.cholesky(omega)
+                Lxi = np.linalg.solve(L, (y - x.dot(beta))[np.newaxis, :, :, np.newaxis])
+                result += (1 / 2 * np.sum(Lxi ** 2, axis=(1, 2, 3))
+                           + np.sum(np.log(np.diagonal(L, axis1=2, axis2=3)), axis=(1, 2)))
         return result
 
     def gradient_gamma(self, beta: np.ndarray, gamma: np.ndarray, **kwargs) -> np.ndarray:
@@ -151,13 +871,7 @@ class LinearLMEOracle:
                 The gradient of the loss function with respect to gamma: ∇_𝛄[ℒ](β, 𝛄)
         """
 
-        self._recalculate_cholesky(gamma)
-        grad_gamma = np.zeros(len(gamma))
-        for (x, y, z, stds), L_inv in zip(self.problem, self.omega_cholesky_inv):
-            xi = y - x.dot(beta)
-            Lz = L_inv.dot(z)
-            grad_gamma += 1 / 2 * np.sum(Lz ** 2, axis=0) - 1 / 2 * Lz.T.dot(L_inv.dot(xi)) ** 2
-        return grad_gamma
+        return self._loss_and_derivatives(beta, gamma)[1]
 
     def hessian_gamma(self, beta: np.ndarray, gamma: np.ndarray, **kwargs) -> np.ndarray:
         """
@@ -177,15 +891,128 @@ class LinearLMEOracle:
             hessian: np.ndarray, shape = [k, k]
                 Hessian of the loss function with respect to gamma ∇²_𝛄[ℒ](β, 𝛄).
         """
+        return self._loss_and_derivatives(beta, gamma, gradient=False, hessian=True)[2]
+
+    def value_and_grad(self, beta: np.ndarray, gamma: np.ndarray, **kwargs):
+        """
+        Returns the loss function and its gradient with respect to gamma, computed in one pass over the groups.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+        kwargs :
+            Not used, left for future and for passing debug/experimental parameters
+
+        Returns
+        -------
+            result : float
+                The value of the loss function: ℒ(β, 𝛄)
+            grad_gamma: np.ndarray, shape = [k]
+                The gradient of the loss function with respect to gamma: ∇_𝛄[ℒ](β, 𝛄)
+        """
+        return self._loss_and_derivatives(beta, gamma)[:2]
+
+    def value_grad_hess(self, beta: np.ndarray, gamma: np.ndarray, **kwargs):
+        """
+        Returns the loss function, its gradient, and its Hessian with respect to gamma,
+        computed in one pass over the groups.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+        kwargs :
+            Not used, left for future and for passing debug/experimental parameters
+
+        Returns
+        -------
+            result : float
+                The value of the loss function: ℒ(β, 𝛄)
+            grad_gamma: np.ndarray, shape = [k]
+                The gradient of the loss function with respect to gamma: ∇_𝛄[ℒ](β, 𝛄)
+            hessian: np.ndarray, shape = [k, k]
+                Hessian of the loss function with respect to gamma ∇²_𝛄[ℒ](β, 𝛄).
+        """
+        return self._loss_and_derivatives(beta, gamma, hessian=True)
+
+    def _loss_and_derivatives(self, beta: np.ndarray, gamma: np.ndarray, gradient: bool = True,
+                              hessian: bool = False):
+        """
+        Computes the loss function and, if requested, its derivatives with respect to gamma in one pass
+        over the groups, so the residuals and the whitened terms of every group are formed only once.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+        gradient : bool, default = True
+            Whether to compute the gradient ∇_𝛄[ℒ](β, 𝛄).
+        hessian : bool, default = False
+            Whether to compute the Hessian ∇²_𝛄[ℒ](β, 𝛄).
+
+        Returns
+        -------
+            result : float
+                The value of the loss function: ℒ(β, 𝛄)
+            grad_gamma: np.ndarray, shape = [k], or None
+                The gradient, if requested
+            hessian: np.ndarray, shape = [k, k], or None
+                The Hessian, if requested
+        """
+        if self.workers:
+            shards_results = self._map("_loss_and_derivatives", beta, gamma, gradient=gradient, hessian=hessian)
+            return tuple(None if results[0] is None else sum(results) for results in zip(*shards_results))
         self._recalculate_cholesky(gamma)
-        num_random_effects = self.problem.num_random_effects
-        hessian = np.zeros(shape=(num_random_effects, num_random_effects))
-        for (x, y, z, stds), L_inv in zip(self.problem, self.omega_cholesky_inv):
-            xi = y - x.dot(beta)
-            Lz = L_inv.dot(z)
-            Lxi = L_inv.dot(xi).reshape((len(xi), 1))
-            hessian += (-Lz.T.dot(Lz) + 2 * (Lz.T.dot(Lxi).dot(Lxi.T).dot(Lz))) * (Lz.T.dot(Lz))
-        return 1 / 2 * hessian
+        num_random_effects = len(gamma)
+        result = 0
+        grad_gamma = np.zeros(num_random_effects)
+        hessian_gamma = np.zeros(shape=(num_random_effects, num_random_effects))
+        if self.mode in woodbury_modes:
+            for (zTlxi, xiTlxi), zTlz, P, logdet in zip(self._residual_statistics(beta),
+                                                        self.zTlambda_invZ,
+                                                        self.capacitance_inv,
+                                                        self.omega_logdets):
+                result += 1 / 2 * (xiTlxi - zTlxi.dot(P).dot(zTlxi)) + 1 / 2 * logdet
+                zTomega_xi = zTlxi - zTlz.dot(P.dot(zTlxi))
+                if gradient:
+                    zTomega_z_diag = np.diag(zTlz) - np.sum(zTlz.dot(P) * zTlz, axis=1)
+                    grad_gamma += 1 / 2 * zTomega_z_diag - 1 / 2 * zTomega_xi ** 2
+                if hessian:
+                    zTomega_xi = zTomega_xi.reshape((num_random_effects, 1))
+                    zTomega_z = zTlz - zTlz.dot(P).dot(zTlz)
+                    hessian_gamma += (-zTomega_z + 2 * zTomega_xi.dot(zTomega_xi.T)) * zTomega_z
+        elif self.mode == "batched":
+            for Lx, Ly, Lz, logdet in self._whitened_blocks():
+                Lxi = Ly - Lx.dot(beta)
+                result += 1 / 2 * np.sum(Lxi ** 2) + logdet
+                zTomega_xi = np.einsum('bik,bi->bk', Lz, Lxi)
+                if gradient:
+                    grad_gamma += (1 / 2 * np.sum(Lz ** 2, axis=(0, 1))
+                                   - 1 / 2 * np.sum(zTomega_xi ** 2, axis=0))
+                if hessian:
+                    zTomega_z = np.einsum('bik,bil->bkl', Lz, Lz)
+                    hessian_gamma += np.sum((-zTomega_z + 2 * np.einsum('bk,bl->bkl', zTomega_xi, zTomega_xi))
+                                            * zTomega_z, axis=0)
+        else:
+            for Lx, Ly, Lz, logdet in self._whitened_blocks():
+                Lxi = Ly - Lx.dot(beta)
+                result += 1 / 2 * np.sum(Lxi ** 2) + logdet
+                if gradient:
+                    grad_gamma += 1 / 2 * np.sum(Lz ** 2, axis=0) - 1 / 2 * Lz.T.dot(Lxi) ** 2
+                if hessian:
+                    Lxi = Lxi.reshape((len(Lxi), 1))
+                    zTomega_z = Lz.T.dot(Lz)
+                    hessian_gamma += (-zTomega_z + 2 * (Lz.T.dot(Lxi).dot(Lxi.T).dot(Lz))) * zTomega_z
+        return (result,
+                grad_gamma if gradient else None,
+                1 / 2 * hessian_gamma if hessian else None)
 
     def optimal_beta(self, gamma: np.ndarray, _dont_solve_wrt_beta=False, **kwargs):
         """
@@ -211,25 +1038,180 @@ class LinearLMEOracle:
             It's left here for the purposes of use in child classes where both the kernel and the tail should be
             adjusted to account for regularization.
         kwargs :
-            Not used, left for future and for passing debug/experimental parameters
+            beta : np.ndarray, shape = [n], Optional
+                Starting point of conjugate gradients when beta_solver='cg'.
 
         Returns
         -------
         beta: np.ndarray, shape = [n]
             Vector of optimal estimates of the fixed effects for given gamma.
         """
+        if self.beta_solver == "cg" and not _dont_solve_wrt_beta:
+            return self._optimal_beta_cg(gamma, beta=kwargs.get("beta", None))
         self._recalculate_cholesky(gamma)
         kernel = 0
         tail = 0
-        for (x, y, z, stds), L_inv in zip(self.problem, self.omega_cholesky_inv):
-            Lx = L_inv.dot(x)
-            kernel += Lx.T.dot(Lx)
-            tail += Lx.T.dot(L_inv.dot(y))
+        if self.workers:
+            for shard_kernel, shard_tail in self._map("optimal_beta", gamma, _dont_solve_wrt_beta=True):
+                kernel += shard_kernel
+                tail += shard_tail
+        elif self.mode in woodbury_modes:
+            for (xTlx, xTlz, xTly, zTly), P in zip(self._design_statistics(), self.capacitance_inv):
+                kernel += xTlx - xTlz.dot(P).dot(xTlz.T)
+                tail += xTly - xTlz.dot(P.dot(zTly))
+        elif self.mode == "batched":
+            for Lx, Ly, Lz, _ in self._whitened_blocks():
+                kernel += np.einsum('bip,biq->pq', Lx, Lx)
+                tail += np.einsum('bip,bi->p', Lx, Ly)
+        else:
+            for Lx, Ly, Lz, _ in self._whitened_blocks():
+                kernel += Lx.T.dot(Lx)
+                tail += Lx.T.dot(Ly)
         if _dont_solve_wrt_beta:
             return kernel, tail
         else:
             return np.linalg.solve(kernel, tail)
 
+    def _optimal_beta_cg(self, gamma: np.ndarray, penalty=0, penalty_tail=0, beta: np.ndarray = None):
+        """
+        Solves for the optimal β by preconditioned conjugate gradients without forming the kernel.
+
+        The system is::
+
+            (∑X_i^TΩ_i^{-1}X_i + diag(penalty))*β = ∑X_i^TΩ_i^{-1}y_i + penalty_tail
+
+        where the penalty terms come from the regularization of β in the child classes.
+        The number of iterations is added to cg_iterations. If conjugate gradients fail, the kernel is assembled
+        and the system is solved directly, with a RuntimeWarning.
+
+        Parameters
+        ----------
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+        penalty : float or np.ndarray, shape = [n]
+            Diagonal which is added to the kernel.
+        penalty_tail : float or np.ndarray, shape = [n]
+            Vector which is added to the tail.
+        beta : np.ndarray, shape = [n], Optional
+            Starting point. If None, the previous solution is used, or zeros if there is none.
+
+        Returns
+        -------
+        beta: np.ndarray, shape = [n]
+            Vector of optimal estimates of the fixed effects for given gamma.
+        """
+        # the problem may have no data in 'sufficient_statistics' mode
+        num_fixed_effects = len(self.beta_to_gamma_map)
+        if beta is None:
+            beta = self.cg_beta if self.cg_beta is not None else np.zeros(num_fixed_effects)
+        residual, tail = self._kernel_product(gamma, beta, with_answers=True).T
+        residual = residual + penalty_tail - penalty * beta
+        tail = tail + penalty_tail
+        diagonal = self._kernel_diagonal(gamma) + penalty
+        preconditioner = np.divide(1, diagonal, out=np.ones(num_fixed_effects), where=diagonal > 0)
+        beta, iterations, converged = _conjugate_gradient(lambda v: self._kernel_product(gamma, v) + penalty * v,
+                                                          beta, residual, preconditioner,
+                                                          atol=self.cg_tol * np.linalg.norm(tail),
+                                                          max_iter=2 * num_fixed_effects)
+        self.cg_iterations += iterations
+        if not converged:
+            warnings.warn("Conjugate gradients did not converge in %d iterations, solving for beta directly."
+                          % iterations, RuntimeWarning)
+            kernel, tail = LinearLMEOracle.optimal_beta(self, gamma, _dont_solve_wrt_beta=True)
+            kernel[np.diag_indices(num_fixed_effects)] += penalty
+            beta = np.linalg.solve(kernel, tail + penalty_tail)
+        self.cg_beta = beta
+        return beta
+
+    def _kernel_product(self, gamma: np.ndarray, v: np.ndarray, with_answers: bool = False):
+        """
+        Applies the kernel ∑X_i^TΩ_i^{-1}X_i to a vector without forming it.
+
+        In Cholesky-based modes it takes two matrix-vector products with the whitened blocks L_i^{-1}*X_i
+        per group; in Woodbury-based modes it applies Ω_i^{-1} = Λ_i^{-1} - Λ_i^{-1}Z_i*P_i*Z_i^TΛ_i^{-1},
+        where P_i are the inverses of the capacitance matrices.
+
+        Parameters
+        ----------
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+        v : np.ndarray, shape = [n]
+            Vector to apply the kernel to.
+        with_answers : bool, default = False
+            If True, returns the columns ∑X_i^TΩ_i^{-1}(y_i - X_i*v) and ∑X_i^TΩ_i^{-1}y_i instead,
+            which are computed in the same pass over the data.
+
+        Returns
+        -------
+            np.ndarray, shape = [n], or [n, 2] if with_answers
+        """
+        self._recalculate_cholesky(gamma)
+        if self.workers:
+            return sum(self._map("_kernel_product", gamma, v, with_answers=with_answers))
+        result = 0
+        if self.mode == "sufficient_statistics":
+            for (xTlx, xTlz, xTly, zTly), P in zip(self._design_statistics(), self.capacitance_inv):
+                x_part = xTlx.dot(v)
+                z_part = xTlz.T.dot(v)
+                if with_answers:
+                    x_part = np.column_stack((xTly - x_part, xTly))
+                    z_part = np.column_stack((zTly - z_part, zTly))
+                result += x_part - xTlz.dot(P.dot(z_part))
+        elif self.mode == "woodbury":
+            for (x, y, z, stds), P in zip(self.problem, self.capacitance_inv):
+                w = x.dot(v)
+                if with_answers:
+                    w = np.column_stack((y - w, y))
+                # Λ_i^{-1} scales the rows of w, which has one or two columns
+                lambda_inv_w = (w.T / stds).T
+                result += x.T.dot(lambda_inv_w - (z.dot(P.dot(z.T.dot(lambda_inv_w))).T / stds).T)
+        elif self.mode == "batched":
+            for Lx, Ly, Lz, _ in self._whitened_blocks():
+                w = np.einsum('bip,p->bi', Lx, v)
+                if with_answers:
+                    w = np.stack((Ly - w, Ly), axis=-1)
+                result += np.einsum('bip,bi...->p...', Lx, w)
+        else:
+            for Lx, Ly, Lz, _ in self._whitened_blocks():
+                w = Lx.dot(v)
+                if with_answers:
+                    w = np.column_stack((Ly - w, Ly))
+                result += Lx.T.dot(w)
+        return result
+
+    def _kernel_diagonal(self, gamma: np.ndarray):
+        """
+        Returns the diagonal of the kernel ∑X_i^TΩ_i^{-1}X_i without forming the kernel.
+
+        Parameters
+        ----------
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+
+        Returns
+        -------
+            np.ndarray, shape = [n]
+        """
+        self._recalculate_cholesky(gamma)
+        if self.workers:
+            return sum(self._map("_kernel_diagonal", gamma))
+        diagonal = 0
+        if self.mode == "sufficient_statistics":
+            for xTlx, xTlz, P in zip(self.xTlambda_invX, self.xTlambda_invZ, self.capacitance_inv):
+                diagonal += np.diag(xTlx) - np.sum(xTlz.dot(P) * xTlz, axis=1)
+        elif self.mode == "woodbury":
+            for (x, y, z, stds), P in zip(self.problem, self.capacitance_inv):
+                lambda_inv_x = x / stds[:, np.newaxis]
+                xTlz = lambda_inv_x.T.dot(z)
+                diagonal += np.sum(lambda_inv_x * x, axis=0) - np.sum(xTlz.dot(P) * xTlz, axis=1)
+        elif self.mode == "batched":
+            for Lx, Ly, Lz, _ in self._whitened_blocks():
+                diagonal += np.sum(Lx ** 2, axis=(0, 1))
+        else:
+            for Lx, Ly, Lz, _ in self._whitened_blocks():
+                diagonal += np.sum(Lx ** 2, axis=0)
+        return diagonal
+
     def optimal_random_effects(self, beta: np.ndarray, gamma: np.ndarray, **kwargs) -> np.ndarray:
         """
         Returns set of optimal random effects estimations for given beta and gamma.
@@ -250,22 +1232,44 @@ class LinearLMEOracle:
 
         """
 
-        random_effects = []
-        for (x, y, z, stds), L_inv in zip(self.problem, self.omega_cholesky_inv):
-            xi = y - x.dot(beta)
-            stds_inv_mat = np.diag(1 / stds)
-            # If the variance of R.E. is 0 then the R.E. is 0, so we take it into account separately
-            # to keep matrices invertible.
-            mask = np.abs(gamma) > 1e-10
+        if self.workers:
+            random_effects = np.zeros((self.problem.num_groups, len(gamma)))
+            for shard, shard_random_effects in zip(self.shards, self._map("optimal_random_effects", beta, gamma)):
+                random_effects[shard] = shard_random_effects
+            return random_effects
+        if self.mode in woodbury_modes:
+            # u_i = diag(𝛄)*Z_i^T*Ω_i^{-1}*(y_i - X_i*β) = P_i*Z_i^T*Λ_i^{-1}*(y_i - X_i*β)
+            # Variances are non-negative; negative values can come only from round-off errors in the line search.
+            self._recalculate_cholesky(np.maximum(gamma, 0))
+            zTlxi = np.array([zTlxi for zTlxi, _ in self._residual_statistics(beta)])
+            return np.einsum('gkl,gl->gk', np.array(self.capacitance_inv), zTlxi)
+        random_effects = np.zeros((self.problem.num_groups, len(gamma)))
+        # If the variance of R.E. is 0 then the R.E. is 0, so we take it into account separately
+        # to keep matrices invertible.
+        mask = np.abs(gamma) > 1e-10
+        if not mask.any():
+            return random_effects
+        if self.mode == "batched":
+            for idx, x, y, z, stds in self._buckets():
+                xi = y - x.dot(beta)
+                z_masked = z[:, :, mask]
+                zTl = np.swapaxes(z_masked / stds[:, :, np.newaxis], 1, 2)
+                u_nonzero = np.linalg.solve(np.diag(1 / gamma[mask]) + np.matmul(zTl, z_masked),
+                                            np.matmul(zTl, xi[:, :, np.newaxis]))
+                random_effects[np.ix_(idx, mask)] = u_nonzero[:, :, 0]
+            return random_effects
+        # u_i = (diag(1/𝛄) + Z_i^T*Λ_i^{-1}*Z_i)^{-1}*Z_i^T*Λ_i^{-1}*(y_i - X_i*β), where Λ_i^{-1} is applied
+        # as a scaling of the rows of Z_i, and the k×k systems of all the groups are solved in one call.
+        zTlz = []
+        zTlxi = []
+        for x, y, z, stds in self.problem:
             z_masked = z[:, mask]
-            gamma_masked = gamma[mask]
-            u_nonzero = np.linalg.solve(np.diag(1 / gamma_masked) + z_masked.T.dot(stds_inv_mat).dot(z_masked),
-                                        z_masked.T.dot(stds_inv_mat).dot(xi)
-                                        )
-            u = np.zeros(len(gamma))
-            u[mask] = u_nonzero
-            random_effects.append(u)
-        return np.array(random_effects)
+            zTl = (z_masked / stds[:, np.newaxis]).T
+            zTlz.append(zTl.dot(z_masked))
+            zTlxi.append(zTl.dot(y - x.dot(beta)))
+        random_effects[:, mask] = np.linalg.solve(np.diag(1 / gamma[mask]) + np.array(zTlz),
+                                                  np.array(zTlxi)[:, :, np.newaxis])[:, :, 0]
+        return random_effects
 
 
 class LinearLMEOracleRegularized(LinearLMEOracle):
@@ -296,7 +1300,8 @@ class LinearLMEOracleRegularized(LinearLMEOracle):
 
     """
 
-    def __init__(self, problem: LinearLMEProblem, lb=0.1, lg=0.1, nnz_tbeta=3, nnz_tgamma=3):
+    def __init__(self, problem: LinearLMEProblem, lb=0.1, lg=0.1, nnz_tbeta=3, nnz_tgamma=3, mode="cholesky",
+                 cache_max_bytes=2 ** 27, n_jobs=1, max_low_rank_updates=0, beta_solver="direct", cg_tol=1e-10):
         """
         Creates an oracle on top of the given problem. The problem should be in the form of LinearLMEProblem.
 
@@ -312,9 +1317,23 @@ class LinearLMEOracleRegularized(LinearLMEOracle):
             Number of non-zero elements allowed in tβ
         nnz_tgamma : int
             Number of non-zero elements allowed in t𝛄
+        mode : {'cholesky', 'packed', 'batched', 'woodbury', 'sufficient_statistics'}, default = 'cholesky'
+            How the oracle handles the matrices Ω_i. See the docs for LinearLMEOracle for more details.
+        cache_max_bytes : int, default = 2**27
+            Memory budget of the LRU cache of factorizations. See the docs for LinearLMEOracle for more details.
+        n_jobs : int, default = 1
+            Number of worker processes. See the docs for LinearLMEOracle for more details.
+        max_low_rank_updates : int, default = 0
+            Maximal number of consecutive low-rank updates of the Cholesky factors.
+            See the docs for LinearLMEOracle for more details.
+        beta_solver : {'direct', 'cg'}, default = 'direct'
+            How optimal_beta solves for β. See the docs for LinearLMEOracle for more details.
+        cg_tol : float, default = 1e-10
+            Relative tolerance of conjugate gradients. See the docs for LinearLMEOracle for more details.
         """
 
-        super().__init__(problem)
+        super().__init__(problem, mode=mode, cache_max_bytes=cache_max_bytes, n_jobs=n_jobs,
+                         max_low_rank_updates=max_low_rank_updates, beta_solver=beta_solver, cg_tol=cg_tol)
         self.lb = lb
         self.lg = lg
         self.k = nnz_tbeta
@@ -346,13 +1365,16 @@ class LinearLMEOracleRegularized(LinearLMEOracle):
             It's left here for the purposes of use in child classes where both the kernel and the tail should be
             adjusted to account for regularization.
         kwargs :
-            Not used, left for future and for passing debug/experimental parameters
+            beta : np.ndarray, shape = [n], Optional
+                Starting point of conjugate gradients when beta_solver='cg'.
 
         Returns
         -------
         beta: np.ndarray, shape = [n]
             Vector of optimal estimates of the fixed effects for given gamma.
         """
+        if self.beta_solver == "cg" and not _dont_solve_wrt_beta:
+            return self._optimal_beta_cg(gamma, self.lb, self.lb * tbeta, beta=kwargs.get("beta", None))
         kernel, tail = super().optimal_beta(gamma, _dont_solve_wrt_beta=True, **kwargs)
         if _dont_solve_wrt_beta:
             return kernel, tail
@@ -432,6 +1454,36 @@ class LinearLMEOracleRegularized(LinearLMEOracle):
                 + self.lb / 2 * sum((beta - tbeta) ** 2)
                 + self.lg / 2 * sum((gamma - tgamma) ** 2))
 
+    def losses(self, beta: np.ndarray, gammas: np.ndarray, tbeta: np.ndarray = None, tgamma: np.ndarray = None,
+               **kwargs) -> np.ndarray:
+        """
+        Returns the loss function values ℒ(β, 𝛄) + lb/2*||β - tβ||^2 + lg/2*||𝛄 - t𝛄||^2 for several 𝛄's at once.
+        See the docs for LinearLMEOracle.losses for more details.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+        gammas : np.ndarray, shape = [c, k]
+            Vectors of estimates of random effects, one per row.
+        tbeta : np.ndarray, shape = [n]
+            Vector of (nnz_tbeta)-sparse estimates of fixed effects.
+        tgamma : np.ndarray, shape = [k]
+            Vector of (nnz_tgamma)-sparse estimates of random effects.
+        kwargs :
+            Not used, left for future and for passing debug/experimental parameters.
+
+        Returns
+        -------
+            result : np.ndarray, shape = [c]
+                The values of the loss function for every row of gammas.
+        """
+        # the same clamping as in LinearLMEOracle.losses, so the regularization term is taken at the same 𝛄's
+        gammas = np.maximum(np.atleast_2d(gammas), 0)
+        return (super().losses(beta, gammas, **kwargs)
+                + self.lb / 2 * sum((beta - tbeta) ** 2)
+                + self.lg / 2 * np.sum((gammas - tgamma) ** 2, axis=1))
+
     def gradient_gamma(self, beta: np.ndarray, gamma: np.ndarray, tgamma: np.ndarray = None, **kwargs) -> np.ndarray:
         """
         Returns the gradient of the loss function with respect to gamma: grad_gamma =  ∇_𝛄[ℒ](β, 𝛄) + lg*(𝛄 - t𝛄)
@@ -476,6 +1528,70 @@ class LinearLMEOracleRegularized(LinearLMEOracle):
 
         return super().hessian_gamma(beta, gamma, **kwargs) + self.lg * np.eye(self.problem.num_random_effects)
 
+    def value_and_grad(self, beta: np.ndarray, gamma: np.ndarray, tbeta: np.ndarray = None,
+                       tgamma: np.ndarray = None, **kwargs):
+        """
+        Returns the loss function and its gradient with respect to gamma, computed in one pass over the groups.
+        See the docs for loss and gradient_gamma for more details.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+        tbeta : np.ndarray, shape = [n]
+            Vector of (nnz_tbeta)-sparse estimates of fixed effects.
+        tgamma : np.ndarray, shape = [k]
+            Vector of (nnz_tgamma)-sparse estimates of random effects.
+        kwargs :
+            Not used, left for future and for passing debug/experimental parameters.
+
+        Returns
+        -------
+            result : float
+                The value of the loss function: ℒ(β, 𝛄) + lb/2*||β - tβ||^2 + lg/2*||𝛄 - t𝛄||^2
+            grad_gamma: np.ndarray, shape = [k]
+                The gradient of the loss function with respect to gamma: ∇_𝛄[ℒ](β, 𝛄) + lg*(𝛄 - t𝛄)
+        """
+        result, grad_gamma = super().value_and_grad(beta, gamma, **kwargs)
+        return (result + self.lb / 2 * sum((beta - tbeta) ** 2) + self.lg / 2 * sum((gamma - tgamma) ** 2),
+                grad_gamma + self.lg * (gamma - tgamma))
+
+    def value_grad_hess(self, beta: np.ndarray, gamma: np.ndarray, tbeta: np.ndarray = None,
+                        tgamma: np.ndarray = None, **kwargs):
+        """
+        Returns the loss function, its gradient, and its Hessian with respect to gamma,
+        computed in one pass over the groups. See the docs for loss, gradient_gamma, and hessian_gamma
+        for more details.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Vector of estimates of fixed effects.
+        gamma : np.ndarray, shape = [k]
+            Vector of estimates of random effects.
+        tbeta : np.ndarray, shape = [n]
+            Vector of (nnz_tbeta)-sparse estimates of fixed effects.
+        tgamma : np.ndarray, shape = [k]
+            Vector of (nnz_tgamma)-sparse estimates of random effects.
+        kwargs :
+            Not used, left for future and for passing debug/experimental parameters.
+
+        Returns
+        -------
+            result : float
+                The value of the loss function: ℒ(β, 𝛄) + lb/2*||β - tβ||^2 + lg/2*||𝛄 - t𝛄||^2
+            grad_gamma: np.ndarray, shape = [k]
+                The gradient of the loss function with respect to gamma: ∇_𝛄[ℒ](β, 𝛄) + lg*(𝛄 - t𝛄)
+            hessian: np.ndarray, shape = [k, k]
+                Hessian of the loss function with respect to gamma ∇²_𝛄[ℒ](β, 𝛄) + lg*I.
+        """
+        result, grad_gamma, hessian = super().value_grad_hess(beta, gamma, **kwargs)
+        return (result + self.lb / 2 * sum((beta - tbeta) ** 2) + self.lg / 2 * sum((gamma - tgamma) ** 2),
+                grad_gamma + self.lg * (gamma - tgamma),
+                hessian + self.lg * np.eye(self.problem.num_random_effects))
+
     def optimal_tgamma(self, tbeta, gamma, **kwargs):
         """
         Returns tgamma which minimizes the loss function with all other variables fixed.
@@ -508,54 +1624,23 @@ class LinearLMEOracleRegularized(LinearLMEOracle):
 
 class LinearLMEOracleW(LinearLMEOracleRegularized):
 
-    def __init__(self, problem: LinearLMEProblem, lb=0.1, lg=0.1, nnz_tbeta=3, nnz_tgamma=3):
-        super().__init__(problem, lb, lg, nnz_tbeta, nnz_tgamma)
-        self.beta = None
+    def __init__(self, problem: LinearLMEProblem, lb=0.1, lg=0.1, nnz_tbeta=3, nnz_tgamma=3, mode="cholesky",
+                 cache_max_bytes=2 ** 27, n_jobs=1, max_low_rank_updates=0, beta_solver="direct", cg_tol=1e-10):
+        super().__init__(problem, lb, lg, nnz_tbeta, nnz_tgamma, mode=mode, cache_max_bytes=cache_max_bytes,
+                         n_jobs=n_jobs, max_low_rank_updates=max_low_rank_updates, beta_solver=beta_solver,
+                         cg_tol=cg_tol)
+        # the point (β, 𝛄) which the current drop penalties were computed at
+        self.drop_penalties_point = None
         self.drop_penalties_beta = None
         self.drop_penalties_gamma = None
 
     def _recalculate_drop_matrices(self, beta, gamma):
-        if np.all(self.gamma == gamma) and np.all(self.beta == beta):
+        if (self.drop_penalties_point is not None
+                and np.array_equal(self.drop_penalties_point[0], beta)
+                and np.array_equal(self.drop_penalties_point[1], gamma)):
             return None
-        self._recalculate_cholesky(gamma)
-
-        self.drop_penalties_beta = np.zeros(self.problem.num_fixed_effects)
-        self.drop_penalties_gamma = np.zeros(self.problem.num_random_effects)
-        for j, ((x, y, z, l), L_inv) in enumerate(zip(self.problem, self.omega_cholesky_inv)):
-            # Calculate drop price for gammas individually
-            xi = y - x.dot(beta)
-            Lxi = L_inv.dot(xi)
-            Lx = L_inv.dot(x)
-            Lz = L_inv.dot(z)
-            h1 = np.sum(Lz ** 2, axis=0)
-            g1 = Lz.T.dot(Lxi) ** 2
-            self.drop_penalties_gamma += -gamma * g1 / (1 - gamma * h1) + np.log(1 + gamma * h1 / (1 - gamma * h1))
-            # Calculate drop price for betas only
-            self.drop_penalties_beta += -2 * beta * Lx.T.dot(Lxi)
-            self.drop_penalties_beta += -beta ** 2 * np.sum(Lx ** 2, axis=0)
-            # Calculate drop price for gammas given dropped betas
-            idx_beta = []
-            idx_gamma = []
-            for i, k in enumerate(self.beta_to_gamma_map):
-                if k >= 0:
-                    idx_beta.append(i)
-                    idx_gamma.append(k)
-            idx_beta = np.array(idx_beta)
-            idx_gamma = np.array(idx_gamma).astype(int)
-            x_s = x[:, idx_beta]
-            beta_s = beta[idx_beta]
-            gamma_s = gamma[idx_gamma]
-            z_s = z[:, idx_gamma]
-            Lz_s = L_inv.dot(z_s)
-            h1_s = np.sum(Lz_s ** 2, axis=0)
-            g2_s = np.sum((Lxi.reshape((len(Lxi), 1)) + L_inv.dot(x_s * beta_s)) * Lz_s, axis=0)
-            self.drop_penalties_beta[idx_beta] += (-gamma_s * (g2_s ** 2) / (1 - gamma_s * h1_s)
-                                                   + np.log(1 + gamma_s * h1_s / (1 - gamma_s * h1_s)))
-
-        # we invert the sign and take into account the 1/2 multiplier for the loss function
-        self.drop_penalties_beta /= -2
-        self.drop_penalties_gamma /= -2
-        self.beta = beta
+        self.drop_penalties_beta, self.drop_penalties_gamma = self._drop_penalties(beta, gamma)
+        self.drop_penalties_point = (np.copy(beta), np.copy(gamma))
         return None
 
     def loss(self, beta: np.ndarray, gamma: np.ndarray, tbeta: np.ndarray = None, tgamma: np.ndarray = None, **kwargs):
@@ -565,6 +1650,15 @@ class LinearLMEOracleW(LinearLMEOracleRegularized):
                 + self.lb / 2 * sum(self.drop_penalties_beta*(beta - tbeta) ** 2)
                 + self.lg / 2 * sum(self.drop_penalties_gamma*(gamma - tgamma) ** 2))
 
+    def losses(self, beta: np.ndarray, gammas: np.ndarray, tbeta: np.ndarray = None, tgamma: np.ndarray = None,
+               **kwargs):
+        gammas = np.maximum(np.atleast_2d(gammas), 0)
+        if self.drop_penalties_beta is None or self.drop_penalties_gamma is None:
+            self._recalculate_drop_matrices(beta, gammas[0])
+        return (super(LinearLMEOracleRegularized, self).losses(beta, gammas, **kwargs)
+                + self.lb / 2 * sum(self.drop_penalties_beta*(beta - tbeta) ** 2)
+                + self.lg / 2 * np.sum(self.drop_penalties_gamma*(gammas - tgamma) ** 2, axis=1))
+
     def optimal_beta(self, gamma: np.ndarray, tbeta: np.ndarray = None, beta: np.ndarray = None, **kwargs):
         if self.drop_penalties_beta is None:
             if beta is not None:
@@ -572,6 +1666,9 @@ class LinearLMEOracleW(LinearLMEOracleRegularized):
             else:
                 raise ValueError("Drop penalties for beta are not initialized")
 
+        if self.beta_solver == "cg":
+            return self._optimal_beta_cg(gamma, self.lb * self.drop_penalties_beta,
+                                         self.lb * self.drop_penalties_beta * tbeta, beta=beta)
         kernel, tail = super(LinearLMEOracleRegularized, self).optimal_beta(gamma, _dont_solve_wrt_beta=True, **kwargs)
         return np.linalg.solve(self.lb * np.diag(self.drop_penalties_beta) + kernel,
                                self.lb * self.drop_penalties_beta * tbeta + tail)
@@ -588,6 +1685,27 @@ class LinearLMEOracleW(LinearLMEOracleRegularized):
         return super(LinearLMEOracleRegularized, self).hessian_gamma(beta, gamma, **kwargs) + self.lg * np.diag(
             self.drop_penalties_gamma)
 
+    def value_and_grad(self, beta: np.ndarray, gamma: np.ndarray, tbeta: np.ndarray = None,
+                       tgamma: np.ndarray = None, **kwargs):
+        if self.drop_penalties_beta is None or self.drop_penalties_gamma is None:
+            self._recalculate_drop_matrices(beta, gamma)
+        result, grad_gamma = super(LinearLMEOracleRegularized, self).value_and_grad(beta, gamma, **kwargs)
+        return (result
+                + self.lb / 2 * sum(self.drop_penalties_beta*(beta - tbeta) ** 2)
+                + self.lg / 2 * sum(self.drop_penalties_gamma*(gamma - tgamma) ** 2),
+                grad_gamma + self.lg * self.drop_penalties_gamma * (gamma - tgamma))
+
+    def value_grad_hess(self, beta: np.ndarray, gamma: np.ndarray, tbeta: np.ndarray = None,
+                        tgamma: np.ndarray = None, **kwargs):
+        if self.drop_penalties_beta is None or self.drop_penalties_gamma is None:
+            self._recalculate_drop_matrices(beta, gamma)
+        result, grad_gamma, hessian = super(LinearLMEOracleRegularized, self).value_grad_hess(beta, gamma, **kwargs)
+        return (result
+                + self.lb / 2 * sum(self.drop_penalties_beta*(beta - tbeta) ** 2)
+                + self.lg / 2 * sum(self.drop_penalties_gamma*(gamma - tgamma) ** 2),
+                grad_gamma + self.lg * self.drop_penalties_gamma * (gamma - tgamma),
+                hessian + self.lg * np.diag(self.drop_penalties_gamma))
+
     def optimal_tbeta(self, beta: np.ndarray, gamma: np.ndarray = None, **kwargs):
         self._recalculate_drop_matrices(beta, gamma)
         tbeta = np.zeros(len(beta))
@@ -606,3 +1724,211 @@ class LinearLMEOracleW(LinearLMEOracleRegularized):
         tgamma2 = np.zeros(len(gamma))
         tgamma2[idx_k_max] = tgamma[idx_k_max]
         return tgamma2
+
+
+def _nbytes(factors) -> int:
+    """
+    Returns the total size in bytes of the arrays in a (possibly nested) list or tuple of factors.
+    """
+    if isinstance(factors, np.ndarray):
+        return factors.nbytes
+    if factors is None:
+        return 0
+    if isinstance(factors, (list, tuple)):
+        return sum(_nbytes(factor) for factor in factors)
+    return np.asarray(factors).nbytes
+
+
+def _packed_omega(z: np.ndarray, gamma: np.ndarray, stds: np.ndarray) -> np.ndarray:
+    """
+    Builds Ω_i = Z_i*diag(𝛄)*Z_i^T + Λ_i in LAPACK's packed format without forming the dense n×n matrix.
+
+    The diagonal Λ_i is put to the packed array first, then Ω_i is accumulated by the rank-one updates
+    𝛄_j*z_j*z_j^T of BLAS's spr routine, one for every random effect with non-zero variance.
+
+    Parameters
+    ----------
+    z : np.ndarray, shape=[n, k]
+        random features of the group
+    gamma : np.ndarray, shape=[k]
+        vector of covariances for random effects
+    stds : np.ndarray, shape=[n]
+        variances of the observations' noise
+
+    Returns
+    -------
+    omega_packed : np.ndarray, shape=[n*(n+1)/2]
+        columns of the lower triangle of Ω_i, stacked together
+    """
+    n = len(stds)
+    columns = np.arange(n)
+    omega_packed = np.zeros(n * (n + 1) // 2)
+    # the diagonal element of the j-th column is the first one of its n - j stored elements
+    omega_packed[columns * (2 * n - columns + 1) // 2] = stds
+    rank_one_update = get_blas_funcs("spr", (omega_packed,))
+    for j in np.flatnonzero(gamma):
+        omega_packed = rank_one_update(n, gamma[j], z[:, j], omega_packed, lower=1, overwrite_ap=1)
+    return omega_packed
+
+
+def _packed_triangular_solve(L_packed: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Solves L*x = b where L is a lower-triangular matrix in LAPACK's packed format.
+
+    Several right-hand sides are solved by one call of LAPACK's trtrs on L unpacked by tpttr:
+    tptrs, which would solve them in the packed format, is not wrapped by the supported versions of SciPy.
+
+    Parameters
+    ----------
+    L_packed : np.ndarray, shape=[n*(n+1)/2]
+        columns of the lower triangle of L, stacked together
+    b : np.ndarray, shape=[n] or [n, m]
+        right-hand side(s)
+
+    Returns
+    -------
+    x : np.ndarray
+        solution of the same shape as b
+    """
+    n = b.shape[0]
+    if b.ndim == 1:
+        return get_blas_funcs("tpsv", (L_packed,))(n, L_packed, b, lower=1)
+    L, info = get_lapack_funcs("tpttr", (L_packed,))(n, L_packed, uplo="L")
+    x, info = get_lapack_funcs("trtrs", (L,))(L, b, lower=1)
+    return x
+
+
+def _cholesky_rank_one_update(L: np.ndarray, L_inv: np.ndarray, v: np.ndarray, sigma: float):
+    """
+    Computes the Cholesky factor and its inverse for the matrix L*L^T + sigma*v*v^T in O(n²).
+
+    L*L^T + sigma*v*v^T = L*(I + sigma*p*p^T)*L^T with p = L^{-1}*v, and the Cholesky factor K of
+    I + sigma*p*p^T has a closed form (Gill, Golub, Murray, Saunders, 1974)::
+
+        K_jj = d_j,  K_ij = p_i*b_j for i > j,
+
+        where c_j = 1 + sigma*Σ_{m≤j} p_m²,  d_j = sqrt(c_j/c_{j-1}),  b_j = sigma*p_j/(c_{j-1}*d_j).
+
+    Both L*K and K^{-1}*L^{-1} are then computed with cumulative sums.
+
+    Parameters
+    ----------
+    L : np.ndarray, shape=[n, n]
+        lower-triangular Cholesky factor
+    L_inv : np.ndarray, shape=[n, n]
+        its inverse
+    v : np.ndarray, shape=[n]
+        direction of the update
+    sigma : float
+        weight of the update, negative for downdates
+
+    Returns
+    -------
+    factors : tuple of np.ndarray or None
+        New L and L_inv, or None if the updated matrix is not numerically positive definite.
+    """
+    p = L_inv.dot(v)
+    c = 1 + sigma * np.cumsum(p ** 2)
+    if c[-1] <= np.sqrt(np.finfo(float).eps):
+        return None
+    c_prev = np.concatenate(([1.], c[:-1]))
+    d = np.sqrt(c / c_prev)
+    b = sigma * p / (c_prev * d)
+    # (L*K)[:, j] = d_j*L[:, j] + b_j*Σ_{i>j} p_i*L[:, i]
+    lp = L * p
+    tail = np.cumsum(lp[:, ::-1], axis=1)[:, ::-1] - lp
+    L_new = L * d + tail * b
+    # (K^{-1}*L^{-1})[j, :] = (L^{-1}[j, :] - p_j/c_{j-1}*Σ_{i<j} b_i*c_i/d_i*L^{-1}[i, :])/d_j
+    weighted = (b * c / d)[:, np.newaxis] * L_inv
+    head = np.cumsum(weighted, axis=0) - weighted
+    L_inv_new = (L_inv - (p / c_prev)[:, np.newaxis] * head) / d[:, np.newaxis]
+    return L_new, L_inv_new
+
+
+def _conjugate_gradient(matvec: Callable, x: np.ndarray, residual: np.ndarray, preconditioner: np.ndarray,
+                        atol: float, max_iter: int):
+    """
+    Solves a symmetric positive-definite system A*x = b by the preconditioned conjugate gradients method.
+
+    Parameters
+    ----------
+    matvec : Callable
+        Returns A*v for a vector v.
+    x : np.ndarray
+        Starting point.
+    residual : np.ndarray
+        Residual b - A*x at the starting point.
+    preconditioner : np.ndarray
+        Diagonal of the inverse of the diagonal preconditioner.
+    atol : float
+        The method stops when the norm of the residual falls below atol.
+    max_iter : int
+        Maximal number of iterations.
+
+    Returns
+    -------
+        tuple (x, number of iterations, whether the method converged). The method fails when it does not
+        converge in max_iter iterations, or when it meets a direction of non-positive (or not finite) curvature,
+        which means that A is not positive definite numerically.
+    """
+    preconditioned_residual = preconditioner * residual
+    direction = preconditioned_residual
+    product = residual.dot(preconditioned_residual)
+    iteration = 0
+    # a NaN residual goes into the loop and fails on the curvature
+    while not np.linalg.norm(residual) <= atol:
+        if iteration >= max_iter:
+            return x, iteration, False
+        kernel_direction = matvec(direction)
+        curvature = direction.dot(kernel_direction)
+        if not curvature > 0 or not np.isfinite(curvature):
+            return x, iteration, False
+        step = product / curvature
+        x = x + step * direction
+        residual = residual - step * kernel_direction
+        preconditioned_residual = preconditioner * residual
+        product, previous_product = residual.dot(preconditioned_residual), product
+        direction = preconditioned_residual + product / previous_product * direction
+        iteration += 1
+    return x, iteration, True
+
+
+def _oracle_worker(connection, problem: LinearLMEProblem, mode: str, cache_max_bytes: int,
+                   max_low_rank_updates: int = 0):
+    """
+    Serves the requests of a parallel LinearLMEOracle for one shard of groups.
+
+    Receives tuples (method, args, kwargs) from the connection, calls the method of a single-process oracle
+    built on the shard, and sends back (True, result), or (False, exception) if the call failed.
+    Stops when it receives None.
+
+    Parameters
+    ----------
+    connection : multiprocessing.connection.Connection
+        Worker's end of the pipe.
+    problem : LinearLMEProblem
+        Groups of this shard.
+    mode : str
+        Mode of the oracle.
+    cache_max_bytes : int
+        Memory budget of the worker's LRU cache of factorizations.
+    max_low_rank_updates : int
+        Maximal number of consecutive low-rank updates of the worker's factors.
+
+    Returns
+    -------
+        None
+    """
+    oracle = LinearLMEOracle(problem, mode=mode, cache_max_bytes=cache_max_bytes,
+                             max_low_rank_updates=max_low_rank_updates)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        method, args, kwargs = request
+        try:
+            connection.send((True, getattr(oracle, method)(*args, **kwargs)))
+        except Exception as e:
+            connection.send((False, e))
+    connection.close()
+    return None
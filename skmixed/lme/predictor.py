@@ -0,0 +1,187 @@
+# This code implements a lightweight predict-only runtime for linear mixed-effects models.
+# Copyright (C) 2020 Aleksei Sholokhov, aksh@uw.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Predict-only runtime for fitted linear mixed-effects models.
+
+This module depends only on Numpy, so it can be imported for serving without loading scikit-learn or Scipy.
+A predictor is created from a fitted model by LinearLMESparseModel.export (or LinearLMEPredictor.from_model)
+and saved as a versioned .npz file.
+"""
+
+import numpy as np
+
+# Version of the format of the files written by LinearLMEPredictor.save
+predictor_format_version = 1
+
+
+class LinearLMEPredictor(object):
+    """
+    Makes predictions of a fitted linear mixed-effects model for the rows in the format of LinearLMEProblem.from_x_y.
+    """
+
+    def __init__(self,
+                 beta: np.ndarray,
+                 random_effects: np.ndarray,
+                 group_labels: np.ndarray,
+                 columns_labels: np.ndarray,
+                 random_intercept: bool):
+        """
+        Creates a predictor from the coefficients of a fitted model.
+
+        Parameters
+        ----------
+        beta : np.ndarray, shape = [n]
+            Fixed effects, the first one is the intercept.
+        random_effects : np.ndarray, shape = [G, k]
+            Random effects of the train groups.
+        group_labels : np.ndarray, shape = [G]
+            Labels of the train groups, in the same order as random_effects.
+        columns_labels : np.ndarray[int], shape = [t]
+            Labels of the columns of the data, see LinearLMEProblem.from_x_y. They do not include the intercept.
+        random_intercept : bool
+            Whether the intercept is a random effect.
+        """
+        order = np.argsort(group_labels, kind="stable")
+        self.group_labels = np.ascontiguousarray(np.asarray(group_labels)[order])
+        # one zero row in the end for the groups which were not seen in training
+        self.random_effects = np.zeros((len(order) + 1, np.shape(random_effects)[1] if len(order) > 0 else 0))
+        self.random_effects[:-1] = np.asarray(random_effects)[order]
+        self.beta = np.asarray(beta, dtype=float)
+        self.columns_labels = np.asarray(columns_labels, dtype=int)
+        self.random_intercept = bool(random_intercept)
+
+        self.group_column = int(np.flatnonzero(self.columns_labels == 0)[0])
+        self.fixed_columns = np.flatnonzero((self.columns_labels == 1) | (self.columns_labels == 3))
+        self.random_columns = np.flatnonzero((self.columns_labels == 2) | (self.columns_labels == 3))
+        assert len(self.beta) == 1 + len(self.fixed_columns), "beta does not match columns_labels"
+        assert self.random_effects.shape[1] == self.random_intercept + len(self.random_columns), \
+            "random_effects do not match columns_labels"
+
+    @staticmethod
+    def from_model(model, use_sparse_coefficients: bool = False):
+        """
+        Creates a predictor from a fitted LinearLMESparseModel.
+
+        Parameters
+        ----------
+        model : LinearLMESparseModel
+            Fitted model.
+        use_sparse_coefficients : bool, default is False
+            If true then uses sparse coefficients, tbeta and tgamma, otherwise uses beta and gamma.
+
+        Returns
+        -------
+        predictor : LinearLMEPredictor
+            Predictor which makes the same predictions as the model.
+        """
+        coefficients = model.coef_
+        if use_sparse_coefficients:
+            beta, random_effects = coefficients["tbeta"], coefficients["sparse_random_effects"]
+        else:
+            beta, random_effects = coefficients["beta"], coefficients["random_effects"]
+        column_labels = np.asarray(coefficients["column_labels"])
+        return LinearLMEPredictor(beta=beta,
+                                  random_effects=np.reshape(random_effects, (len(coefficients["group_labels"]), -1)),
+                                  group_labels=coefficients["group_labels"],
+                                  columns_labels=column_labels[1:],
+                                  random_intercept=column_labels[0] == 3)
+
+    def save(self, path: str):
+        """
+        Saves the predictor to an .npz file.
+
+        Parameters
+        ----------
+        path : str
+            Path to the file.
+
+        Returns
+        -------
+            None
+        """
+        np.savez(path,
+                 format_version=predictor_format_version,
+                 beta=self.beta,
+                 random_effects=self.random_effects[:-1],
+                 group_labels=self.group_labels,
+                 columns_labels=self.columns_labels,
+                 random_intercept=self.random_intercept)
+        return None
+
+    @staticmethod
+    def load(path: str):
+        """
+        Loads a predictor which was saved by LinearLMEPredictor.save.
+
+        Parameters
+        ----------
+        path : str
+            Path to the file.
+
+        Returns
+        -------
+        predictor : LinearLMEPredictor
+            The loaded predictor.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data["format_version"])
+            if version > predictor_format_version:
+                raise ValueError("The predictor was saved in the format version %d, but only versions up to %d "
+                                 "are supported." % (version, predictor_format_version))
+            return LinearLMEPredictor(beta=data["beta"],
+                                      random_effects=data["random_effects"],
+                                      group_labels=data["group_labels"],
+                                      columns_labels=data["columns_labels"],
+                                      random_intercept=bool(data["random_intercept"]))
+
+    def predict(self, x: np.ndarray, validate: bool = True) -> np.ndarray:
+        """
+        Makes predictions for the rows of x.
+
+        Parameters
+        ----------
+        x : np.ndarray, shape = [m, t]
+            Data in the same format as the data which the model was fitted on, but without the row of columns
+            labels. It may contain new groups, in which case the prediction is formed using the fixed effects only.
+        validate : bool, default is True
+            Whether to check the shape of x and that it is finite. Trusted callers can turn it off to save time.
+
+        Returns
+        -------
+        y : np.ndarray, shape = [m]
+            Predictions, in the order of the rows of x.
+        """
+        if validate:
+            x = np.asarray(x, dtype=float)
+            if x.ndim != 2 or x.shape[1] != len(self.columns_labels):
+                raise ValueError("x should be a matrix with %d columns." % len(self.columns_labels))
+            if not np.all(np.isfinite(x)):
+                raise ValueError("x contains NaN or infinity.")
+
+        # positions of the groups of the rows in the train groups, or the zero row for the unseen ones
+        labels = x[:, self.group_column]
+        positions = np.minimum(np.searchsorted(self.group_labels, labels), len(self.group_labels) - 1)
+        if len(self.group_labels) > 0:
+            positions = np.where(self.group_labels[positions] == labels, positions, -1)
+        random_effects = self.random_effects[positions]
+
+        y = self.beta[0] + x[:, self.fixed_columns].dot(self.beta[1:])
+        if self.random_intercept:
+            y += random_effects[:, 0]
+            random_effects = random_effects[:, 1:]
+        y += np.einsum('ij,ij->i', x[:, self.random_columns], random_effects)
+        return y
@@ -15,10 +15,12 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-from typing import Union, Sized, List, Optional, Tuple
+import contextlib
+import os
+import tempfile
+from typing import Union, Sized, List, Optional, Tuple, Iterable
 
 import numpy as np
-from sklearn.utils.multiclass import unique_labels
 from sklearn.utils.validation import check_X_y
 
 from skmixed.helpers import get_per_group_coefficients
@@ -53,21 +55,64 @@ class LinearLMEProblem(LMEProblem):
     """
 
     def __init__(self,
-                 fixed_features: List[np.ndarray],
-                 random_features: List[np.ndarray],
-                 obs_stds: Union[int, float, np.ndarray],
+                 fixed_features: Union[List[np.ndarray], np.ndarray],
+                 random_features: Union[List[np.ndarray], np.ndarray],
+                 obs_stds: Union[List[np.ndarray], np.ndarray],
                  group_labels: np.ndarray,
                  column_labels: List[Tuple[int, int]],
                  order_of_objects: np.ndarray,
-                 answers=None):
-        super(LinearLMEProblem, self).__init__()
+                 answers=None,
+                 group_offsets: np.ndarray = None,
+                 sufficient_statistics: dict = None):
+        """
+        Creates a problem from the data of its groups.
 
-        self.fixed_features = fixed_features
-        self.answers = answers
-        self.random_features = random_features
-        self.obs_stds = obs_stds
+        The data is stored packed: one array per role (fixed features, random features, answers, and observation
+        standard deviations) where the objects of every group occupy a contiguous range of rows, and an array
+        group_offsets such that the i-th group is rows group_offsets[i]:group_offsets[i+1]. The data of a group
+        is a view of these arrays.
 
-        self.groups_sizes = [x.shape[0] for x in fixed_features]
+        Parameters
+        ----------
+        fixed_features : List[np.ndarray] or np.ndarray
+            Fixed features of every group, or packed fixed features of all groups if group_offsets is given.
+        random_features : List[np.ndarray] or np.ndarray
+            Random features, in the same format.
+        obs_stds : List[np.ndarray] or np.ndarray
+            Observation standard deviations, in the same format.
+        group_labels : np.ndarray
+            Labels of the groups.
+        column_labels : List
+            Labels of the columns, see from_x_y for details.
+        order_of_objects : np.ndarray
+            Positions of the objects in the original dataset, in the order they are stored here.
+        answers : List[np.ndarray] or np.ndarray, Optional
+            Answers, in the same format as the features.
+        group_offsets : np.ndarray[int64], Optional
+            Offsets of the groups in the packed arrays. If None then the data is given as lists of per-group
+            arrays, and it gets packed (copied) into contiguous arrays. Otherwise the packed arrays are used
+            as they are, without copying.
+        sufficient_statistics : dict, Optional
+            Per-group Λ-weighted Gram blocks of the data, see from_chunks for details. If given then the problem
+            may have no data at all (None instead of the features), and it can only be used by the oracles in
+            'sufficient_statistics' mode.
+        """
+        super(LinearLMEProblem, self).__init__()
+
+        if group_offsets is None:
+            group_offsets = np.concatenate(([0], np.cumsum([x.shape[0] for x in fixed_features])))
+            fixed_features = _pack(fixed_features)
+            random_features = _pack(random_features)
+            obs_stds = _pack(obs_stds)
+            answers = None if answers is None else _pack(answers)
+        self.group_offsets = np.asarray(group_offsets, dtype=np.int64)
+        self.fixed_features_packed = fixed_features
+        self.random_features_packed = random_features
+        self.obs_stds_packed = obs_stds
+        self.answers_packed = answers
+        self.sufficient_statistics = sufficient_statistics
+
+        self.groups_sizes = np.diff(self.group_offsets).tolist()
         self.num_groups = len(self.groups_sizes)
         self.num_obs = sum(self.groups_sizes)
         self.group_labels = group_labels
@@ -77,22 +122,187 @@ class LinearLMEProblem(LMEProblem):
         self.num_random_effects = sum([label in (2, 3) for label in column_labels])
         self.num_fixed_effects = sum([label in (1, 3) for label in column_labels])
 
+    @property
+    def fixed_features(self) -> List[np.ndarray]:
+        """Fixed features of every group, as views of the packed array."""
+        return np.split(self.fixed_features_packed, self.group_offsets[1:-1])
+
+    @fixed_features.setter
+    def fixed_features(self, value: List[np.ndarray]):
+        self.fixed_features_packed = _pack_groups(value, self.groups_sizes, "fixed_features")
+
+    @property
+    def random_features(self) -> List[np.ndarray]:
+        """Random features of every group, as views of the packed array."""
+        return np.split(self.random_features_packed, self.group_offsets[1:-1])
+
+    @random_features.setter
+    def random_features(self, value: List[np.ndarray]):
+        self.random_features_packed = _pack_groups(value, self.groups_sizes, "random_features")
+
+    @property
+    def obs_stds(self) -> List[np.ndarray]:
+        """Observation standard deviations of every group, as views of the packed array."""
+        return np.split(self.obs_stds_packed, self.group_offsets[1:-1])
+
+    @obs_stds.setter
+    def obs_stds(self, value: List[np.ndarray]):
+        self.obs_stds_packed = _pack_groups(value, self.groups_sizes, "obs_stds")
+
+    @property
+    def answers(self) -> Optional[List[np.ndarray]]:
+        """Answers of every group, as views of the packed array, or None if the problem has no answers."""
+        if self.answers_packed is None:
+            return None
+        return np.split(self.answers_packed, self.group_offsets[1:-1])
+
+    @answers.setter
+    def answers(self, value: Optional[List[np.ndarray]]):
+        self.answers_packed = None if value is None else _pack_groups(value, self.groups_sizes, "answers")
+
     def __iter__(self):
+        if self.fixed_features_packed is None:
+            raise ValueError("The problem has no data, only sufficient statistics of its groups.")
         self.__iteration_pos = 0
         return self
 
     def __next__(self):
         j = self.__iteration_pos
-        if j < len(self.fixed_features):
+        if j < self.num_groups:
             self.__iteration_pos += 1
-            if self.answers is None:
+            start, end = self.group_offsets[j], self.group_offsets[j + 1]
+            if self.answers_packed is None:
                 answers = None
             else:
-                answers = self.answers[j]
-            return self.fixed_features[j], answers, self.random_features[j], self.obs_stds[j]
+                answers = self.answers_packed[start:end]
+            return (self.fixed_features_packed[start:end], answers, self.random_features_packed[start:end],
+                    self.obs_stds_packed[start:end])
         else:
             raise StopIteration
 
+    def take_groups(self, groups_idx: np.ndarray):
+        """
+        Returns a problem which consists only of the given groups of this problem.
+
+        Parameters
+        ----------
+        groups_idx : np.ndarray[int]
+            Indices (positions, not labels) of the groups to take, in the order they should appear
+            in the new problem.
+
+        Returns
+        -------
+        problem : LinearLMEProblem
+            A problem with a copy of the data of the selected groups.
+        """
+
+        groups_idx = np.asarray(groups_idx, dtype=np.int64)
+        sizes = self.group_offsets[groups_idx + 1] - self.group_offsets[groups_idx]
+        group_offsets = np.concatenate(([0], np.cumsum(sizes)))
+        if self.sufficient_statistics is not None:
+            sufficient_statistics = {name: value[groups_idx] for name, value in self.sufficient_statistics.items()}
+        else:
+            sufficient_statistics = None
+        if self.fixed_features_packed is None:
+            return LinearLMEProblem(fixed_features=None,
+                                    random_features=None,
+                                    obs_stds=None,
+                                    group_labels=np.asarray(self.group_labels)[groups_idx],
+                                    column_labels=self.column_labels,
+                                    order_of_objects=None,
+                                    group_offsets=group_offsets,
+                                    sufficient_statistics=sufficient_statistics)
+        # positions of the objects of the selected groups in the packed arrays
+        objects_idx = np.arange(group_offsets[-1]) + np.repeat(self.group_offsets[groups_idx] - group_offsets[:-1],
+                                                               sizes)
+        return LinearLMEProblem(fixed_features=self.fixed_features_packed[objects_idx],
+                                random_features=self.random_features_packed[objects_idx],
+                                obs_stds=self.obs_stds_packed[objects_idx],
+                                group_labels=np.asarray(self.group_labels)[groups_idx],
+                                column_labels=self.column_labels,
+                                order_of_objects=np.asarray(self.order_of_objects)[objects_idx],
+                                answers=None if self.answers_packed is None else self.answers_packed[objects_idx],
+                                group_offsets=group_offsets,
+                                sufficient_statistics=sufficient_statistics)
+
+    def take_columns(self, fixed_idx: np.ndarray, random_idx: np.ndarray):
+        """
+        Returns a problem which consists only of the given fixed and random features of this problem.
+
+        It is this problem with the coefficients of all the other features fixed at zero: a column which is both
+        a fixed and a random feature here stays only as a fixed (or random) one if only its β (or 𝛄) is taken.
+        The intercept always stays, either as a fixed or as a random feature.
+
+        Parameters
+        ----------
+        fixed_idx : np.ndarray[int]
+            Indices of the fixed effects to take, in ascending order.
+        random_idx : np.ndarray[int]
+            Indices of the random effects to take, in ascending order.
+
+        Returns
+        -------
+        problem : LinearLMEProblem
+            A problem with a copy of the selected columns of the data.
+        """
+        fixed_idx = np.asarray(fixed_idx, dtype=np.int64)
+        random_idx = np.asarray(random_idx, dtype=np.int64)
+        column_labels = np.asarray(self.column_labels)
+        is_fixed = np.isin(column_labels, (1, 3))
+        is_random = np.isin(column_labels, (2, 3))
+        # positions of the columns among the fixed and among the random effects
+        fixed_position = np.cumsum(is_fixed) - 1
+        random_position = np.cumsum(is_random) - 1
+        new_labels = np.where(is_fixed | is_random,
+                              (is_fixed & np.isin(fixed_position, fixed_idx)) * 1
+                              + (is_random & np.isin(random_position, random_idx)) * 2,
+                              column_labels)
+        # the columns of group labels and of STDs stay as they are
+        kept_columns = ~(is_fixed | is_random) | (new_labels > 0)
+        if not kept_columns[0]:
+            raise ValueError("The intercept can't be dropped: take either its fixed or its random effect.")
+        if self.sufficient_statistics is not None:
+            f, r = fixed_idx, random_idx
+            statistics = self.sufficient_statistics
+            sufficient_statistics = {"xTlambda_invX": statistics["xTlambda_invX"][:, f][:, :, f],
+                                     "xTlambda_invZ": statistics["xTlambda_invZ"][:, f][:, :, r],
+                                     "xTlambda_invY": statistics["xTlambda_invY"][:, f],
+                                     "zTlambda_invY": statistics["zTlambda_invY"][:, r],
+                                     "yTlambda_invY": statistics["yTlambda_invY"],
+                                     "zTlambda_invZ": statistics["zTlambda_invZ"][:, r][:, :, r],
+                                     "lambda_logdets": statistics["lambda_logdets"]}
+        else:
+            sufficient_statistics = None
+        has_data = self.fixed_features_packed is not None
+        return LinearLMEProblem(fixed_features=self.fixed_features_packed[:, fixed_idx] if has_data else None,
+                                random_features=self.random_features_packed[:, random_idx] if has_data else None,
+                                obs_stds=self.obs_stds_packed,
+                                group_labels=self.group_labels,
+                                column_labels=new_labels[kept_columns].tolist(),
+                                order_of_objects=self.order_of_objects,
+                                answers=self.answers_packed,
+                                group_offsets=self.group_offsets,
+                                sufficient_statistics=sufficient_statistics)
+
+    def compute_sufficient_statistics(self):
+        """
+        Computes the Λ-weighted Gram blocks of every group and keeps them in sufficient_statistics.
+
+        The oracles in 'woodbury' and 'sufficient_statistics' modes take them from the problem instead of computing
+        them, and take_groups passes them on to the subproblems, so many oracles on subsets of the groups
+        (e.g. the folds of cross-validation) share one pass over the data.
+
+        Returns
+        -------
+            None
+        """
+        if self.answers_packed is None:
+            raise ValueError("Sufficient statistics require answers.")
+        statistics = [_sufficient_statistics(x, y, z, stds) for x, y, z, stds in self]
+        self.sufficient_statistics = {name: np.array([group_statistics[name] for group_statistics in statistics])
+                                      for name in _sufficient_statistics_names}
+        return None
+
     @staticmethod
     def generate(groups_sizes: Optional[List[Optional[int]]] = None,
                  features_labels: Optional[List[int]] = None,
@@ -325,6 +535,188 @@ class LinearLMEProblem(LMEProblem):
         else:
             return generated_problem, None
 
+    @staticmethod
+    def generate_batched(groups_sizes: Union[List[int], np.ndarray],
+                         features_labels: Optional[List[int]] = None,
+                         random_intercept: bool = False,
+                         features_covariance_matrix: Optional[np.ndarray] = None,
+                         obs_std: Union[float, np.ndarray] = 0.1,
+                         beta: Optional[np.ndarray] = None,
+                         gamma: Optional[np.ndarray] = None,
+                         true_random_effects: Optional[np.ndarray] = None,
+                         random_state: Union[int, np.random.Generator, None] = None,
+                         mode: str = "memory",
+                         path: str = None,
+                         batch_size: int = 2 ** 20):
+        """
+        Generates a random mixed-effects problem, like LinearLMEProblem.generate, but fast enough for large ones.
+
+        The groups are generated in batches of about batch_size objects: the features of all objects
+        of a batch are drawn by one call to the random generator and multiplied by the Cholesky factor of
+        features_covariance_matrix, which is computed only once. It uses its own random generator, so the global
+        Numpy random state is left intact. The results differ from the ones of LinearLMEProblem.generate
+        for the same seed.
+
+        Parameters
+        ----------
+        groups_sizes : List[int] or np.ndarray[int]
+            Sizes of the groups.
+        features_labels : List[int], Optional
+            Labels of the features, see LinearLMEProblem.generate. If None then the only feature is the intercept.
+        random_intercept : bool, default is False
+            True if the intercept is a random parameter as well.
+        features_covariance_matrix : np.ndarray, Optional, Symmetric and PD
+            Covariance matrix of the features from features_labels. If None then defaults to the identity matrix.
+        obs_std : float or np.ndarray
+            Standard deviations of measurement errors: one for all objects, one per group, or one per object.
+        beta : np.ndarray, Optional
+            True vector of fixed effects. If None then it's generated from U[0, 1]^k.
+        gamma : np.ndarray, Optional
+            True vector of random effects' variances. If None then it's generated from U[0, 1]^k.
+        true_random_effects : np.ndarray, Optional, shape = [num_groups, k]
+            True random effects. If None then they are generated as u_i ~ 𝒩(0, diag(𝛄)).
+        random_state : int or np.random.Generator, Optional
+            Seed of a new random generator, or a generator to use.
+        mode : str
+            What to do with the generated data:
+
+                - "memory" : return a LinearLMEProblem which holds all the data in memory.
+                - "stream" : return an iterator of chunks (x, y), one per batch, in the format of
+                  LinearLMEProblem.from_x_y with columns labels features_labels + [4, 0]. They are generated
+                  only when the iterator is advanced. It can be fed to LinearLMEProblem.from_chunks.
+                - "disk" : write the data straight to the directory path in the format of LinearLMEProblem.save,
+                  batch by batch, and return the problem loaded from there memory-mapped.
+
+        path : str, Optional
+            Directory for the "disk" mode.
+        batch_size : int, default is 2**20
+            Approximate number of objects generated at once. Every batch consists of whole groups.
+
+        Returns
+        -------
+        problem : LinearLMEProblem or Iterator of (x, y)
+            Generated problem, or the stream of its chunks.
+        true_parameters : dict
+            True beta, gamma, random effects, and per group coefficients. Unlike LinearLMEProblem.generate,
+            it does not include the errors.
+        """
+        if mode not in ("memory", "stream", "disk"):
+            raise ValueError("Unknown mode: %s" % mode)
+        if mode == "disk" and path is None:
+            raise ValueError("'disk' mode requires a path.")
+        rng = np.random.default_rng(random_state)
+        groups_sizes = np.asarray(groups_sizes, dtype=np.int64)
+        features_labels = [] if features_labels is None else list(features_labels)
+        num_groups = len(groups_sizes)
+        group_offsets = np.concatenate(([0], np.cumsum(groups_sizes)))
+        num_objects = int(group_offsets[-1])
+
+        fixed_effects_idx = np.array([0] + [i + 1 for i, label in enumerate(features_labels) if label in (1, 3)])
+        random_effects_idx = np.array(([0] if random_intercept else [])
+                                      + [i + 1 for i, label in enumerate(features_labels) if label in (2, 3)],
+                                      dtype=int)
+        num_fixed_effects = len(fixed_effects_idx)
+        num_random_effects = len(random_effects_idx)
+        if beta is None:
+            beta = rng.random(num_fixed_effects)
+        assert beta.shape[0] == num_fixed_effects, "beta should have %d elements" % num_fixed_effects
+        if gamma is None:
+            gamma = rng.random(num_random_effects)
+        assert gamma.shape[0] == num_random_effects, "gamma should have %d elements" % num_random_effects
+        if features_covariance_matrix is None:
+            features_cholesky = np.eye(len(features_labels))
+        else:
+            assert features_covariance_matrix.shape == (len(features_labels), len(features_labels)), \
+                "features_covariance_matrix should be n*n where n is length of features_labels"
+            features_cholesky = np.linalg.cholesky(features_covariance_matrix)
+        if true_random_effects is None:
+            true_random_effects = rng.standard_normal((num_groups, num_random_effects)) * np.sqrt(gamma)
+        if isinstance(obs_std, np.ndarray):
+            if obs_std.shape[0] == num_objects:
+                objects_stds = obs_std
+            elif obs_std.shape[0] == num_groups:
+                objects_stds = None
+            else:
+                raise ValueError("len(obs_std) should be either num_groups or sum(groups_sizes)")
+        elif isinstance(obs_std, (float, int)):
+            objects_stds = None
+        else:
+            raise ValueError("obs_std is not an array or int/float.")
+
+        # batches of whole groups of about batch_size objects: groups batches_starts[j]:batches_starts[j+1]
+        batches_starts = np.unique(np.searchsorted(group_offsets[1:], np.arange(0, num_objects, batch_size),
+                                                   side="right"))
+        batches_starts = np.append(batches_starts, num_groups)
+
+        def batches():
+            for first_group, last_group in zip(batches_starts[:-1], batches_starts[1:]):
+                start, end = group_offsets[first_group], group_offsets[last_group]
+                sizes = groups_sizes[first_group:last_group]
+                all_features = np.empty((end - start, len(features_labels) + 1))
+                all_features[:, 0] = 1
+                all_features[:, 1:] = rng.standard_normal((end - start, len(features_labels))).dot(
+                    features_cholesky.T)
+                if objects_stds is not None:
+                    stds = np.asarray(objects_stds[start:end], dtype=float)
+                elif isinstance(obs_std, np.ndarray):
+                    stds = np.repeat(obs_std[first_group:last_group].astype(float), sizes)
+                else:
+                    stds = np.full(end - start, float(obs_std))
+                fixed_features = all_features[:, fixed_effects_idx]
+                random_features = all_features[:, random_effects_idx]
+                objects_random_effects = np.repeat(true_random_effects[first_group:last_group], sizes, axis=0)
+                answers = (fixed_features.dot(beta) + np.einsum('ij,ij->i', random_features, objects_random_effects)
+                           + rng.standard_normal(end - start) * stds)
+                yield first_group, last_group, all_features, fixed_features, random_features, stds, answers
+
+        all_columns_labels = [3 if random_intercept else 1] + features_labels + [4, 0]
+        true_parameters = {
+            "beta": beta,
+            "gamma": gamma,
+            "per_group_coefficients": get_per_group_coefficients(beta, true_random_effects,
+                                                                 labels=np.array(all_columns_labels)),
+            "random_effects": true_random_effects,
+        }
+
+        if mode == "stream":
+            def chunks():
+                for first_group, last_group, all_features, _, _, stds, answers in batches():
+                    group_labels = np.repeat(np.arange(first_group, last_group), groups_sizes[first_group:last_group])
+                    yield np.column_stack((all_features[:, 1:], stds, group_labels)), answers
+
+            return chunks(), true_parameters
+
+        shapes = {"fixed_features": (num_objects, num_fixed_effects),
+                  "random_features": (num_objects, num_random_effects),
+                  "obs_stds": (num_objects,),
+                  "answers": (num_objects,)}
+        if mode == "disk":
+            os.makedirs(path, exist_ok=True)
+            arrays = {name: np.lib.format.open_memmap(os.path.join(path, name + ".npy"), mode="w+",
+                                                      dtype=np.float64, shape=shape)
+                      for name, shape in shapes.items()}
+        else:
+            arrays = {name: np.empty(shape) for name, shape in shapes.items()}
+        for first_group, last_group, _, fixed_features, random_features, stds, answers in batches():
+            start, end = group_offsets[first_group], group_offsets[last_group]
+            arrays["fixed_features"][start:end] = fixed_features
+            arrays["random_features"][start:end] = random_features
+            arrays["obs_stds"][start:end] = stds
+            arrays["answers"][start:end] = answers
+
+        metadata = {"group_offsets": group_offsets,
+                    "group_labels": np.arange(num_groups),
+                    "column_labels": np.array(all_columns_labels),
+                    "order_of_objects": np.arange(num_objects)}
+        if mode == "disk":
+            for array in arrays.values():
+                array.flush()
+            del arrays
+            for name, array in metadata.items():
+                np.save(os.path.join(path, name + ".npy"), array, allow_pickle=False)
+            return LinearLMEProblem.load(path), true_parameters
+        return LinearLMEProblem(**metadata, **arrays), true_parameters
+
     @staticmethod
     def from_x_y(x: np.ndarray,
                  y: Optional[np.ndarray] = None,
@@ -334,6 +726,10 @@ class LinearLMEProblem(LMEProblem):
         """
         Transforms matrices x (data) and y(answers) into an instance of LinearLMEProblem
 
+        The objects are grouped by one stable sort of the group labels, so it takes O(m*log(m)) time regardless
+        of the number of groups. If the objects are already sorted by groups then the sort is skipped.
+        The arrays are passed to the problem as its packed storage, without copying.
+
         Parameters
         ----------
         x: array-like, shape = [m,n]
@@ -378,39 +774,39 @@ class LinearLMEProblem(LMEProblem):
         assert all(x[:, obs_std_idx] != 0), "Errors' STDs can't be zero. Check for zeros in the respective column."
         features_idx = [i for i, t in enumerate(columns_labels) if t == 1 or t == 3]
         random_features_idx = [i for i, t in enumerate(columns_labels) if t == 2 or t == 3]
-        groups_labels = unique_labels(x[:, group_labels_idx])
+        group_column = x[:, group_labels_idx]
+        if np.all(group_column[1:] >= group_column[:-1]):
+            # the objects are already sorted by groups, so every group is a contiguous slice of the input
+            order_of_objects = np.arange(x.shape[0])
+        else:
+            # stable sort keeps the objects of every group in their original order
+            order_of_objects = np.argsort(group_column, kind="stable")
+            x = x[order_of_objects]
+            if y is not None:
+                y = y[order_of_objects]
+            group_column = x[:, group_labels_idx]
+        groups_starts = np.flatnonzero(group_column[1:] != group_column[:-1]) + 1
+        groups_labels = group_column[np.concatenate(([0], groups_starts))]
+
+        # add an intercept column plus real features
+        intercept = np.ones((x.shape[0], 1))
+        fixed_features = np.concatenate((intercept, x[:, features_idx]), axis=1)
+        # same for random effects
+        random_features = x[:, random_features_idx]
+        if random_intercept:
+            random_features = np.concatenate((intercept, random_features), axis=1)
 
         data = {
-            'fixed_features': [],
-            'random_features': [],
-            'answers': None if y is None else [],
-            'obs_stds': [],
+            'fixed_features': fixed_features,
+            'random_features': random_features,
+            'answers': y,
+            'obs_stds': x[:, obs_std_idx],
             'group_labels': groups_labels,
-            'column_labels': np.array([3 if random_intercept else 1] + columns_labels)
+            'column_labels': np.array([3 if random_intercept else 1] + columns_labels),
+            'order_of_objects': order_of_objects,
+            'group_offsets': np.concatenate(([0], groups_starts, [x.shape[0]]))
         }
 
-        order_of_objects = []
-        for label in groups_labels:
-            objects_idx = x[:, group_labels_idx] == label
-            order_of_objects += np.where(objects_idx)[0].tolist()
-            features = x[np.ix_(objects_idx, features_idx)]
-            # add an intercept column plus real features
-            # noinspection PyTypeChecker
-            data['fixed_features'].append(np.concatenate((np.ones((features.shape[0], 1)), features), axis=1))
-            # same for random effects
-            random_features = x[np.ix_(objects_idx, random_features_idx)]
-            if random_intercept:
-                # noinspection PyTypeChecker
-                data['random_features'].append(np.concatenate((np.ones((random_features.shape[0], 1)), random_features),
-                                                              axis=1))
-            else:
-                data['random_features'].append(random_features)
-            if y is not None:
-                data['answers'].append(y[objects_idx])
-            data['obs_stds'].append(x[objects_idx, obs_std_idx])
-
-        data["order_of_objects"] = order_of_objects
-
         return LinearLMEProblem(**data), None
 
     def to_x_y(self) -> Tuple[np.ndarray, np.ndarray]:
@@ -428,9 +824,9 @@ class LinearLMEProblem(LMEProblem):
         """
 
         all_group_labels = np.repeat(self.group_labels, self.groups_sizes)
-        all_features = np.concatenate(self.fixed_features, axis=0)
-        all_random_features = np.concatenate(self.random_features, axis=0)
-        all_stds = np.concatenate(self.obs_stds, axis=0)
+        all_features = self.fixed_features_packed
+        all_random_features = self.random_features_packed
+        all_stds = self.obs_stds_packed
         untitled_data = np.zeros((all_features.shape[0], len(self.column_labels) - 1))
 
         fixed_effects_counter = 1
@@ -459,8 +855,293 @@ class LinearLMEProblem(LMEProblem):
         untitled_data = untitled_data[self.order_of_objects, :]
         column_labels = np.array(self.column_labels[1:]).reshape((1, len(self.column_labels[1:])))
         data_with_column_labels = np.concatenate((column_labels, untitled_data), axis=0)
-        if self.answers is not None:
-            all_answers = np.concatenate(self.answers)
+        if self.answers_packed is not None:
+            all_answers = np.array(self.answers_packed)
         else:
             all_answers = None
         return data_with_column_labels, all_answers
+
+    def save(self, path: str):
+        """
+        Saves the problem to a directory of .npy files, one file per packed array.
+
+        The directory can be loaded back by LinearLMEProblem.load, which memory-maps the files, so the grouping
+        and packing of the data are paid for only once. Sufficient statistics of the groups are saved too,
+        one file per statistic, and the arrays which the problem does not have (answers, or the data of
+        a problem built from sufficient statistics only) are not saved.
+
+        Parameters
+        ----------
+        path : str
+            Path to the directory. It's created if it does not exist; the files which are already there
+            get overwritten.
+
+        Returns
+        -------
+            None
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {"group_offsets": self.group_offsets,
+                  "group_labels": np.asarray(self.group_labels),
+                  "column_labels": np.asarray(self.column_labels),
+                  "order_of_objects": None if self.order_of_objects is None else np.asarray(self.order_of_objects)}
+        for name in _packed_arrays_names:
+            arrays[name] = getattr(self, name + "_packed")
+        for name in _sufficient_statistics_names:
+            arrays[name] = None if self.sufficient_statistics is None else self.sufficient_statistics[name]
+        for name, array in arrays.items():
+            file_name = os.path.join(path, name + ".npy")
+            if array is None:
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+                continue
+            np.save(file_name, array, allow_pickle=False)
+        return None
+
+    @staticmethod
+    def load(path: str, mmap: bool = True):
+        """
+        Loads a problem which was saved by LinearLMEProblem.save.
+
+        Parameters
+        ----------
+        path : str
+            Path to the directory.
+        mmap : bool, default = True
+            If True then the arrays are memory-mapped read-only, so loading is almost instant and only the pages
+            of the groups which are actually accessed are read from the disk. Otherwise the arrays are read
+            into memory.
+
+        Returns
+        -------
+        problem : LinearLMEProblem
+            The loaded problem.
+        """
+        arrays = {}
+        required_names = ("group_offsets", "group_labels", "column_labels")
+        for name in required_names + ("order_of_objects",) + _packed_arrays_names + _sufficient_statistics_names:
+            file_name = os.path.join(path, name + ".npy")
+            if name not in required_names and not os.path.exists(file_name):
+                arrays[name] = None
+                continue
+            arrays[name] = np.load(file_name, mmap_mode="r" if mmap else None, allow_pickle=False)
+        if any(arrays[name] is None for name in _sufficient_statistics_names):
+            sufficient_statistics = None
+        else:
+            sufficient_statistics = {name: arrays[name] for name in _sufficient_statistics_names}
+        return LinearLMEProblem(fixed_features=arrays["fixed_features"],
+                                random_features=arrays["random_features"],
+                                obs_stds=arrays["obs_stds"],
+                                group_labels=np.array(arrays["group_labels"]),
+                                column_labels=np.array(arrays["column_labels"]),
+                                order_of_objects=arrays["order_of_objects"],
+                                answers=arrays["answers"],
+                                group_offsets=np.asarray(arrays["group_offsets"]),
+                                sufficient_statistics=sufficient_statistics)
+
+    @staticmethod
+    def from_chunks(chunks: Iterable[Tuple[np.ndarray, Optional[np.ndarray]]],
+                    columns_labels: List[int],
+                    random_intercept: bool = True,
+                    sufficient_statistics: bool = False,
+                    path: str = None):
+        """
+        Builds a problem from a stream of chunks of rows, without ever holding the whole dataset in one matrix.
+
+        Every chunk is grouped as in from_x_y, and the rows of every group are accumulated separately, so the
+        result is the same as from_x_y on the concatenation of the chunks: groups are sorted by their labels,
+        and the objects of every group keep the order they came in. order_of_objects refers to the positions
+        of the objects in the concatenation of the chunks.
+
+        Only path or sufficient_statistics bound the memory. Without them the rows of the chunks are kept
+        in memory until the last chunk comes, and then they are copied into the packed arrays of the problem,
+        so the peak memory is about twice the size of the dataset.
+
+        Parameters
+        ----------
+        chunks : Iterable of (x, y)
+            Chunks of the dataset: x of shape [m_c, n] and y of shape [m_c], or None if there are no answers.
+            The objects of one group can be scattered over many chunks.
+        columns_labels : List, shape = [n]
+            Labels of the columns of x, see from_x_y.
+        random_intercept : bool, default = True
+            Whether to treat the intercept as a random feature.
+        sufficient_statistics : bool, default = False
+            If True then only the Λ-weighted Gram blocks of every group are accumulated (O(p²) memory per group
+            regardless of its size), and the rows are thrown away. The resulting problem has no data and it can
+            only be used by the oracles in 'sufficient_statistics' mode.
+        path : str, Optional
+            If given then the rows are spilled to temporary files in this directory as they come, and then
+            they are assembled into the format of LinearLMEProblem.save there. The problem is loaded back
+            memory-mapped, so neither the chunks nor the result have to fit in memory at once.
+            The directory is created if it does not exist.
+
+        Returns
+        -------
+        problem : LinearLMEProblem
+            An instance of LinearLMEProblem built on the concatenation of the chunks.
+        """
+        if sufficient_statistics and path is not None:
+            raise ValueError("Sufficient statistics are kept in memory, path can not be used with them.")
+        # group label -> data pieces of this group, their locations in the spill files,
+        # or its sufficient statistics, depending on the mode
+        accumulated = {}
+        groups_sizes = {}
+        num_objects = 0
+        column_labels = None
+        has_answers = None
+        roles = _packed_arrays_names + ("order_of_objects",)
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=path) if path is not None else _no_directory() as spill_path, \
+                contextlib.ExitStack() as open_files:
+            spill_files = None
+            widths = None
+            for x, y in chunks:
+                chunk, _ = LinearLMEProblem.from_x_y(np.asarray(x), y, columns_labels,
+                                                     random_intercept=random_intercept)
+                if has_answers is None:
+                    has_answers = y is not None
+                    column_labels = chunk.column_labels
+                    widths = {"fixed_features": (chunk.num_fixed_effects,),
+                              "random_features": (chunk.num_random_effects,)}
+                    if sufficient_statistics and not has_answers:
+                        raise ValueError("Sufficient statistics require answers.")
+                if has_answers != (y is not None):
+                    raise ValueError("Either all chunks or none of them should have answers.")
+                pieces = {"fixed_features": chunk.fixed_features_packed,
+                          "random_features": chunk.random_features_packed,
+                          "obs_stds": chunk.obs_stds_packed,
+                          "answers": chunk.answers_packed,
+                          "order_of_objects": chunk.order_of_objects + num_objects}
+                if spill_path is not None:
+                    if spill_files is None:
+                        spill_files = {role: open_files.enter_context(open(os.path.join(spill_path, role), "wb"))
+                                       for role in roles}
+                    for role in roles:
+                        if pieces[role] is not None:
+                            dtype = np.int64 if role == "order_of_objects" else np.float64
+                            np.ascontiguousarray(pieces[role], dtype=dtype).tofile(spill_files[role])
+                for j, label in enumerate(chunk.group_labels):
+                    start, end = chunk.group_offsets[j], chunk.group_offsets[j + 1]
+                    groups_sizes[label] = groups_sizes.get(label, 0) + end - start
+                    if sufficient_statistics:
+                        statistics = _sufficient_statistics(pieces["fixed_features"][start:end],
+                                                            pieces["answers"][start:end],
+                                                            pieces["random_features"][start:end],
+                                                            pieces["obs_stds"][start:end])
+                        if label in accumulated:
+                            for name, value in statistics.items():
+                                accumulated[label][name] += value
+                        else:
+                            accumulated[label] = statistics
+                    elif spill_path is not None:
+                        accumulated.setdefault(label, []).append((num_objects + start, end - start))
+                    else:
+                        accumulated.setdefault(label, []).append(
+                            {role: None if piece is None else piece[start:end] for role, piece in pieces.items()})
+                num_objects += chunk.num_obs
+            if has_answers is None:
+                raise ValueError("No chunks were given.")
+
+            group_labels = np.array(sorted(accumulated))
+            group_offsets = np.concatenate(([0], np.cumsum([groups_sizes[label] for label in group_labels])))
+            if sufficient_statistics:
+                return LinearLMEProblem(fixed_features=None,
+                                        random_features=None,
+                                        obs_stds=None,
+                                        group_labels=group_labels,
+                                        column_labels=column_labels,
+                                        order_of_objects=None,
+                                        group_offsets=group_offsets,
+                                        sufficient_statistics={
+                                            name: np.array([accumulated[label][name] for label in group_labels])
+                                            for name in _sufficient_statistics_names})
+            if spill_path is None:
+                arrays = {role: None if not has_answers and role == "answers" else
+                          _pack([piece[role] for label in group_labels for piece in accumulated[label]])
+                          for role in roles}
+                return LinearLMEProblem(fixed_features=arrays["fixed_features"],
+                                        random_features=arrays["random_features"],
+                                        obs_stds=arrays["obs_stds"],
+                                        group_labels=group_labels,
+                                        column_labels=column_labels,
+                                        order_of_objects=arrays["order_of_objects"],
+                                        answers=arrays["answers"],
+                                        group_offsets=group_offsets)
+
+            # copy the spilled pieces of every group next to each other, straight into the files of the problem
+            for role in roles:
+                spill_files[role].close()
+                if role == "answers" and not has_answers:
+                    continue
+                dtype = np.int64 if role == "order_of_objects" else np.float64
+                shape = (num_objects,) + widths.get(role, ())
+                spilled = np.memmap(os.path.join(spill_path, role), dtype=dtype, mode="r", shape=shape)
+                packed = np.lib.format.open_memmap(os.path.join(path, role + ".npy"), mode="w+", dtype=dtype,
+                                                   shape=shape)
+                destination = 0
+                for label in group_labels:
+                    for source, size in accumulated[label]:
+                        packed[destination:destination + size] = spilled[source:source + size]
+                        destination += size
+                packed.flush()
+                del spilled, packed
+        if not has_answers and os.path.exists(os.path.join(path, "answers.npy")):
+            os.remove(os.path.join(path, "answers.npy"))
+        for name, array in (("group_offsets", group_offsets), ("group_labels", group_labels),
+                            ("column_labels", np.asarray(column_labels))):
+            np.save(os.path.join(path, name + ".npy"), array, allow_pickle=False)
+        return LinearLMEProblem.load(path)
+
+
+# Arrays which hold the data of a problem in the packed form, without "_packed" suffix
+_packed_arrays_names = ("fixed_features", "random_features", "obs_stds", "answers")
+
+# Names of the per-group sufficient statistics, the same as the names of the respective attributes of the oracles
+_sufficient_statistics_names = ("xTlambda_invX", "xTlambda_invZ", "xTlambda_invY", "zTlambda_invY", "yTlambda_invY",
+                                "zTlambda_invZ", "lambda_logdets")
+
+
+def _pack(arrays: List[np.ndarray]) -> np.ndarray:
+    """
+    Concatenates the per-group arrays into one contiguous array along the objects' axis.
+    """
+    if len(arrays) == 0:
+        return np.empty(0)
+    return np.concatenate(arrays, axis=0)
+
+
+def _pack_groups(arrays: List[np.ndarray], groups_sizes: List[int], name: str) -> np.ndarray:
+    """
+    Packs the per-group arrays which are assigned to a problem, checking that they match its groups,
+    since the offsets of the groups are not changed by the assignment.
+    """
+    sizes = [len(array) for array in arrays]
+    if sizes != list(groups_sizes):
+        raise ValueError("Sizes of the groups of %s %s do not match the sizes of the groups of the problem %s"
+                         % (name, sizes, list(groups_sizes)))
+    return _pack(arrays)
+
+
+def _sufficient_statistics(x: np.ndarray, y: np.ndarray, z: np.ndarray, stds: np.ndarray) -> dict:
+    """
+    Computes the Λ-weighted Gram blocks of the data of one group. They are additive over the objects,
+    so the statistics of a group which comes in parts is the sum of the statistics of the parts.
+    """
+    xTl = (x / stds[:, np.newaxis]).T
+    return {"xTlambda_invX": xTl.dot(x),
+            "xTlambda_invZ": xTl.dot(z),
+            "xTlambda_invY": xTl.dot(y),
+            "zTlambda_invY": z.T.dot(y / stds),
+            "yTlambda_invY": y.dot(y / stds),
+            "zTlambda_invZ": z.T.dot(z / stds[:, np.newaxis]),
+            "lambda_logdets": np.sum(np.log(stds))}
+
+
+@contextlib.contextmanager
+def _no_directory():
+    """
+    A stand-in for tempfile.TemporaryDirectory when no directory is needed.
+    """
+    yield None
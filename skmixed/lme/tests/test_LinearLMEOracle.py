@@ -1,3 +1,4 @@
+import os
 import unittest
 from unittest import TestCase
 
@@ -5,7 +6,7 @@ import numpy as np
 from numpy import allclose
 from scipy.misc import derivative
 
-from skmixed.lme.oracles import LinearLMEOracle, LinearLMEOracleRegularized
+from skmixed.lme.oracles import LinearLMEOracle, LinearLMEOracleRegularized, LinearLMEOracleW, _conjugate_gradient
 from skmixed.legacy.oracles import LinearLMEOracle as OldOracle
 from skmixed.lme.problems import LinearLMEProblem
 
@@ -51,6 +52,347 @@ class TestLinearLMEOracle(TestCase):
                             msg="Optimal random effects don't match with old oracle")
         return None
 
+    def test_modes_match_cholesky_mode(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 40, 5, 4, 5],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        cholesky_oracle = LinearLMEOracle(problem, mode="cholesky")
+        trials = 100
+        rtol = 1e-8
+        atol = 1e-8
+        for mode in ("packed", "batched", "woodbury", "sufficient_statistics"):
+            other_oracle = LinearLMEOracle(problem, mode=mode)
+            np.random.seed(42)
+            for random_beta, random_gamma in zip(np.random.rand(trials, problem.num_fixed_effects),
+                                                 np.random.rand(trials, problem.num_random_effects)):
+                # all modes should also handle zero variances of random effects, including round-off negative ones
+                random_gamma[np.random.rand(problem.num_random_effects) < 0.2] = 0
+                random_gamma[np.random.rand(problem.num_random_effects) < 0.1] = -1e-17
+                self.assertAlmostEqual(cholesky_oracle.loss(random_beta, random_gamma),
+                                       other_oracle.loss(random_beta, random_gamma),
+                                       delta=atol, msg="%s: Loss does not match with Cholesky mode" % mode)
+                self.assertTrue(allclose(cholesky_oracle.gradient_gamma(random_beta, random_gamma),
+                                         other_oracle.gradient_gamma(random_beta, random_gamma),
+                                         rtol=rtol, atol=atol),
+                                msg="%s: Gradients don't match with Cholesky mode" % mode)
+                self.assertTrue(allclose(cholesky_oracle.hessian_gamma(random_beta, random_gamma),
+                                         other_oracle.hessian_gamma(random_beta, random_gamma),
+                                         rtol=rtol, atol=atol),
+                                msg="%s: Hessians don't match with Cholesky mode" % mode)
+                self.assertTrue(allclose(cholesky_oracle.optimal_beta(random_gamma),
+                                         other_oracle.optimal_beta(random_gamma),
+                                         rtol=rtol, atol=atol),
+                                msg="%s: Optimal betas don't match with Cholesky mode" % mode)
+                self.assertTrue(allclose(cholesky_oracle.optimal_random_effects(random_beta, random_gamma),
+                                         other_oracle.optimal_random_effects(random_beta, random_gamma),
+                                         rtol=rtol, atol=atol),
+                                msg="%s: Optimal random effects don't match with Cholesky mode" % mode)
+        return None
+
+    def test_sufficient_statistics_mode_does_not_use_data(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 40, 5, 4, 5],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        oracle = LinearLMEOracle(problem, mode="sufficient_statistics")
+        reference_oracle = LinearLMEOracle(problem, mode="cholesky")
+        beta = np.random.rand(problem.num_fixed_effects)
+        gamma = np.random.rand(problem.num_random_effects)
+        # the data is not needed after the oracle is created
+        oracle.problem = None
+        self.assertAlmostEqual(oracle.loss(beta, gamma), reference_oracle.loss(beta, gamma), delta=1e-8)
+        self.assertTrue(allclose(oracle.optimal_beta(gamma), reference_oracle.optimal_beta(gamma)))
+        problem.answers = None
+        self.assertRaises(ValueError, lambda: LinearLMEOracle(problem, mode="sufficient_statistics"))
+        return None
+
+    def test_factors_cache(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 40],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        np.random.seed(42)
+        beta = np.random.rand(problem.num_fixed_effects)
+        gammas = np.random.rand(3, problem.num_random_effects)
+        for mode in ("cholesky", "packed", "batched", "woodbury", "sufficient_statistics"):
+            oracle = LinearLMEOracle(problem, mode=mode)
+            losses = [oracle.loss(beta, gamma) for gamma in gammas]
+            self.assertEqual(oracle.cache_misses, 3, msg="%s: new gammas should not be taken from cache" % mode)
+            # imitates the line search which alternates between the current and the trial points
+            for _ in range(5):
+                for gamma, loss in zip(gammas, losses):
+                    self.assertEqual(oracle.loss(beta, gamma.copy()), loss,
+                                     msg="%s: cached factors give a different loss" % mode)
+            self.assertEqual(oracle.cache_misses, 3, msg="%s: cached gammas were recalculated" % mode)
+            self.assertEqual(oracle.cache_hits, 15, msg="%s: cached gammas were not reused" % mode)
+            # Only one set of factors fits into the budget, so every change of gamma results in a miss.
+            one_entry_bytes = oracle.factors_cache_bytes // 3
+            small_cache_oracle = LinearLMEOracle(problem, mode=mode, cache_max_bytes=one_entry_bytes)
+            for _ in range(2):
+                for gamma in gammas:
+                    small_cache_oracle.loss(beta, gamma)
+            self.assertEqual(small_cache_oracle.cache_misses, 6, msg="%s: cache does not evict old factors" % mode)
+            self.assertEqual(len(small_cache_oracle.factors_cache), 1,
+                             msg="%s: cache does not respect its budget" % mode)
+        return None
+
+    def test_low_rank_updates(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[40, 5, 30, 60, 7],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        np.random.seed(42)
+        beta = np.random.rand(problem.num_fixed_effects)
+        gamma = np.random.rand(problem.num_random_effects)
+        oracle = LinearLMEOracle(problem, max_low_rank_updates=4)
+        reference_oracle = LinearLMEOracle(problem)
+        oracle.loss(beta, gamma)
+        # coordinate-wise steps, including downdates to zero, and one step which changes all the coordinates
+        steps = [(0, 0.3), (1, -0.5 * gamma[1]), (2, -gamma[2]), (0, 1.5), (3, -0.9 * gamma[3]), (1, 0.01)]
+        gammas = []
+        for i, (j, step) in enumerate(steps + [(slice(None), 0.1)]):
+            gamma = gamma.copy()
+            gamma[j] += step
+            gammas.append(gamma)
+            self.assertAlmostEqual(oracle.loss(beta, gamma), reference_oracle.loss(beta, gamma), delta=1e-8)
+            self.assertEqual(oracle.low_rank_updates, (i + 1) % 5, msg="Factors were not refreshed periodically")
+            for L, L_inv, reference_L, reference_L_inv in zip(oracle.omega_cholesky, oracle.omega_cholesky_inv,
+                                                                reference_oracle.omega_cholesky,
+                                                                reference_oracle.omega_cholesky_inv):
+                self.assertTrue(allclose(L, reference_L))
+                self.assertTrue(allclose(L_inv, reference_L_inv))
+            self.assertTrue(allclose(oracle.gradient_gamma(beta, gamma), reference_oracle.gradient_gamma(beta, gamma)))
+            self.assertTrue(allclose(oracle.optimal_beta(gamma), reference_oracle.optimal_beta(gamma)))
+        # factors taken from the cache come with the number of updates they went through
+        cache_hits = oracle.cache_hits
+        oracle.loss(beta, gammas[2])
+        self.assertEqual(oracle.cache_hits, cache_hits + 1)
+        self.assertEqual(oracle.low_rank_updates, 3, msg="Number of low-rank updates was not restored from the cache")
+        gamma = gammas[2] + 0.05
+        self.assertAlmostEqual(oracle.loss(beta, gamma), reference_oracle.loss(beta, gamma), delta=1e-8)
+        self.assertEqual(oracle.low_rank_updates, 4)
+        self.assertRaises(ValueError, lambda: LinearLMEOracle(problem, mode="woodbury", max_low_rank_updates=1))
+        return None
+
+    def test_fused_calls_match_separate_calls(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 40, 5, 4, 5],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        np.random.seed(42)
+        beta, tbeta = np.random.rand(2, problem.num_fixed_effects)
+        gamma, tgamma = np.random.rand(2, problem.num_random_effects)
+        for mode in ("cholesky", "packed", "batched", "woodbury", "sufficient_statistics"):
+            for oracle, args in ((LinearLMEOracle(problem, mode=mode), ()),
+                                 (LinearLMEOracleRegularized(problem, lb=0.3, lg=0.2, mode=mode), (tbeta, tgamma))):
+                loss, gradient = oracle.value_and_grad(beta, gamma, *args)
+                self.assertEqual(loss, oracle.loss(beta, gamma, *args), msg="%s: loss is different" % mode)
+                self.assertTrue((gradient == oracle.gradient_gamma(beta, gamma, *args[1:])).all(),
+                                msg="%s: gradient is different" % mode)
+                loss, gradient, hessian = oracle.value_grad_hess(beta, gamma, *args)
+                self.assertEqual(loss, oracle.loss(beta, gamma, *args), msg="%s: loss is different" % mode)
+                self.assertTrue((gradient == oracle.gradient_gamma(beta, gamma, *args[1:])).all(),
+                                msg="%s: gradient is different" % mode)
+                self.assertTrue((hessian == oracle.hessian_gamma(beta, gamma)).all(),
+                                msg="%s: Hessian is different" % mode)
+        return None
+
+    def test_random_effects_of_zero_variances(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 40, 5, 4, 5],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        beta, gamma = true_parameters["beta"], true_parameters["gamma"].copy()
+        gamma[1] = 0
+        for mode in ("cholesky", "packed", "batched", "woodbury", "sufficient_statistics"):
+            oracle = LinearLMEOracle(problem, mode=mode)
+            random_effects = oracle.optimal_random_effects(beta, gamma)
+            self.assertEqual(random_effects.shape, (problem.num_groups, problem.num_random_effects))
+            self.assertTrue(allclose(random_effects[:, 1], 0), msg="%s: R.E. of zero variance is not zero" % mode)
+            self.assertTrue(allclose(oracle.optimal_random_effects(beta, 0 * gamma), 0),
+                            msg="%s: R.E. of zero variances are not zero" % mode)
+            negative_gamma = gamma.copy()
+            negative_gamma[1] = -1e-17
+            self.assertTrue(np.all(oracle.optimal_random_effects(beta, negative_gamma)[:, 1] == 0),
+                            msg="%s: R.E. of a round-off negative variance is not zero" % mode)
+        return None
+
+    def test_losses_match_loss(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 40, 5, 4, 5],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        np.random.seed(42)
+        beta, tbeta = np.random.rand(2, problem.num_fixed_effects)
+        tgamma = np.random.rand(problem.num_random_effects)
+        gammas = np.random.rand(4, problem.num_random_effects)
+        gammas[0, 1] = 0
+        for mode in ("cholesky", "packed", "batched", "woodbury", "sufficient_statistics"):
+            for oracle, args in ((LinearLMEOracle(problem, mode=mode), ()),
+                                 (LinearLMEOracleRegularized(problem, lb=0.3, lg=0.2, mode=mode), (tbeta, tgamma))):
+                losses = oracle.losses(beta, gammas, *args)
+                self.assertTrue(allclose(losses, [oracle.loss(beta, gamma, *args) for gamma in gammas]),
+                                msg="%s: losses are different from loss" % mode)
+                # the factors of the current gamma are left untouched
+                factors_key, cache_misses = oracle.factors_key, oracle.cache_misses
+                oracle.losses(beta, 2 * gammas, *args)
+                self.assertEqual((factors_key, cache_misses), (oracle.factors_key, oracle.cache_misses))
+        return None
+
+    def test_losses_clamp_negative_gammas(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 40, 5, 4, 5],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        np.random.seed(42)
+        beta, tbeta = np.random.rand(2, problem.num_fixed_effects)
+        tgamma = np.random.rand(problem.num_random_effects)
+        # trial steps of a line search which overshoot the boundary
+        gammas = np.random.rand(4, problem.num_random_effects) - 0.5
+        w_oracle = LinearLMEOracleW(problem, lb=0.3, lg=0.2)
+        w_oracle._recalculate_drop_matrices(beta, tgamma)
+        for oracle, args in ((LinearLMEOracle(problem), ()),
+                             (LinearLMEOracleRegularized(problem, lb=0.3, lg=0.2), (tbeta, tgamma)),
+                             (w_oracle, (tbeta, tgamma))):
+            self.assertTrue(allclose(oracle.losses(beta, gammas, *args),
+                                     [oracle.loss(beta, np.maximum(gamma, 0), *args) for gamma in gammas]),
+                            msg="%s: losses of negative gammas are different" % type(oracle).__name__)
+        return None
+
+    def test_marginal_scores(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 40, 5, 4, 5],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        np.random.seed(42)
+        beta = np.random.rand(problem.num_fixed_effects)
+        gamma = np.random.rand(problem.num_random_effects)
+        oracle = LinearLMEOracle(problem)
+        scores_beta, scores_gamma = oracle.marginal_scores(beta, gamma)
+        for j in range(problem.num_fixed_effects):
+            # the loss is quadratic in beta_j, so its decrease is found from three points
+            step = np.zeros(problem.num_fixed_effects)
+            step[j] = 1
+            minus, zero, plus = (oracle.loss(beta + t * step, gamma) for t in (-1, 0, 1))
+            decrease = (plus - minus) ** 2 / (8 * (plus + minus - 2 * zero))
+            self.assertTrue(np.isclose(scores_beta[j], decrease), msg="Wrong score of beta_%d" % j)
+        for j in range(problem.num_random_effects):
+            gamma_without_j = gamma.copy()
+            gamma_without_j[j] = 0
+            self.assertTrue(np.isclose(scores_gamma[j], -oracle.gradient_gamma(beta, gamma_without_j)[j]),
+                            msg="Wrong score of gamma_%d" % j)
+        for mode in ("packed", "batched", "woodbury", "sufficient_statistics"):
+            self.assertTrue(allclose(LinearLMEOracle(problem, mode=mode).marginal_scores(beta, gamma),
+                                     (scores_beta, scores_gamma)), msg="%s: scores are different" % mode)
+        parallel_oracle = LinearLMEOracle(problem, n_jobs=2)
+        self.assertTrue(allclose(parallel_oracle.marginal_scores(beta, gamma), (scores_beta, scores_gamma)))
+        parallel_oracle.close()
+        return None
+
+    def test_conjugate_gradients_beta_solver(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 40, 5, 4, 5],
+                                                             features_labels=[3, 3, 1, 2, 1, 1],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        np.random.seed(42)
+        beta, tbeta = np.random.rand(2, problem.num_fixed_effects)
+        gamma = np.random.rand(problem.num_random_effects)
+        for mode in ("cholesky", "packed", "batched", "woodbury", "sufficient_statistics"):
+            for oracle_class, args in ((LinearLMEOracle, {}),
+                                       (LinearLMEOracleRegularized, {"lb": 0.3}),
+                                       (LinearLMEOracleW, {"lb": 0.3})):
+                direct_oracle = oracle_class(problem, mode=mode, **args)
+                cg_oracle = oracle_class(problem, mode=mode, beta_solver="cg", **args)
+                beta_args = (gamma,) if oracle_class is LinearLMEOracle else (gamma, tbeta)
+                self.assertTrue(allclose(cg_oracle.optimal_beta(*beta_args, beta=beta),
+                                         direct_oracle.optimal_beta(*beta_args, beta=beta)),
+                                msg="%s, %s: conjugate gradients found a different beta" % (mode,
+                                                                                         oracle_class.__name__))
+                # started from the solution, it is already there
+                iterations = cg_oracle.cg_iterations
+                cg_oracle.optimal_beta(*beta_args)
+                self.assertEqual(iterations, cg_oracle.cg_iterations)
+        parallel_oracle = LinearLMEOracleRegularized(problem, lb=0.3, n_jobs=2, beta_solver="cg")
+        self.assertTrue(allclose(parallel_oracle.optimal_beta(gamma, tbeta),
+                                 LinearLMEOracleRegularized(problem, lb=0.3).optimal_beta(gamma, tbeta)))
+        parallel_oracle.close()
+        # when conjugate gradients fail, the system is solved directly
+        failing_oracle = LinearLMEOracleW(problem, lb=0.3, beta_solver="cg", cg_tol=0)
+        with self.assertWarns(RuntimeWarning):
+            failing_beta = failing_oracle.optimal_beta(gamma, tbeta, beta=beta)
+        self.assertTrue(allclose(failing_beta, LinearLMEOracleW(problem, lb=0.3).optimal_beta(gamma, tbeta, beta=beta)))
+        indefinite_matrix = np.diag([1., -1.])
+        _, _, converged = _conjugate_gradient(indefinite_matrix.dot, np.zeros(2), np.ones(2), np.ones(2),
+                                              atol=1e-10, max_iter=10)
+        self.assertFalse(converged, msg="Conjugate gradients did not notice the negative curvature")
+        with self.assertRaises(ValueError):
+            LinearLMEOracle(problem, beta_solver="lsqr")
+        return None
+
+    def test_parallel_oracle_matches_serial_oracle(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[40, 5, 30, 20, 7, 9, 100, 3],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        trials = 10
+        rtol = 1e-10
+        atol = 1e-10
+        for mode in ("cholesky", "woodbury"):
+            serial_oracle = LinearLMEOracle(problem, mode=mode)
+            parallel_oracle = LinearLMEOracle(problem, mode=mode, n_jobs=3)
+            self.assertEqual(sorted(np.concatenate(parallel_oracle.shards)), list(range(problem.num_groups)),
+                             msg="%s: Shards do not cover all the groups" % mode)
+            np.random.seed(42)
+            for random_beta, random_gamma in zip(np.random.rand(trials, problem.num_fixed_effects),
+                                                 np.random.rand(trials, problem.num_random_effects)):
+                self.assertAlmostEqual(serial_oracle.loss(random_beta, random_gamma),
+                                       parallel_oracle.loss(random_beta, random_gamma),
+                                       delta=atol, msg="%s: Loss of parallel oracle is different" % mode)
+                self.assertTrue(allclose(serial_oracle.gradient_gamma(random_beta, random_gamma),
+                                         parallel_oracle.gradient_gamma(random_beta, random_gamma),
+                                         rtol=rtol, atol=atol),
+                                msg="%s: Gradient of parallel oracle is different" % mode)
+                self.assertTrue(allclose(serial_oracle.hessian_gamma(random_beta, random_gamma),
+                                         parallel_oracle.hessian_gamma(random_beta, random_gamma),
+                                         rtol=rtol, atol=atol),
+                                msg="%s: Hessian of parallel oracle is different" % mode)
+                self.assertTrue(allclose(serial_oracle.optimal_beta(random_gamma),
+                                         parallel_oracle.optimal_beta(random_gamma),
+                                         rtol=rtol, atol=atol),
+                                msg="%s: Optimal beta of parallel oracle is different" % mode)
+                self.assertTrue(allclose(serial_oracle.optimal_random_effects(random_beta, random_gamma),
+                                         parallel_oracle.optimal_random_effects(random_beta, random_gamma),
+                                         rtol=rtol, atol=atol),
+                                msg="%s: Optimal random effects of parallel oracle are different" % mode)
+            parallel_oracle.close()
+            self.assertEqual(len(parallel_oracle.workers), 0, msg="Workers were not stopped")
+        return None
+
+    def test_number_of_jobs(self):
+        problem, true_parameters = LinearLMEProblem.generate(groups_sizes=[40, 5, 30, 20, 7, 9, 100, 3],
+                                                             features_labels=[3, 3, 1, 2],
+                                                             random_intercept=True,
+                                                             obs_std=0.1,
+                                                             seed=42)
+        # negative numbers count from the number of processors, but never go below one
+        self.assertEqual(LinearLMEOracle(problem, n_jobs=-1).n_jobs, min(os.cpu_count(), problem.num_groups))
+        self.assertEqual(LinearLMEOracle(problem, n_jobs=-1000).n_jobs, 1)
+        with self.assertRaises(ValueError):
+            LinearLMEOracle(problem, n_jobs=0)
+        return None
+
     def test_gamma_derivatives(self):
         trials = 5
         rtol = 1e-3
@@ -63,3 +63,105 @@ class TestLinearLMEOracleW(TestCase):
         w_gamma = oracle.drop_penalties_gamma
         self.assertTrue((w_gamma[1:] == 0).all(), msg="Drop of zero gamma is not zero")
         self.assertTrue((w_beta[2:] == 0).all(), msg="Drop of zero beta is not zero")
+
+    def test_drop_matrices_in_other_modes(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20, 5, 10, 50, 5, 20, 5],
+                                               features_labels=[1, 2, 3, 3],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        cholesky_oracle = LinearLMEOracleW(problem, lb=0, lg=0,
+                                           nnz_tbeta=problem.num_fixed_effects,
+                                           nnz_tgamma=problem.num_random_effects)
+        trials = 20
+        rtol = 1e-8
+        atol = 1e-8
+        for mode in ("packed", "batched", "woodbury", "sufficient_statistics"):
+            other_oracle = LinearLMEOracleW(problem, lb=0, lg=0,
+                                               nnz_tbeta=problem.num_fixed_effects,
+                                               nnz_tgamma=problem.num_random_effects,
+                                               mode=mode)
+            np.random.seed(42)
+            for random_beta, random_gamma in zip(np.random.rand(trials, problem.num_fixed_effects),
+                                                 np.random.rand(trials, problem.num_random_effects)):
+                cholesky_oracle._recalculate_drop_matrices(random_beta, random_gamma)
+                other_oracle._recalculate_drop_matrices(random_beta, random_gamma)
+                self.assertTrue(allclose(cholesky_oracle.drop_penalties_beta, other_oracle.drop_penalties_beta,
+                                         rtol=rtol, atol=atol),
+                                msg="%s: W_beta does not match with Cholesky mode" % mode)
+                self.assertTrue(allclose(cholesky_oracle.drop_penalties_gamma, other_oracle.drop_penalties_gamma,
+                                         rtol=rtol, atol=atol),
+                                msg="%s: W_gamma does not match with Cholesky mode" % mode)
+
+    def test_drop_matrices_parallel(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20, 5, 10, 50, 5, 20, 5],
+                                               features_labels=[1, 2, 3, 3],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        serial_oracle = LinearLMEOracleW(problem, lb=0, lg=0,
+                                         nnz_tbeta=problem.num_fixed_effects,
+                                         nnz_tgamma=problem.num_random_effects)
+        parallel_oracle = LinearLMEOracleW(problem, lb=0, lg=0,
+                                           nnz_tbeta=problem.num_fixed_effects,
+                                           nnz_tgamma=problem.num_random_effects,
+                                           n_jobs=2)
+        np.random.seed(42)
+        random_beta = np.random.rand(problem.num_fixed_effects)
+        random_gamma = np.random.rand(problem.num_random_effects)
+        serial_oracle._recalculate_drop_matrices(random_beta, random_gamma)
+        parallel_oracle._recalculate_drop_matrices(random_beta, random_gamma)
+        self.assertTrue(allclose(serial_oracle.drop_penalties_beta, parallel_oracle.drop_penalties_beta),
+                        msg="W_beta of parallel oracle is different")
+        self.assertTrue(allclose(serial_oracle.drop_penalties_gamma, parallel_oracle.drop_penalties_gamma),
+                        msg="W_gamma of parallel oracle is different")
+        parallel_oracle.close()
+
+    def test_whitened_blocks_are_computed_once_per_gamma(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20, 5, 10, 50, 5, 20, 5],
+                                               features_labels=[1, 2, 3, 3],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        np.random.seed(42)
+        beta = np.random.rand(problem.num_fixed_effects)
+        gammas = np.random.rand(2, problem.num_random_effects)
+        for mode in ("cholesky", "packed", "batched"):
+            oracle = LinearLMEOracleW(problem, lb=0, lg=0,
+                                      nnz_tbeta=problem.num_fixed_effects,
+                                      nnz_tgamma=problem.num_random_effects,
+                                      mode=mode)
+            # second pass over the same gammas takes the blocks from the cache of factors
+            for expected_count, gamma in zip([1, 2, 2, 2], [gammas[0], gammas[1], gammas[0], gammas[1]]):
+                oracle.loss(beta, gamma, tbeta=beta, tgamma=gamma)
+                oracle.gradient_gamma(beta, gamma, tgamma=gamma)
+                oracle.hessian_gamma(beta, gamma)
+                oracle.optimal_beta(gamma, tbeta=beta, beta=beta)
+                oracle._recalculate_drop_matrices(beta + 1, gamma)
+                self.assertEqual(oracle.whitening_count, expected_count,
+                                 msg="%s: whitened blocks were recomputed for the same gamma" % mode)
+
+    def test_drop_matrices_follow_gamma(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20, 5, 10, 50, 5, 20, 5],
+                                               features_labels=[1, 2, 3, 3],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        np.random.seed(42)
+        beta = np.random.rand(problem.num_fixed_effects)
+        gammas = np.random.rand(2, problem.num_random_effects)
+        oracle = LinearLMEOracleW(problem, lb=1, lg=1)
+        reference_oracle = LinearLMEOracleW(problem, lb=1, lg=1)
+        oracle._recalculate_drop_matrices(beta, gammas[0])
+        # the loss at another gamma changes the factors, but not the point which the penalties were computed at
+        oracle.loss(beta, gammas[1], tbeta=beta, tgamma=gammas[1])
+        oracle._recalculate_drop_matrices(beta, gammas[1])
+        reference_oracle._recalculate_drop_matrices(beta, gammas[1])
+        self.assertTrue((oracle.drop_penalties_beta == reference_oracle.drop_penalties_beta).all(),
+                        msg="W_beta was not recalculated for the new gamma")
+        self.assertTrue((oracle.drop_penalties_gamma == reference_oracle.drop_penalties_gamma).all(),
+                        msg="W_gamma was not recalculated for the new gamma")
+
+
+if __name__ == '__main__':
+    unittest.main()
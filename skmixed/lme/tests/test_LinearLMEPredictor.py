@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+import skmixed
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.predictor import LinearLMEPredictor
+from skmixed.lme.problems import LinearLMEProblem
+
+
+class TestLinearLMEPredictor(unittest.TestCase):
+
+    def test_exported_predictor_matches_model(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20, 5, 10, 50, 7, 12],
+                                               features_labels=[3, 3, 1, 2],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        x, y = problem.to_x_y()
+        model = LinearLMESparseModel(nnz_tbeta=3, nnz_tgamma=2, lb=1, lg=1, n_iter=10, n_iter_inner=10)
+        model.fit(x, y)
+        # one unseen group and shuffled rows
+        data = x[1:].copy()
+        data[data[:, -1] == 2, -1] = 100
+        np.random.seed(42)
+        data = data[np.random.permutation(data.shape[0])]
+        with tempfile.TemporaryDirectory() as path:
+            for use_sparse_coefficients in (False, True):
+                file_name = os.path.join(path, "predictor.npz")
+                model.export(file_name, use_sparse_coefficients=use_sparse_coefficients)
+                predictor = LinearLMEPredictor.load(file_name)
+                y_model = model.predict(np.concatenate((x[:1], data)),
+                                        use_sparse_coefficients=use_sparse_coefficients)
+                self.assertTrue(np.allclose(predictor.predict(data), y_model))
+                self.assertTrue(np.allclose(predictor.predict(data, validate=False), y_model))
+            with self.assertRaises(ValueError):
+                predictor.predict(data[:, 1:])
+            with np.load(file_name) as saved:
+                arrays = dict(saved)
+            arrays["format_version"] = 100
+            np.savez(file_name, **arrays)
+            with self.assertRaises(ValueError):
+                LinearLMEPredictor.load(file_name)
+
+    def test_predictor_imports_only_numpy(self):
+        code = "import sys; import skmixed.lme.predictor; print('sklearn' in sys.modules or 'scipy' in sys.modules)"
+        root = os.path.dirname(os.path.dirname(skmixed.__file__))
+        output = subprocess.check_output([sys.executable, "-c", code], env=dict(os.environ, PYTHONPATH=root))
+        self.assertEqual(output.strip(), b"False", msg="The predictor should not import sklearn or scipy")
+
+
+if __name__ == '__main__':
+    unittest.main()
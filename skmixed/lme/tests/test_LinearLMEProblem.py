@@ -1,7 +1,10 @@
+import os
+import tempfile
 import unittest
 
 import numpy as np
 
+from skmixed.lme.oracles import LinearLMEOracle
 from skmixed.lme.problems import LinearLMEProblem
 
 
@@ -58,6 +61,213 @@ class TestLinearLMEProblem(unittest.TestCase):
         self.assertTrue(np.all(x2 == x), msg="x is not the same after from/to transformation")
         self.assertTrue(np.all(y2 == y), msg="y is not the same after from/to transformation")
 
+    def test_from_x_y_groups_shuffled_objects(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 1, 7],
+                                               features_labels=[3, 3, 1, 2],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        x, y = problem.to_x_y()
+        column_labels = list(x[0, :].astype(int))
+        sorted_problem, _ = LinearLMEProblem.from_x_y(x[1:], y, column_labels)
+        self.assertTrue(np.all(sorted_problem.order_of_objects == np.arange(len(y))))
+        self.assertTrue(np.shares_memory(sorted_problem.obs_stds[1], x),
+                        msg="Sorted input should not be copied")
+        np.random.seed(42)
+        permutation = np.random.permutation(len(y))
+        shuffled_problem, _ = LinearLMEProblem.from_x_y(x[1:][permutation], y[permutation], column_labels)
+        self.assertTrue(np.all(shuffled_problem.group_labels == sorted_problem.group_labels))
+        self.assertEqual(shuffled_problem.groups_sizes, sorted_problem.groups_sizes)
+        self.assertTrue(np.all(np.concatenate(shuffled_problem.answers)
+                               == y[permutation][shuffled_problem.order_of_objects]),
+                        msg="order_of_objects does not point to the positions of the objects in the input")
+        original_positions = np.split(permutation[shuffled_problem.order_of_objects],
+                                      np.cumsum(shuffled_problem.groups_sizes)[:-1])
+        for (x1, y1, z1, stds1), (x2, y2, z2, stds2), positions in zip(shuffled_problem, sorted_problem,
+                                                                       original_positions):
+            # stable sort keeps the objects of a group in the order they came in
+            self.assertTrue(np.all(np.diff(np.argsort(permutation)[positions]) > 0))
+            order = np.argsort(positions)
+            self.assertTrue(np.all(x1[order] == x2) and np.all(y1[order] == y2) and np.all(z1[order] == z2)
+                            and np.all(stds1[order] == stds2), msg="Groups are different for shuffled input")
+
+    def test_packed_storage(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 1, 7],
+                                               features_labels=[3, 3, 1, 2],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        self.assertEqual(problem.group_offsets.dtype, np.int64)
+        self.assertTrue(np.all(problem.group_offsets == [0, 4, 9, 19, 20, 27]))
+        self.assertEqual(problem.fixed_features_packed.shape, (27, problem.num_fixed_effects))
+        packed = (problem.fixed_features_packed, problem.answers_packed, problem.random_features_packed,
+                  problem.obs_stds_packed)
+        for group in problem:
+            for group_data, packed_data in zip(group, packed):
+                self.assertTrue(np.shares_memory(group_data, packed_data), msg="Groups should be views")
+        groups_idx = [3, 0, 2]
+        subproblem = problem.take_groups(groups_idx)
+        self.assertEqual(subproblem.groups_sizes, [1, 4, 10])
+        self.assertTrue(np.all(subproblem.group_labels == problem.group_labels[groups_idx]))
+        for (x1, y1, z1, stds1), i in zip(subproblem, groups_idx):
+            x2, y2, z2, stds2 = problem.fixed_features[i], problem.answers[i], problem.random_features[i], \
+                                problem.obs_stds[i]
+            self.assertTrue(np.all(x1 == x2) and np.all(y1 == y2) and np.all(z1 == z2) and np.all(stds1 == stds2))
+        # assigned groups should match the groups of the problem
+        self.assertRaises(ValueError, lambda: setattr(problem, "answers", [y[:2] for y in problem.answers]))
+        self.assertRaises(ValueError, lambda: setattr(problem, "obs_stds", problem.obs_stds[1:]))
+        problem.fixed_features = [2 * x for x in problem.fixed_features]
+        self.assertTrue(np.all(problem.fixed_features_packed == 2 * packed[0]))
+        problem.answers = None
+        self.assertTrue(all(y is None for x, y, z, stds in problem))
+
+    def test_save_and_load(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 1, 7],
+                                               features_labels=[3, 3, 1, 2],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        x, y = problem.to_x_y()
+        problem, _ = LinearLMEProblem.from_x_y(x, y)
+        np.random.seed(42)
+        beta = np.random.rand(problem.num_fixed_effects)
+        gamma = np.random.rand(problem.num_random_effects)
+        with tempfile.TemporaryDirectory() as path:
+            problem.save(path)
+            for mmap in (True, False):
+                loaded_problem = LinearLMEProblem.load(path, mmap=mmap)
+                self.assertEqual(isinstance(loaded_problem.fixed_features_packed, np.memmap), mmap)
+                self.assertEqual(loaded_problem.groups_sizes, problem.groups_sizes)
+                self.assertTrue(np.all(loaded_problem.group_labels == problem.group_labels))
+                self.assertTrue(np.all(loaded_problem.column_labels == problem.column_labels))
+                self.assertTrue(np.all(loaded_problem.order_of_objects == problem.order_of_objects))
+                for group, loaded_group in zip(problem, loaded_problem):
+                    self.assertTrue(all(np.all(a == b) for a, b in zip(group, loaded_group)))
+                self.assertEqual(LinearLMEOracle(loaded_problem).loss(beta, gamma),
+                                 LinearLMEOracle(problem).loss(beta, gamma))
+                del loaded_problem
+            problem.answers = None
+            problem.save(path)
+            self.assertIsNone(LinearLMEProblem.load(path).answers)
+
+    def test_from_chunks(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[4, 5, 10, 1, 7],
+                                               features_labels=[3, 3, 1, 2],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        x, y = problem.to_x_y()
+        column_labels = list(x[0, :].astype(int))
+        np.random.seed(42)
+        permutation = np.random.permutation(len(y))
+        x, y = x[1:][permutation], y[permutation]
+        chunks_borders = [0, 3, 4, 13, 20, 27]
+        chunks = [(x[start:end], y[start:end]) for start, end in zip(chunks_borders[:-1], chunks_borders[1:])]
+        problem, _ = LinearLMEProblem.from_x_y(x, y, column_labels)
+        with tempfile.TemporaryDirectory() as path:
+            for chunks_problem in (LinearLMEProblem.from_chunks(iter(chunks), column_labels),
+                                   LinearLMEProblem.from_chunks(iter(chunks), column_labels, path=path)):
+                self.assertEqual(chunks_problem.groups_sizes, problem.groups_sizes)
+                self.assertTrue(np.all(chunks_problem.group_labels == problem.group_labels))
+                self.assertTrue(np.all(chunks_problem.column_labels == problem.column_labels))
+                self.assertTrue(np.all(chunks_problem.order_of_objects == problem.order_of_objects))
+                for group, chunks_group in zip(problem, chunks_problem):
+                    self.assertTrue(all(np.all(a == b) for a, b in zip(group, chunks_group)))
+            self.assertEqual(sorted(os.listdir(path)), sorted(name + ".npy" for name in (
+                "group_offsets", "group_labels", "column_labels", "order_of_objects", "fixed_features",
+                "random_features", "obs_stds", "answers")), msg="Spill files should be removed")
+            del chunks_problem
+            # the directory is created when it does not exist yet
+            new_path = os.path.join(path, "new", "directory")
+            new_path_problem = LinearLMEProblem.from_chunks(iter(chunks), column_labels, path=new_path)
+            self.assertEqual(new_path_problem.groups_sizes, problem.groups_sizes)
+            self.assertTrue(os.path.isdir(new_path))
+            del new_path_problem
+        statistics_problem = LinearLMEProblem.from_chunks(iter(chunks), column_labels, sufficient_statistics=True)
+        self.assertEqual(statistics_problem.groups_sizes, problem.groups_sizes)
+        with self.assertRaises(ValueError):
+            LinearLMEOracle(statistics_problem)
+        oracle = LinearLMEOracle(problem, mode="sufficient_statistics")
+        statistics_oracle = LinearLMEOracle(statistics_problem, mode="sufficient_statistics")
+        beta = np.random.rand(problem.num_fixed_effects)
+        gamma = np.random.rand(problem.num_random_effects)
+        self.assertTrue(np.isclose(oracle.loss(beta, gamma), statistics_oracle.loss(beta, gamma)))
+        self.assertTrue(np.allclose(oracle.gradient_gamma(beta, gamma), statistics_oracle.gradient_gamma(beta, gamma)))
+        self.assertTrue(np.allclose(oracle.optimal_beta(gamma), statistics_oracle.optimal_beta(gamma)))
+        self.assertTrue(np.allclose(oracle.optimal_random_effects(beta, gamma),
+                                    statistics_oracle.optimal_random_effects(beta, gamma)))
+        # a problem of only sufficient statistics is saved and loaded too
+        with tempfile.TemporaryDirectory() as path:
+            statistics_problem.save(path)
+            for mmap in (True, False):
+                loaded_problem = LinearLMEProblem.load(path, mmap=mmap)
+                self.assertIsNone(loaded_problem.fixed_features_packed)
+                self.assertIsNone(loaded_problem.order_of_objects)
+                self.assertEqual(loaded_problem.groups_sizes, problem.groups_sizes)
+                loaded_oracle = LinearLMEOracle(loaded_problem, mode="sufficient_statistics")
+                self.assertEqual(loaded_oracle.loss(beta, gamma), statistics_oracle.loss(beta, gamma))
+                self.assertTrue(np.all(loaded_oracle.optimal_beta(gamma) == statistics_oracle.optimal_beta(gamma)))
+                del loaded_problem, loaded_oracle
+
+    def test_generate_batched(self):
+        groups_sizes = [30, 1, 200, 50, 7, 120]
+        parameters = {"groups_sizes": groups_sizes,
+                      "features_labels": [3, 3, 1, 2],
+                      "random_intercept": True,
+                      "features_covariance_matrix": np.array([[1, 0.5, 0, 0],
+                                                              [0.5, 1, 0, 0],
+                                                              [0, 0, 1, 0],
+                                                              [0, 0, 0, 1]]),
+                      "obs_std": 0.1,
+                      "random_state": 42,
+                      "batch_size": 100}
+        np.random.seed(42)
+        global_state = np.random.get_state()[1].copy()
+        problem, true_parameters = LinearLMEProblem.generate_batched(**parameters)
+        self.assertTrue(np.all(np.random.get_state()[1] == global_state), msg="Global random state has changed")
+        self.assertEqual(problem.groups_sizes, groups_sizes)
+        self.assertEqual(true_parameters["random_effects"].shape, (len(groups_sizes), problem.num_random_effects))
+        residuals = [y - x.dot(true_parameters["beta"]) - z.dot(u)
+                     for (x, y, z, stds), u in zip(problem, true_parameters["random_effects"])]
+        self.assertTrue(np.isclose(np.std(np.concatenate(residuals)), 0.1, rtol=0.1))
+        self.assertTrue(np.isclose(np.corrcoef(problem.fixed_features_packed[:, 1:3].T)[0, 1], 0.5, atol=0.1))
+        same_problem, _ = LinearLMEProblem.generate_batched(**parameters)
+        stream, _ = LinearLMEProblem.generate_batched(**parameters, mode="stream")
+        streamed_problem = LinearLMEProblem.from_chunks(stream, [3, 3, 1, 2, 4, 0])
+        with tempfile.TemporaryDirectory() as path:
+            disk_problem, _ = LinearLMEProblem.generate_batched(**parameters, mode="disk", path=path)
+            for other_problem in (same_problem, streamed_problem, disk_problem):
+                self.assertTrue(np.all(other_problem.group_labels == problem.group_labels))
+                for group, other_group in zip(problem, other_problem):
+                    self.assertTrue(all(np.all(a == b) for a, b in zip(group, other_group)))
+            del disk_problem, other_problem
+
+    def test_take_columns(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[4, 6, 9],
+                                               features_labels=[3, 1, 2, 3, 3],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        problem.compute_sufficient_statistics()
+        fixed_idx, random_idx = np.array([0, 2, 3]), np.array([1, 3])
+        reduced_problem = problem.take_columns(fixed_idx, random_idx)
+        self.assertEqual(reduced_problem.column_labels, [1, 2, 1, 3, 4, 0])
+        self.assertEqual(reduced_problem.num_fixed_effects, 3)
+        self.assertEqual(reduced_problem.num_random_effects, 2)
+        np.random.seed(42)
+        beta = np.zeros(problem.num_fixed_effects)
+        beta[fixed_idx] = np.random.rand(len(fixed_idx))
+        gamma = np.zeros(problem.num_random_effects)
+        gamma[random_idx] = np.random.rand(len(random_idx))
+        for mode in ("cholesky", "woodbury", "sufficient_statistics"):
+            oracle = LinearLMEOracle(problem, mode=mode)
+            reduced_oracle = LinearLMEOracle(reduced_problem, mode=mode)
+            self.assertTrue(np.isclose(oracle.loss(beta, gamma),
+                                       reduced_oracle.loss(beta[fixed_idx], gamma[random_idx])),
+                            msg="%s: the reduced problem is not the one with the other coefficients at zero" % mode)
+        with self.assertRaises(ValueError):
+            problem.take_columns(np.array([1, 2]), np.array([1]))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -276,5 +276,194 @@ class TestLinearLMESparseModel(unittest.TestCase):
         assert abs(bad_score) < 0.1
 
 
+    def test_parallel_fit(self):
+        problem_parameters = {
+            "groups_sizes": [20, 5, 10, 50, 7, 12],
+            "features_labels": [3, 3, 3],
+            "random_intercept": True,
+            "obs_std": 0.1,
+        }
+        model_parameters = {
+            "nnz_tbeta": 3,
+            "nnz_tgamma": 2,
+            "lb": 20,
+            "lg": 20,
+            "logger_keys": ('converged',),
+            "tol": 1e-6,
+            "n_iter": 1000,
+            "tol_inner": 1e-4,
+            "n_iter_inner": 1000,
+        }
+        problem, true_model_parameters = LinearLMEProblem.generate(**problem_parameters, seed=42)
+        x, y = problem.to_x_y()
+        # We check only the l2-regularized model: the loss-weighted one is sensitive to round-off errors,
+        # which are different when the groups are summed up in a different order.
+        serial_model = LinearLMESparseModel(**model_parameters)
+        serial_model.fit(x, y)
+        parallel_model = LinearLMESparseModel(**model_parameters, n_jobs=2)
+        parallel_model.fit(x, y)
+        for key in ("beta", "gamma", "tbeta", "tgamma"):
+            self.assertTrue(np.allclose(serial_model.coef_[key], parallel_model.coef_[key], rtol=1e-5, atol=1e-5),
+                            msg="%s of the parallel model is different" % key)
+        self.assertTrue(np.allclose(serial_model.predict(x), parallel_model.predict(x), rtol=1e-5, atol=1e-5),
+                        msg="Prediction of the parallel model is different")
+
+    def test_predict_keeps_order_of_rows(self):
+        problem_parameters = {
+            "groups_sizes": [20, 5, 10, 50, 7, 12],
+            "features_labels": [3, 3, 1],
+            "random_intercept": True,
+            "obs_std": 0.1,
+        }
+        problem, _ = LinearLMEProblem.generate(**problem_parameters, seed=42)
+        x, y = problem.to_x_y()
+        model = LinearLMESparseModel(nnz_tbeta=3, nnz_tgamma=3, lb=0, lg=0, n_iter=10, n_iter_inner=10)
+        model.fit(x, y)
+        beta = model.coef_["beta"]
+        us = model.coef_["random_effects"]
+        # relabel one group as an unseen one and shuffle the rows
+        column_labels = x[:1]
+        data = x[1:].copy()
+        data[data[:, -1] == 2, -1] = 100
+        np.random.seed(42)
+        data = data[np.random.permutation(data.shape[0])]
+        y_pred = model.predict(np.concatenate((column_labels, data)))
+        for row, prediction in zip(data, y_pred):
+            fixed_features = np.concatenate(([1], row[:3]))
+            random_features = np.concatenate(([1], row[:2]))
+            label = int(row[-1])
+            expected = fixed_features.dot(beta) + (random_features.dot(us[label]) if label < 100 else 0)
+            self.assertTrue(np.isclose(prediction, expected), msg="Prediction is not in the order of rows")
+
+    def test_second_order_solvers(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20, 5, 10, 50],
+                                               features_labels=[3, 3, 3],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        x, y = problem.to_x_y()
+        model_parameters = {"nnz_tbeta": 2, "nnz_tgamma": 2, "lb": 1, "lg": 1, "tol": 1e-6, "n_iter": 1000,
+                            "tol_inner": 1e-4, "n_iter_inner": 1000}
+        losses = {}
+        for solver in ("pgd", "newton", "lbfgsb"):
+            model = LinearLMESparseModel(solver=solver, **model_parameters)
+            model.fit(x, y)
+            self.assertTrue(np.all(model.coef_["gamma"] >= 0), msg="%s: gamma is not feasible" % solver)
+            oracle = model._make_oracle(problem)
+            losses[solver] = oracle.loss(model.coef_["beta"], model.coef_["gamma"], model.coef_["tbeta"],
+                                         model.coef_["tgamma"])
+        for solver in ("newton", "lbfgsb"):
+            self.assertLessEqual(losses[solver], losses["pgd"] + 1e-6, msg="%s: loss is worse than PGD's" % solver)
+        with self.assertRaises(ValueError):
+            LinearLMESparseModel(solver="sgd").fit(x, y)
+
+    def test_low_rank_updates(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[100, 60, 80, 120],
+                                               features_labels=[3, 3, 3],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        x, y = problem.to_x_y()
+        model_parameters = {"nnz_tbeta": 2, "nnz_tgamma": 2, "lb": 1, "lg": 1, "tol": 1e-6, "n_iter": 1000}
+        model = LinearLMESparseModel(**model_parameters).fit(x, y)
+        low_rank_model = LinearLMESparseModel(max_low_rank_updates=1000, **model_parameters)
+        # keep the oracle of the fit to look at its counters
+        oracles = []
+        make_oracle = low_rank_model._make_oracle
+        low_rank_model._make_oracle = lambda problem: oracles.append(make_oracle(problem)) or oracles[-1]
+        low_rank_model.fit(x, y)
+        self.assertGreater(oracles[0].low_rank_updates, 0, msg="The factors were never updated")
+        for key in ("beta", "gamma", "tbeta", "tgamma"):
+            self.assertTrue(np.allclose(low_rank_model.coef_[key], model.coef_[key], atol=1e-8),
+                            msg="%s is different with low-rank updates" % key)
+
+    def test_active_set(self):
+        num_features = 40
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20] * 20,
+                                               features_labels=[3] * 6 + [1] * (num_features - 6),
+                                               random_intercept=True,
+                                               obs_std=0.3,
+                                               beta=np.r_[np.linspace(1, 0.1, 12), np.zeros(num_features - 11)],
+                                               gamma=np.r_[np.ones(3), np.zeros(4)],
+                                               seed=0)
+        x, y = problem.to_x_y()
+        model_parameters = {"nnz_tbeta": 4, "nnz_tgamma": 2, "lb": 100, "lg": 100, "tol": 1e-6, "n_iter": 200,
+                            "solver": "newton", "logger_keys": ("converged", "working_set_size")}
+        model = LinearLMESparseModel(**model_parameters).fit(x, y)
+        active_set_model = LinearLMESparseModel(active_set=True, **model_parameters).fit(x, y)
+        working_set_sizes = [size for size in active_set_model.logger_.get("working_set_size") if size is not None]
+        self.assertTrue(0 < len(working_set_sizes) and max(working_set_sizes) < num_features,
+                        msg="The problem was not reduced")
+        for key in ("beta", "gamma", "tbeta", "tgamma", "random_effects"):
+            self.assertEqual(active_set_model.coef_[key].shape, model.coef_[key].shape)
+        self.assertTrue(np.all(active_set_model.coef_["tbeta"].nonzero()[0] == model.coef_["tbeta"].nonzero()[0]))
+        self.assertTrue(np.all(active_set_model.coef_["tgamma"].nonzero()[0] == model.coef_["tgamma"].nonzero()[0]))
+
+    def test_screening(self):
+        num_features = 60
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20] * 20,
+                                               features_labels=[3] * 6 + [1] * (num_features - 6),
+                                               random_intercept=True,
+                                               obs_std=0.3,
+                                               beta=np.r_[np.linspace(1, 0.1, 12), np.zeros(num_features - 11)],
+                                               gamma=np.r_[np.ones(3), np.zeros(4)],
+                                               seed=0)
+        x, y = problem.to_x_y()
+        model_parameters = {"nnz_tbeta": 4, "nnz_tgamma": 2, "lb": 1, "lg": 1, "tol": 1e-6, "n_iter": 200}
+        model = LinearLMESparseModel(**model_parameters).fit(x, y)
+        for screening_size, refits in ((20, 0), (4, 1)):
+            screened_model = LinearLMESparseModel(screening_size=screening_size, **model_parameters).fit(x, y)
+            self.assertGreater(screened_model.logger_.get("screened_fraction"), 0.5)
+            # with exactly as many columns as the support, the fit fails the check against the full problem,
+            # which re-admits more columns, and the model gets re-fitted
+            self.assertEqual(screened_model.logger_.get("screening_refits"), refits)
+            for key in ("beta", "gamma", "tbeta", "tgamma", "random_effects"):
+                self.assertEqual(screened_model.coef_[key].shape, model.coef_[key].shape)
+            self.assertEqual(np.count_nonzero(screened_model.coef_["tbeta"]), 4)
+        self.assertTrue(np.all(screened_model.coef_["tbeta"].nonzero()[0] == model.coef_["tbeta"].nonzero()[0]))
+        for screening_size in (3, problem.num_fixed_effects + 1):
+            with self.assertRaises(ValueError):
+                LinearLMESparseModel(screening_size=screening_size, **model_parameters).fit(x, y)
+
+    def test_screening_readmits_wrongly_screened_columns(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20, 5, 10, 50, 7, 12],
+                                               features_labels=[3, 3, 1, 2],
+                                               random_intercept=True,
+                                               seed=42)
+        x, y = problem.to_x_y()
+        model_parameters = {"regularization_type": "loss-weighted", "nnz_tbeta": 3, "nnz_tgamma": 2,
+                            "solver": "newton"}
+        model = LinearLMESparseModel(**model_parameters).fit(x, y)
+        # the third feature scores low at 𝛄 = 0, so it is screened out, but it belongs to the solution
+        screened_model = LinearLMESparseModel(screening_size=3, **model_parameters).fit(x, y)
+        self.assertEqual(screened_model.logger_.get("screening_refits"), 1)
+        self.assertTrue(np.all(screened_model.coef_["tbeta"].nonzero()[0] == model.coef_["tbeta"].nonzero()[0]))
+        losses = []
+        for fitted_model in (model, screened_model):
+            oracle = fitted_model._make_oracle(problem)
+            coefficients = fitted_model.coef_
+            oracle._recalculate_drop_matrices(coefficients["beta"], coefficients["gamma"])
+            losses.append(oracle.loss(coefficients["beta"], coefficients["gamma"], coefficients["tbeta"],
+                                      coefficients["tgamma"]))
+        self.assertAlmostEqual(losses[0], losses[1], delta=1e-2)
+
+    def test_conjugate_gradients_beta_solver(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20] * 20,
+                                               features_labels=[3] * 4 + [1] * 16,
+                                               random_intercept=True,
+                                               obs_std=0.3,
+                                               beta=np.r_[np.linspace(1, 0.1, 8), np.zeros(13)],
+                                               seed=0)
+        x, y = problem.to_x_y()
+        model_parameters = {"nnz_tbeta": 4, "nnz_tgamma": 2, "lb": 1, "lg": 1, "tol": 1e-6, "n_iter": 200}
+        for regularization_type in ("l2", "loss-weighted"):
+            model = LinearLMESparseModel(regularization_type=regularization_type, **model_parameters).fit(x, y)
+            cg_model = LinearLMESparseModel(regularization_type=regularization_type, beta_solver="cg",
+                                            **model_parameters).fit(x, y)
+            for key in ("beta", "gamma", "tbeta", "tgamma"):
+                self.assertTrue(np.allclose(cg_model.coef_[key], model.coef_[key], atol=1e-6),
+                                msg="%s: %s is different with conjugate gradients" % (regularization_type, key))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+
+from skmixed.lme.model_selection import LinearLMESparseModelCV, _group_k_fold
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.problems import LinearLMEProblem
+
+
+class TestLinearLMESparseModelCV(unittest.TestCase):
+
+    def test_group_k_fold(self):
+        groups_sizes = [20, 5, 10, 50, 7, 12, 30, 9]
+        folds = _group_k_fold(groups_sizes, 3)
+        test_groups = np.sort(np.concatenate([test_idx for train_idx, test_idx in folds]))
+        self.assertTrue(np.all(test_groups == np.arange(len(groups_sizes))), msg="Every group should be tested once")
+        for train_idx, test_idx in folds:
+            self.assertEqual(len(np.intersect1d(train_idx, test_idx)), 0)
+            self.assertEqual(len(train_idx) + len(test_idx), len(groups_sizes))
+        folds_sizes = [sum(groups_sizes[i] for i in test_idx) for train_idx, test_idx in folds]
+        self.assertLessEqual(max(folds_sizes) - min(folds_sizes), 20)
+        with self.assertRaises(ValueError):
+            _group_k_fold(groups_sizes, 9)
+
+    def test_cross_validation(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20, 5, 10, 50, 7, 12, 30, 9],
+                                               features_labels=[3, 3, 1, 2],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        x, y = problem.to_x_y()
+        estimator = LinearLMESparseModel(n_iter=10, n_iter_inner=10)
+        cv_parameters = {"lb": [0.1, 10], "lg": [1], "nnz_tbeta": [2, 4], "nnz_tgamma": [3], "cv": 3}
+        model = LinearLMESparseModelCV(estimator=estimator, **cv_parameters)
+        model.fit(x, y)
+        self.assertEqual(model.cv_results_["split_scores"].shape, (4, 3))
+        # a fold of one combination fitted by hand on the rows of the train groups
+        params = model.cv_results_["params"][1]
+        train_idx, test_idx = _group_k_fold(problem.groups_sizes, 3)[2]
+        labels = x[1:, -1]
+        train_rows = np.isin(labels, problem.group_labels[train_idx])
+        fold_model = LinearLMESparseModel(n_iter=10, n_iter_inner=10, **params)
+        fold_model.fit(np.concatenate((x[:1], x[1:][train_rows])), y[train_rows])
+        y_test = y[~train_rows]
+        y_pred = fold_model.predict(np.concatenate((x[:1], x[1:][~train_rows])))
+        score = 1 - ((y_test - y_pred) ** 2).sum() / ((y_test - y_test.mean()) ** 2).sum()
+        self.assertTrue(np.isclose(model.cv_results_["split_scores"][1, 2], score))
+        best = np.argmax(model.cv_results_["mean_test_score"])
+        self.assertEqual(model.best_params_, model.cv_results_["params"][best])
+        best_model = LinearLMESparseModel(n_iter=10, n_iter_inner=10, **model.best_params_).fit(x, y)
+        self.assertTrue(np.all(model.predict(x) == best_model.predict(x)))
+
+        parallel_model = LinearLMESparseModelCV(estimator=estimator, n_processes=2, **cv_parameters).fit(x, y)
+        # BLAS may sum in a different order in the worker processes
+        self.assertTrue(np.allclose(parallel_model.cv_results_["split_scores"], model.cv_results_["split_scores"],
+                                    rtol=0, atol=1e-12))
+        woodbury_estimator = LinearLMESparseModel(n_iter=10, n_iter_inner=10, oracle_mode="woodbury")
+        woodbury_model = LinearLMESparseModelCV(estimator=woodbury_estimator, **cv_parameters).fit(x, y)
+        self.assertTrue(np.allclose(woodbury_model.cv_results_["split_scores"], model.cv_results_["split_scores"],
+                                    atol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+
+from skmixed.lme.line_search import armijo_backtracking
+
+
+class TestLineSearch(unittest.TestCase):
+
+    def test_armijo_backtracking(self):
+        # φ(t) = (t - 0.3)^2, so φ(0) = 0.09 and φ'(0) = -0.6
+        calls = []
+
+        def function(t):
+            calls.append(t)
+            return (t - 0.3) ** 2
+
+        step_len, value, evaluations, num_calls = armijo_backtracking(function, value=0.09, slope=-0.6, step_len=1)
+        # the quadratic interpolation hits the minimizer right after the first trial
+        self.assertEqual((evaluations, num_calls), (2, 2))
+        self.assertEqual(calls, [1, step_len])
+        self.assertAlmostEqual(step_len, 0.3)
+        self.assertAlmostEqual(value, 0)
+
+        def batch_function(steps):
+            calls.append(steps)
+            return (steps - 0.3) ** 2
+
+        calls = []
+        step_len, value, evaluations, num_calls = armijo_backtracking(function, value=0.09, slope=-0.6, step_len=1,
+                                                                      batch_function=batch_function, batch_size=3)
+        self.assertEqual((step_len, evaluations, num_calls), (0.5, 3, 1))
+        self.assertAlmostEqual(value, 0.04)
+
+        # no step gives the required decrease: the search gives up once the linear model promises less than it
+        calls = []
+        step_len, value, evaluations, num_calls = armijo_backtracking(function, value=0.09, slope=-0.6, step_len=1,
+                                                                      min_decrease=1)
+        self.assertEqual((step_len, value, evaluations), (0, 0.09, 0))
+        step_len, value, evaluations, num_calls = armijo_backtracking(function, value=0.09, slope=-0.6, step_len=1,
+                                                                      min_decrease=0.1)
+        self.assertEqual((step_len, value), (0, 0.09))
+        self.assertTrue(0 < evaluations < 5)
+        # not a descent direction
+        self.assertEqual(armijo_backtracking(function, value=0.09, slope=0.6)[0], 0)
+        with self.assertRaises(ValueError):
+            armijo_backtracking(function, value=0.09, slope=-0.6, batch_function=batch_function, batch_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
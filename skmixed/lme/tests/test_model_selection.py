@@ -0,0 +1,41 @@
+import unittest
+
+import numpy as np
+
+from skmixed.lme.model_selection import sparsity_path
+from skmixed.lme.models import LinearLMESparseModel
+from skmixed.lme.problems import LinearLMEProblem
+
+
+class TestModelSelection(unittest.TestCase):
+
+    def test_sparsity_path(self):
+        problem, _ = LinearLMEProblem.generate(groups_sizes=[20, 5, 10, 50, 7, 12],
+                                               features_labels=[3, 3, 1, 2],
+                                               random_intercept=True,
+                                               obs_std=0.1,
+                                               seed=42)
+        x, y = problem.to_x_y()
+        model = LinearLMESparseModel(lb=1, lg=1, n_iter=20, n_iter_inner=20, initializer="EM")
+        path = sparsity_path(model, x, y, nnz_tbeta=[4, 2], nnz_tgamma=[1, 3])
+        self.assertTrue(np.all(path["nnz_tbeta"] == [4, 4, 2, 2]))
+        self.assertTrue(np.all(path["nnz_tgamma"] == [3, 1, 3, 1]))
+        self.assertTrue(np.all(np.count_nonzero(path["tbeta"], axis=1) <= path["nnz_tbeta"]))
+        self.assertTrue(np.all(np.count_nonzero(path["tgamma"], axis=1) <= path["nnz_tgamma"]))
+        # the first point of every branch starts from the same point as fit
+        for i in (0, 2):
+            model.set_params(nnz_tbeta=path["nnz_tbeta"][i], nnz_tgamma=path["nnz_tgamma"][i])
+            model.fit(x, y)
+            for key in ("beta", "gamma", "tbeta", "tgamma"):
+                self.assertTrue(np.all(model.coef_[key] == path[key][i]), msg="%d: %s is different from fit" % (i, key))
+        degrees_of_freedom = np.count_nonzero(path["tbeta"], axis=1) + np.count_nonzero(path["tgamma"], axis=1)
+        self.assertTrue(np.allclose(path["bic"] - path["aic"], (np.log(problem.num_obs) - 2) * degrees_of_freedom))
+        parallel_path = sparsity_path(model, x, y, nnz_tbeta=[4, 2], nnz_tgamma=[1, 3], n_processes=2)
+        for key, value in path.items():
+            self.assertTrue(np.all(parallel_path[key] == value), msg="%s of the parallel path is different" % key)
+        with self.assertRaises(ValueError):
+            sparsity_path(model, x, y, nnz_tbeta=[0])
+
+
+if __name__ == '__main__':
+    unittest.main()